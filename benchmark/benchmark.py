@@ -0,0 +1,643 @@
+""" Offline benchmarks for the pipeline and the dashboard queries. Replays StackExchange
+    pages recorded on disk, loads the scraped data into a throwaway database on a local
+    Postgres server and prints the timings as JSON, so runs can be compared.
+
+    python benchmark.py record   - saves the live listing and its question pages as fixtures
+    python benchmark.py run      - benchmarks against the fixtures, without the network
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from os import environ
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import psycopg2
+import requests as req
+from dotenv import load_dotenv
+from psycopg2 import sql
+from psycopg2.extensions import connection
+from requests.adapters import BaseAdapter
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path[:0] = [os.path.join(ROOT_DIR, "pipeline"), os.path.join(ROOT_DIR, "dashboard")]
+
+# pylint: disable=wrong-import-position
+import connect as dashboard_connect
+import crawl
+import fetch
+import id_cache
+import insert
+import metrics
+import migrate
+import records
+import rollup
+import scrape
+import sites
+
+FIXTURES_DIR = os.path.join(BENCHMARK_DIR, "fixtures")
+DEFAULT_DATA_PATH = os.path.join(ROOT_DIR, "pipeline", "data.json")
+TABLES = ["Author", "Tag", "Question", "Question_Tag_Assignment", "Answer", "Post_Snapshot"]
+LISTING_PAGE_SIZE = 50
+GENERATED_TIME = datetime(2024, 3, 6, 12)
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html itemscope itemtype="https://schema.org/QAPage" class="html__responsive">
+<head><title>Generated page - History Stack Exchange</title></head>
+<body class="question-page unified-theme">
+<header class="s-topbar ps-fixed t0 l0 js-top-bar">
+  <a href="/" class="s-topbar--logo">Home</a>
+</header>
+<div id="content" class="snippet-hidden">
+  <div id="mainbar" role="main">{body}</div>
+  <div id="sidebar" class="show-votes" role="complementary">
+    <div class="module sidebar-related"><h4 id="h-related">Related</h4></div>
+  </div>
+</div>
+<footer id="footer" class="site-footer js-footer" role="contentinfo"></footer>
+</body>
+</html>
+"""
+SUMMARY_TEMPLATE = """
+<div id="question-summary-{question_id}" class="s-post-summary    js-post-summary"
+     data-post-id="{question_id}" data-post-type-id="1">
+  <div class="s-post-summary--stats js-post-summary-stats">
+    <div class="s-post-summary--stats-item s-post-summary--stats-item__emphasized"
+         title="Score of {votes}">
+      <span class="s-post-summary--stats-item-number">{votes}</span>
+      <span class="s-post-summary--stats-item-unit">{votes_unit}</span>
+    </div>
+    <div class="s-post-summary--stats-item {answered}" title="{answer_count} {answers_unit}">
+      <span class="s-post-summary--stats-item-number">{answer_count}</span>
+      <span class="s-post-summary--stats-item-unit">{answers_unit}</span>
+    </div>
+    <div class="s-post-summary--stats-item " title="{views} views">
+      <span class="s-post-summary--stats-item-number">{views}</span>
+      <span class="s-post-summary--stats-item-unit">views</span>
+    </div>
+  </div>
+  <div class="s-post-summary--content">
+    <h3 class="s-post-summary--content-title">
+      <a href="{href}" class="s-link">{title}</a>
+    </h3>
+    <div class="s-post-summary--meta">
+      <div class="s-post-summary--meta-tags d-inline-block tags js-tags">
+        <ul class="ml0 list-ls-none js-post-tag-list-wrapper d-inline">{tags}</ul>
+      </div>
+      <div class="s-user-card s-user-card__minimal">
+        <div class="s-user-card--info">
+          <div class="s-user-card--link d-flex gs4">
+            <a href="/users/1/user" class="flex--item">{username}</a>
+          </div>
+        </div>
+        <time class="s-user-card--time">
+          asked <span title="{timestamp}" class="relativetime">{timestamp}</span>
+        </time>
+      </div>
+    </div>
+  </div>
+</div>"""
+TAG_TEMPLATE = """
+          <li class="d-inline mr4 js-post-tag-list-item"><a href="/questions/tagged/{tag}"
+              class="post-tag">{tag}</a></li>"""
+ANSWER_TEMPLATE = """
+<div id="answer-{answer_id}" class="answer js-answer" data-answerid="{answer_id}"
+     data-score="{vote_count}" itemprop="suggestedAnswer" itemscope
+     itemtype="https://schema.org/Answer">
+  <div class="post-layout">
+    <div class="votecell post-layout--left">
+      <div class="js-vote-count flex--item d-flex fd-column ai-center fw-bold fs-subheading py4"
+           itemprop="upvoteCount" data-value="{vote_count}">{vote_count}</div>
+    </div>
+    <div class="answercell post-layout--right">
+      <div class="s-prose js-post-body" itemprop="text">{answer}</div>
+      <div class="post-signature flex--item fl0">
+        <div class="user-info ">
+          <div class="user-action-time fl-grow1">
+            answered <span title="{timestamp}" class="relativetime">{timestamp}</span>
+          </div>
+          <div class="user-details" itemprop="author" itemscope
+               itemtype="https://schema.org/Person">
+            <a href="/users/1/user">{username}</a>
+            <span class="d-none" itemprop="name">{username}</span>
+          </div>
+        </div>
+      </div>
+    </div>
+  </div>
+</div>"""
+
+
+def get_round_trips() -> int:
+    """ Returns the statements, commits and rollbacks metrics.InstrumentedConnection
+        has recorded sending to the server so far. """
+
+    return sum(value for (name, _), value in metrics.get_state()["counters"].items()
+               if name == "db_round_trips_total")
+
+
+class ReplayAdapter(BaseAdapter):
+    """ Transport adapter answering requests with recorded pages instead of the network.
+        URLs that were not recorded get a 404. """
+
+    def __init__(self, fixtures_dir: str):
+        super().__init__()
+        self.pages_dir = os.path.join(fixtures_dir, "pages")
+        self.manifest = load_manifest(fixtures_dir)
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        response = req.Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = "utf-8"
+        response.headers["Content-Type"] = "text/html; charset=utf-8"
+
+        page = self.manifest.get(request.url)
+        if page is None:
+            response.status_code = 404
+            response._content = b""  # pylint: disable=protected-access
+        else:
+            response.status_code = 200
+            with open(os.path.join(self.pages_dir, page), "rb") as f:
+                response._content = f.read()  # pylint: disable=protected-access
+        return response
+
+    def close(self):
+        pass
+
+
+def load_manifest(fixtures_dir: str) -> dict:
+    """ Returns {url: page file} of the recorded pages, empty if none were recorded. """
+
+    try:
+        with open(os.path.join(fixtures_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def is_listing_url(url: str) -> bool:
+    """ Returns whether a URL is a questions listing page rather than a question page. """
+
+    return urlparse(url).path.rstrip("/") == "/questions"
+
+
+def to_json(value):
+    """ Returns value as it reads back from JSON, with times as strings. """
+
+    return json.loads(json.dumps(value, default=str))
+
+
+def record_fixtures(fixtures_dir: str, listing_pages: int):
+    """ Scrapes listing pages live, saving every fetched page, the manifest of their URLs
+        and the scraped data (in the shape of pipeline/data.json) as fixtures. """
+
+    environ["HTTP_CACHE_DIR"] = environ["ARCHIVE_DIR"] = ""
+    pages_dir = os.path.join(fixtures_dir, "pages")
+    os.makedirs(pages_dir, exist_ok=True)
+    manifest = {}
+
+    def save_page(response, *args, **kwargs):  # pylint: disable=unused-argument
+        page = f"{hashlib.sha256(response.request.url.encode('utf-8')).hexdigest()[:16]}.html"
+        fetch.write_file(os.path.join(pages_dir, page), response.content)
+        manifest[response.request.url] = page
+
+    fetch.get_session().hooks["response"].append(save_page)
+
+    data = []
+    with redirect_stdout(sys.stderr):
+        for page in range(1, listing_pages + 1):
+            data.extend(scrape.extract_stack_exchange_history_data(
+                url=crawl.get_listing_url(page)))
+
+    with open(os.path.join(fixtures_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    with open(os.path.join(fixtures_dir, "data.json"), "w", encoding="utf-8") as f:
+        json.dump(to_json([records.to_dict(question) for question in data]), f, indent=2)
+
+    logging.info("Recorded %s pages and %s questions.", len(manifest), len(data))
+
+
+def format_page_time(timestamp: datetime) -> str:
+    """ Returns time as StackExchange pages give it in relativetime titles. """
+
+    return timestamp.strftime("%Y-%m-%d %H:%M:%SZ")
+
+
+def render_summary(question: records.Question, href: str) -> str:
+    """ Returns listing page summary of a question, linking to href. """
+
+    return SUMMARY_TEMPLATE.format(
+        question_id=question.question_id, href=href, title=html.escape(question.title),
+        votes=question.votes, votes_unit="vote" if question.votes == 1 else "votes",
+        answer_count=question.answer_count,
+        answers_unit="answer" if question.answer_count == 1 else "answers",
+        answered="has-answers" if question.answer_count else "", views=question.views,
+        tags="".join(TAG_TEMPLATE.format(tag=html.escape(tag)) for tag in question.tags),
+        username=html.escape(question.username),
+        timestamp=format_page_time(question.timestamp))
+
+
+def render_answer(answer: records.Answer) -> str:
+    """ Returns question page block of an answer. """
+
+    return ANSWER_TEMPLATE.format(
+        answer_id=answer.answer_id, vote_count=answer.vote_count,
+        answer=html.escape(answer.answer), username=html.escape(answer.username),
+        timestamp=format_page_time(answer.timestamp))
+
+
+def generate_fixtures(fixtures_dir: str, data_path: str):
+    """ Writes listing pages of the questions in a data.json style file and a page of
+        each question's answers, in the markup the scraper reads, with their manifest
+        and the data they scrape to, for benchmarking without recorded pages. Questions
+        are listed on the default site, and times the file lacks are filled in counting
+        back from GENERATED_TIME. """
+
+    pages_dir = os.path.join(fixtures_dir, "pages")
+    os.makedirs(pages_dir, exist_ok=True)
+    manifest = {}
+
+    def save_page(url: str, body: str):
+        page = f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]}.html"
+        fetch.write_file(os.path.join(pages_dir, page),
+                         PAGE_TEMPLATE.format(body=body).encode("utf-8"))
+        manifest[url] = page
+
+    data = load_benchmark_data(data_path)
+    for start in range(0, len(data), LISTING_PAGE_SIZE):
+        summaries = []
+        for index, question in enumerate(data[start:start + LISTING_PAGE_SIZE], start):
+            question.site = sites.DEFAULT_SITE
+            question.timestamp = question.timestamp or GENERATED_TIME - timedelta(hours=index)
+            question.last_activity = question.timestamp
+            question.answer_count = len(question.answers)
+            for number, answer in enumerate(question.answers, 1):
+                answer.timestamp = (answer.timestamp
+                                    or question.timestamp + timedelta(minutes=number))
+
+            href = f"/questions/{question.question_id}/question-{question.question_id}"
+            summaries.append(render_summary(question, href))
+            save_page(f"https://{sites.DEFAULT_HOST}/{href}",
+                      "".join(render_answer(answer) for answer in question.answers))
+        save_page(crawl.get_listing_url(start // LISTING_PAGE_SIZE + 1), "".join(summaries))
+
+    with open(os.path.join(fixtures_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    with open(os.path.join(fixtures_dir, "data.json"), "w", encoding="utf-8") as f:
+        json.dump(to_json([records.to_dict(question) for question in data]), f, indent=2)
+
+    logging.info("Generated %s pages of %s questions from %s.", len(manifest), len(data),
+                 data_path)
+
+
+def measure_memory(stage) -> float:
+    """ Runs stage again under tracemalloc and returns its peak Python memory in MB. """
+
+    tracemalloc.start()
+    try:
+        stage()
+        return round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+    finally:
+        tracemalloc.stop()
+
+
+def parse_page(url: str, html: str) -> int:
+    """ Parses a recorded page as the scraper does and returns how many questions
+        or answers it held. """
+
+    page = SimpleNamespace(text=html)
+    if is_listing_url(url):
+        soup = scrape.soup_website(page, scrape.QUESTION_SUMMARIES)
+        return len([scrape.extract_question_summary(question)
+                    for question in scrape.get_all_questions(soup)])
+
+    soup = scrape.soup_website(page, scrape.ANSWER_BLOCKS)
+    return len([scrape.extract_answer(answer)
+                for answer in soup.find_all("div", class_="answer js-answer")])
+
+
+def benchmark_parsing(fixtures_dir: str, repeat: int) -> dict:
+    """ Times parsing of every recorded page, taking the median of repeat runs. """
+
+    pages = {}
+    for url, page in load_manifest(fixtures_dir).items():
+        with open(os.path.join(fixtures_dir, "pages", page), "r", encoding="utf-8") as f:
+            pages[url] = f.read()
+
+    def parse_all():
+        for url, html in pages.items():
+            parse_page(url, html)
+
+    timings = {"listing": [], "question": []}
+    for url, html in pages.items():
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse_page(url, html)
+            runs.append(time.perf_counter() - start)
+        timings["listing" if is_listing_url(url) else "question"].append(statistics.median(runs))
+
+    total = sum(sum(runs) for runs in timings.values())
+    return {
+        "parser": scrape.get_parser_backend(),
+        "listing_pages": len(timings["listing"]),
+        "question_pages": len(timings["question"]),
+        "listing_ms_per_page": round(statistics.mean(timings["listing"]) * 1000, 3)
+        if timings["listing"] else None,
+        "question_ms_per_page": round(statistics.mean(timings["question"]) * 1000, 3)
+        if timings["question"] else None,
+        "pages_per_second": round(len(pages) / total, 1) if total else None,
+        "peak_memory_mb": measure_memory(parse_all),
+    }
+
+
+def scrape_recorded_listings(fixtures_dir: str) -> list[records.Question]:
+    """ Runs the scraper over every recorded listing page, replaying recorded responses. """
+
+    data = []
+    with redirect_stdout(sys.stderr):
+        for url in load_manifest(fixtures_dir):
+            if is_listing_url(url):
+                data.extend(scrape.extract_stack_exchange_history_data(url=url))
+    return data
+
+
+def benchmark_scraping(fixtures_dir: str) -> tuple[dict, list[records.Question]]:
+    """ Times the whole scraper over the recorded listings and returns its report
+        and the scraped data. """
+
+    start = time.perf_counter()
+    data = scrape_recorded_listings(fixtures_dir)
+    seconds = time.perf_counter() - start
+
+    with open(os.path.join(fixtures_dir, "data.json"), "r", encoding="utf-8") as f:
+        recorded = json.load(f)
+
+    return {
+        "questions": len(data),
+        "seconds": round(seconds, 4),
+        "questions_per_second": round(len(data) / seconds, 1) if seconds else None,
+        "matches_recorded_data":
+            data == [records.question_from_dict(question) for question in recorded],
+        "peak_memory_mb": measure_memory(lambda: scrape_recorded_listings(fixtures_dir)),
+    }, data
+
+
+def load_benchmark_data(path: str) -> list[records.Question]:
+    """ Returns question records from a data.json style file. Fields older files lack
+        are left empty. """
+
+    with open(path, "r", encoding="utf-8") as f:
+        return [records.question_from_dict(question) for question in json.load(f)]
+
+
+def get_server_settings() -> dict:
+    """ Returns connection settings of the local Postgres server from DB_* variables. """
+
+    load_dotenv()
+    return {"user": environ["DB_USERNAME"], "password": environ["DB_PASSWORD"],
+            "host": environ["DB_IP"], "port": environ["DB_PORT"]}
+
+
+def create_database(name: str):
+    """ Creates an empty database on the benchmark server. """
+
+    conn = psycopg2.connect(dbname=environ.get("BENCHMARK_ADMIN_DB", "postgres"),
+                            **get_server_settings())
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("CREATE DATABASE {};").format(sql.Identifier(name)))
+    conn.close()
+
+
+def drop_database(name: str):
+    """ Drops a benchmark database. """
+
+    conn = psycopg2.connect(dbname=environ.get("BENCHMARK_ADMIN_DB", "postgres"),
+                            **get_server_settings())
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE);").format(sql.Identifier(name)))
+    conn.close()
+
+
+def connect_database(name: str) -> connection:
+    """ Returns connection to a benchmark database, instrumented as the pipeline's is
+        so its round trips are counted. """
+
+    return psycopg2.connect(dbname=name, connection_factory=metrics.InstrumentedConnection,
+                            **get_server_settings())
+
+
+def count_rows(conn: connection) -> int:
+    """ Returns total rows of the tables the pipeline inserts into. """
+
+    with conn.cursor() as cur:
+        cur.execute(" UNION ALL ".join(f"SELECT COUNT(*) FROM {table}" for table in TABLES))
+        total = sum(row[0] for row in cur.fetchall())
+    conn.commit()
+    return total
+
+
+def reset_id_caches():
+    """ Empties the in-process id caches so each insert benchmark starts cold. """
+
+    insert.author_ids = id_cache.IdCache("author", insert.ID_CACHE_SIZE)
+    insert.tag_ids = id_cache.IdCache("tag", insert.ID_CACHE_SIZE)
+    insert.site_ids = id_cache.IdCache("site", insert.ID_CACHE_SIZE)
+
+
+def time_insert(insert_data, data: list[records.Question], conn: connection) -> dict:
+    """ Times one insert of data and returns rows written, rows per second and round trips. """
+
+    rows_before = count_rows(conn)
+    round_trips_before = get_round_trips()
+    start = time.perf_counter()
+    insert_data(data, conn)
+    seconds = time.perf_counter() - start
+    round_trips = get_round_trips() - round_trips_before
+    rows = count_rows(conn) - rows_before
+
+    return {"seconds": round(seconds, 4),
+            "rows_written": rows,
+            "rows_per_second": round(rows / seconds, 1) if seconds else None,
+            "round_trips": round_trips}
+
+
+def benchmark_inserts(data: list[records.Question], database: str) -> dict:
+    """ Times the row-by-row and bulk insert paths into fresh databases, and the bulk
+        path again on unchanged data. """
+
+    report = {"questions": len(data),
+              "answers": sum(len(question.answers) for question in data)}
+
+    for mode, insert_data in [("row", insert.insert_data_to_database),
+                              ("bulk", insert.bulk_insert_data_to_database)]:
+        name = f"{database}_{mode}"
+        create_database(name)
+        try:
+            conn = connect_database(name)
+            migrate.migrate(conn)
+            reset_id_caches()
+            report[mode] = time_insert(insert_data, data, conn)
+            if mode == "bulk":
+                report["bulk_unchanged"] = time_insert(insert_data, data, conn)
+            conn.close()
+        finally:
+            drop_database(name)
+
+    def bulk_insert_into_fresh_database():
+        name = f"{database}_memory"
+        create_database(name)
+        try:
+            conn = connect_database(name)
+            migrate.migrate(conn)
+            reset_id_caches()
+            insert.bulk_insert_data_to_database(data, conn)
+            conn.close()
+        finally:
+            drop_database(name)
+
+    report["bulk"]["peak_memory_mb"] = measure_memory(bulk_insert_into_fresh_database)
+    return report
+
+
+def benchmark_dashboard(data: list[records.Question], database: str, repeat: int) -> dict:
+    """ Loads data, refreshes the rollups and times every dashboard loader,
+        taking the median of repeat runs. """
+
+    name = f"{database}_dashboard"
+    create_database(name)
+    try:
+        conn = connect_database(name)
+        migrate.migrate(conn)
+        reset_id_caches()
+        insert.bulk_insert_data_to_database(data, conn)
+
+        start = time.perf_counter()
+        rollup.refresh_rollups(conn)
+        report = {"refresh_rollups_seconds": round(time.perf_counter() - start, 4),
+                  "loaders": {}}
+
+        conn.autocommit = True
+        loaders = [name for name in dir(dashboard_connect) if name.startswith("load_")
+                   and callable(getattr(dashboard_connect, name))
+                   and name != "load_dotenv"]
+        for loader_name in loaders:
+            loader = getattr(dashboard_connect, loader_name)
+            runs = []
+            round_trips_before = get_round_trips()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                loader(conn)
+                runs.append(time.perf_counter() - start)
+            report["loaders"][loader_name] = {
+                "median_ms": round(statistics.median(runs) * 1000, 3),
+                "min_ms": round(min(runs) * 1000, 3),
+                "round_trips": (get_round_trips() - round_trips_before) // repeat}
+        conn.close()
+    finally:
+        drop_database(name)
+
+    return report
+
+
+def get_git_commit() -> str:
+    """ Returns the commit being benchmarked, or None outside a git checkout. """
+
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(fixtures_dir: str, data_path: str, repeat: int) -> dict:
+    """ Runs every benchmark and returns the report. When no pages have been recorded,
+        pages generated from data_path are replayed instead. """
+
+    environ["HTTP_CACHE_DIR"] = environ["ARCHIVE_DIR"] = ""
+    # replayed pages come from disk, so the site's rate limit does not apply
+    environ["HTTP_RATE"] = environ["HTTP_MAX_RATE"] = environ["HTTP_BURST"] = "100000"
+
+    with tempfile.TemporaryDirectory() as generated_dir:
+        pages = "recorded"
+        if not load_manifest(fixtures_dir):
+            logging.info("No recorded pages in %s, generating them from %s.",
+                         fixtures_dir, data_path)
+            generate_fixtures(generated_dir, data_path)
+            fixtures_dir, pages = generated_dir, "generated"
+
+        replay = ReplayAdapter(fixtures_dir)
+        fetch.get_session().mount("https://", replay)
+        fetch.get_session().mount("http://", replay)
+
+        report = {"started_at": datetime.now().isoformat(),
+                  "git_commit": get_git_commit(),
+                  "python": sys.version.split()[0],
+                  "repeat": repeat,
+                  "pages": pages,
+                  "parse": benchmark_parsing(fixtures_dir, repeat)}
+        report["scrape"], data = benchmark_scraping(fixtures_dir)
+
+    database = f"benchmark_{os.getpid()}"
+    report["insert"] = benchmark_inserts(data, database)
+    report["dashboard"] = benchmark_dashboard(data, database, repeat)
+    report["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+
+    return report
+
+
+def parse_arguments() -> argparse.Namespace:
+    """ Returns command line arguments. """
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR,
+                        help="directory of recorded pages (default: benchmark/fixtures)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="record live pages as fixtures")
+    record.add_argument("--listing-pages", type=int, default=1,
+                        help="listing pages to record, with their question pages")
+
+    run = commands.add_parser("run", help="run the benchmarks and print JSON")
+    run.add_argument("--repeat", type=int, default=5,
+                     help="runs per page and per dashboard loader (default 5)")
+    run.add_argument("--data", default=DEFAULT_DATA_PATH,
+                     help="data.json style questions to generate pages from when none "
+                          "are recorded")
+    run.add_argument("--output", help="write the JSON report here instead of stdout")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    arguments = parse_arguments()
+
+    if arguments.command == "record":
+        record_fixtures(arguments.fixtures, arguments.listing_pages)
+    else:
+        benchmark_report = run_benchmarks(arguments.fixtures, arguments.data, arguments.repeat)
+        if arguments.output:
+            with open(arguments.output, "w", encoding="utf-8") as output:
+                json.dump(benchmark_report, output, indent=2)
+        else:
+            json.dump(benchmark_report, sys.stdout, indent=2)
+            print()
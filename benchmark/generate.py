@@ -0,0 +1,226 @@
+""" Fills a database with synthetic StackExchange history data for scale testing the
+    dashboard queries and the pipeline's upserts. Tags and authors follow Zipf
+    distributions and questions and answers are asked more at some hours of the day
+    than others, like the real site. Rows are written with COPY and the same seed
+    always generates the same data.
+
+    python generate.py --database scale_test --create --questions 1000000 --answers 5000000
+"""
+
+import argparse
+import io
+import logging
+import math
+import random
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import psycopg2
+from psycopg2 import sql
+
+import benchmark  # puts pipeline/ on the path
+import migrate
+import rollup
+
+COPY_CHUNK_SIZE = 100000
+WORDS = ("empire war king trade revolution treaty army church city colony dynasty "
+         "battle navy reform peasant senate republic plague famine border century "
+         "roman medieval ottoman british french chinese soviet silk railway coin").split()
+
+
+def get_zipf_weights(size: int, exponent: float) -> list[float]:
+    """ Returns cumulative Zipf weights of ranks 1 to size, for random.choices. """
+
+    return list(accumulate(1 / rank ** exponent for rank in range(1, size + 1)))
+
+
+def get_hour_weights() -> list[float]:
+    """ Returns relative activity for each hour of the day, peaking mid afternoon
+        and quietest before dawn. """
+
+    return [1 + 0.6 * math.cos(2 * math.pi * (hour - 15) / 24) for hour in range(24)]
+
+
+def random_timestamps(rng: random.Random, count: int, start: datetime, days: int) -> array:
+    """ Returns count epoch timestamps between start and start + days, with hours of
+        the day drawn from get_hour_weights. """
+
+    start_epoch = start.timestamp()
+    hours = rng.choices(range(24), weights=get_hour_weights(), k=count)
+    return array("d", (start_epoch + rng.randrange(days) * 86400 + hour * 3600
+                       + rng.random() * 3600 for hour in hours))
+
+
+def format_epoch(epoch: float) -> str:
+    """ Returns epoch time as a timestamp COPY accepts. """
+
+    return datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def random_texts(rng: random.Random, count: int, words: int) -> list[str]:
+    """ Returns a pool of count random texts of about the given number of words. """
+
+    return [" ".join(rng.choices(WORDS, k=rng.randint(max(1, words // 2), words * 2)))
+            for _ in range(count)]
+
+
+def copy_rows(table: str, columns: list[str], rows, cur):
+    """ Writes rows of tab separated values to a table with COPY, in chunks. """
+
+    query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table.lower()), sql.SQL(", ").join(map(sql.Identifier, columns)))
+
+    buffer, count, total = io.StringIO(), 0, 0
+    for row in rows:
+        buffer.write("\t".join(map(str, row)))
+        buffer.write("\n")
+        count += 1
+        if count == COPY_CHUNK_SIZE:
+            buffer.seek(0)
+            cur.copy_expert(query, buffer)
+            buffer, total, count = io.StringIO(), total + count, 0
+    buffer.seek(0)
+    cur.copy_expert(query, buffer)
+
+    logging.info("Copied %s rows into %s.", total + count, table)
+
+
+def copy_names(table: str, id_column: str, name_column: str, names: list[str], cur) -> list[int]:
+    """ Copies names into a table with a generated id and returns their ids, in order. """
+
+    copy_rows(table, [name_column], ((name,) for name in names), cur)
+    cur.execute(sql.SQL("SELECT {}, {} FROM {};").format(
+        sql.Identifier(name_column), sql.Identifier(id_column), sql.Identifier(table.lower())))
+    ids = dict(cur.fetchall())
+    return [ids[name] for name in names]
+
+
+def get_site_id(site: str, cur) -> int:
+    """ Returns id of a site, adding it if it is not in the database yet. """
+
+    cur.execute("INSERT INTO Site (site) VALUES (%s) ON CONFLICT (site) DO NOTHING;", (site,))
+    cur.execute("SELECT site_id FROM Site WHERE site = %s;", (site,))
+    return cur.fetchone()[0]
+
+
+def generate(conn, questions: int, answers: int, authors: int, tags: int, days: int,
+             exponent: float, seed: int, site: str):
+    """ Generates and copies authors, tags, and the questions, their tags and answers
+        of a site, in one transaction. """
+
+    rng = random.Random(seed)
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) \
+        - timedelta(days=days)
+
+    with conn.cursor() as cur:
+        site_id = get_site_id(site, cur)
+        author_ids = copy_names("Author", "author_id", "author_username",
+                                [f"user_{seed}_{i}" for i in range(authors)], cur)
+        tag_ids = copy_names("Tag", "tag_id", "tag",
+                             [f"{rng.choice(WORDS)}-{i}" for i in range(tags)], cur)
+
+        author_weights = get_zipf_weights(authors, exponent)
+        tag_weights = get_zipf_weights(tags, exponent)
+
+        question_times = random_timestamps(rng, questions, start, days)
+        answer_questions = array("i", (rng.randrange(questions) for _ in range(answers)))
+        answer_times = array("d", (min(question_times[question] + rng.expovariate(1 / 86400),
+                                       start.timestamp() + days * 86400)
+                                   for question in answer_questions))
+        last_activity = array("d", question_times)
+        answer_counts = array("i", bytes(4 * questions))
+        for question, answered_at in zip(answer_questions, answer_times):
+            last_activity[question] = max(last_activity[question], answered_at)
+            answer_counts[question] += 1
+
+        titles = random_texts(rng, 1000, 10)
+        question_authors = rng.choices(author_ids, cum_weights=author_weights, k=questions)
+        copy_rows("Question", ["site_id", "question_id", "author_id", "question", "votes",
+                               "views", "upload_timestamp", "last_activity", "answer_count"],
+                  ((site_id, question + 1, question_authors[question], rng.choice(titles),
+                    int(rng.paretovariate(2.5)) - 1, int(rng.lognormvariate(5, 1)),
+                    format_epoch(question_times[question]),
+                    format_epoch(last_activity[question]), answer_counts[question])
+                   for question in range(questions)), cur)
+        del question_authors
+
+        copy_rows("Question_Tag_Assignment", ["tag_id", "site_id", "question_id"],
+                  ((tag_id, site_id, question + 1) for question in range(questions)
+                   for tag_id in set(rng.choices(tag_ids, cum_weights=tag_weights,
+                                                 k=rng.randint(1, 5)))), cur)
+
+        bodies = random_texts(rng, 1000, 60)
+        answer_authors = rng.choices(author_ids, cum_weights=author_weights, k=answers)
+        copy_rows("Answer", ["site_id", "answer_id", "answer", "votes", "question_id",
+                             "author_id", "upload_timestamp"],
+                  ((site_id, answer + 1, rng.choice(bodies), int(rng.paretovariate(2)) - 1,
+                    answer_questions[answer] + 1, answer_authors[answer],
+                    format_epoch(answer_times[answer]))
+                   for answer in range(answers)), cur)
+
+    conn.commit()
+
+
+def parse_arguments() -> argparse.Namespace:
+    """ Returns command line arguments. """
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", required=True,
+                        help="database to fill, on the server given by the DB_* variables")
+    parser.add_argument("--create", action="store_true",
+                        help="create the database first")
+    parser.add_argument("--questions", type=int, default=10000)
+    parser.add_argument("--answers", type=int, default=None,
+                        help="default 5 per question")
+    parser.add_argument("--authors", type=int, default=None,
+                        help="default 1 per 10 questions")
+    parser.add_argument("--tags", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365,
+                        help="questions are asked over this many days up to now")
+    parser.add_argument("--zipf-exponent", type=float, default=1.1,
+                        help="skew of the tag and author distributions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--site", default="history",
+                        help="site the questions and answers belong to")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    arguments = parse_arguments()
+
+    if arguments.create:
+        benchmark.create_database(arguments.database)
+    db_conn = psycopg2.connect(dbname=arguments.database, **benchmark.get_server_settings())
+    migrate.migrate(db_conn)
+
+    with db_conn.cursor() as db_cur:
+        db_cur.execute("SELECT EXISTS (SELECT 1 FROM Question);")
+        if db_cur.fetchone()[0]:
+            sys.exit(f"{arguments.database} already has questions, generate into an empty database.")
+
+    started = time.perf_counter()
+    generate(db_conn,
+             questions=arguments.questions,
+             answers=arguments.answers if arguments.answers is not None
+             else arguments.questions * 5,
+             authors=arguments.authors or max(1, arguments.questions // 10),
+             tags=arguments.tags,
+             days=arguments.days,
+             exponent=arguments.zipf_exponent,
+             seed=arguments.seed,
+             site=arguments.site)
+
+    with db_conn.cursor() as db_cur:
+        db_cur.execute("ANALYZE;")
+    db_conn.commit()
+    rollup.rebuild_rollups(db_conn)
+    db_conn.close()
+
+    logging.info("Generated in %.1f seconds.", time.perf_counter() - started)
@@ -0,0 +1,111 @@
+""" Serves the answers in a data.json file the way the Stack Exchange API's
+    /questions/{ids}/answers method does, so the pipeline's API answer source can be
+    run and benchmarked offline without using up the daily request quota.
+
+    python stackexchange_api_stub.py --port 8765
+    SCRAPE_ANSWER_SOURCE=api SE_API_URL=http://127.0.0.1:8765/2.3 python pipeline.py
+"""
+
+import argparse
+import html
+import json
+import logging
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+DEFAULT_DATA = Path(__file__).resolve().parent.parent / "pipeline" / "data.json"
+
+
+def format_item(question_id: str, answer: dict) -> dict:
+    """ Returns a stored answer as an API answer item. """
+
+    item = {'answer_id': int(answer['answer_id']),
+            'question_id': int(question_id),
+            'body': f"<p>{html.escape(answer['answer'])}</p>",
+            'owner': {'display_name': html.escape(answer['username'])},
+            'score': int(answer['vote_count'])}
+    if answer.get('timestamp'):
+        item['creation_date'] = int(datetime.fromisoformat(answer['timestamp'])
+                                    .replace(tzinfo=timezone.utc).timestamp())
+    return item
+
+
+def load_answers(path: Path) -> dict[tuple, list[dict]]:
+    """ Returns {(site, question id): API answer items} from a data.json file.
+        Questions recorded without a site are from history. """
+
+    with open(path, encoding="utf-8") as f:
+        questions = json.load(f)
+    return {(question.get('site', "history"), str(question['question_id'])):
+            [format_item(question['question_id'], answer) for answer in question['answers']]
+            for question in questions}
+
+
+def make_handler(answers: dict[tuple, list[dict]], backoff: int) -> type:
+    """ Returns request handler class serving the given answers. """
+
+    class StubHandler(BaseHTTPRequestHandler):
+        """ Answers /filters/create and /questions/{ids}/answers. """
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            url = urlsplit(self.path)
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            parts = url.path.strip("/").split("/")
+
+            if parts[-2:] == ["filters", "create"]:
+                self.send_json({'items': [{'filter': "stub"}]})
+            elif len(parts) >= 3 and parts[-3] == "questions" and parts[-1] == "answers":
+                site = query.get("site", "history")
+                items = [item for question_id in unquote(parts[-2]).split(";")
+                         for item in answers.get((site, question_id), [])]
+                page, pagesize = int(query.get("page", 1)), int(query.get("pagesize", 30))
+                data = {'items': items[(page - 1) * pagesize:page * pagesize],
+                        'has_more': page * pagesize < len(items),
+                        'quota_remaining': 10000}
+                if backoff:
+                    data['backoff'] = backoff
+                self.send_json(data)
+            else:
+                self.send_error(404)
+
+        def send_json(self, data: dict):
+            """ Sends data as a JSON response. """
+
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            logging.debug(format, *args)
+
+    return StubHandler
+
+
+def parse_arguments() -> argparse.Namespace:
+    """ Returns command line arguments. """
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--data", type=Path, default=DEFAULT_DATA,
+                        help="scraped questions to serve answers of")
+    parser.add_argument("--backoff", type=int, default=0,
+                        help="seconds to ask clients to back off after each request")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    arguments = parse_arguments()
+
+    server = ThreadingHTTPServer(("127.0.0.1", arguments.port),
+                                 make_handler(load_answers(arguments.data), arguments.backoff))
+    logging.info("Serving Stack Exchange API stub on http://127.0.0.1:%s/2.3", arguments.port)
+    server.serve_forever()
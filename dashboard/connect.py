@@ -1,16 +1,22 @@
 """ RDS database connection functions for Stack Exchange History page dashboard."""
 
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from os import environ
 import logging
+import os
+import re
+import time
+from threading import BoundedSemaphore, Lock
 
 from dotenv import load_dotenv
 from pandas import DataFrame
-from psycopg2 import connect
+from psycopg2 import connect, DatabaseError
 from psycopg2.extensions import connection
 
 
 def get_connection() -> connection:
-    """ Retrieves connection and returns it. """
+    """ Retrieves connection and returns it. Raises if the database cannot be reached. """
     load_dotenv()
     try:
         conn = connect(
@@ -20,28 +26,261 @@ def get_connection() -> connection:
             port=environ['DB_PORT'],
             dbname=environ['DB_NAME']
         )
-        logging.info("Successful connection to Redshift database.")
-        return conn
-    except ConnectionError as e:
+    except DatabaseError as e:
         logging.error("Unsuccessful connection to database: %s", e)
-        return None
+        raise
+    logging.info("Successful connection to RDS database.")
+    return conn
+
+
+class ConnectionPool:
+    """ Process-wide pool of read-only connections shared by every dashboard session.
+        Connections idle for longer than check_after seconds are health checked before
+        being lent out, and connections older than max_age seconds are replaced. """
+
+    def __init__(self, min_size: int, max_size: int, max_age: float, check_after: float):
+        self.max_age = max_age
+        self.check_after = check_after
+        self.slots = BoundedSemaphore(max_size)
+        self.lock = Lock()
+        self.idle = []
+        self.created_at = {}
+        for _ in range(min_size):
+            self.idle.append((self.open(), time.monotonic()))
+
+    def open(self) -> connection:
+        """ Opens a new autocommit connection and records when it was created. """
+
+        conn = get_connection()
+        conn.autocommit = True
+        self.created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def discard(self, conn: connection):
+        """ Closes a connection that will not be reused. """
+
+        self.created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except DatabaseError:
+            pass
+
+    def is_healthy(self, conn: connection, idle_since: float) -> bool:
+        """ Returns whether a pooled connection can be lent out. """
+
+        now = time.monotonic()
+        if conn.closed or now - self.created_at.get(id(conn), 0) > self.max_age:
+            return False
+        if now - idle_since < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        except DatabaseError:
+            return False
+
+    def get(self) -> connection:
+        """ Returns a healthy idle connection, or a new one if none is left. """
+
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, idle_since = self.idle.pop()
+            if self.is_healthy(conn, idle_since):
+                return conn
+            self.discard(conn)
+        return self.open()
+
+    def put(self, conn: connection):
+        """ Returns a connection to the pool, discarding it if it is broken. """
+
+        if conn.closed:
+            self.discard(conn)
+            return
+        with self.lock:
+            self.idle.append((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """ Lends a connection for the duration of a with block, waiting while all
+            max_size connections are in use. """
+
+        with self.slots:
+            conn = self.get()
+            broken = False
+            try:
+                yield conn
+            except DatabaseError:
+                broken = True
+                raise
+            finally:
+                if broken:
+                    self.discard(conn)
+                else:
+                    self.put(conn)
+
+
+connection_pool_lock = Lock()
+connection_pools = []
+
+
+def get_connection_pool() -> ConnectionPool:
+    """ Returns the pool shared by all sessions, creating it on first use with its
+        sizes and lifetimes from DB_POOL_* variables. """
+
+    with connection_pool_lock:
+        if not connection_pools:
+            load_dotenv()
+            connection_pools.append(ConnectionPool(
+                min_size=int(environ.get("DB_POOL_MIN_SIZE", 1)),
+                max_size=int(environ.get("DB_POOL_MAX_SIZE", 10)),
+                max_age=float(environ.get("DB_POOL_MAX_AGE", 1800)),
+                check_after=float(environ.get("DB_POOL_CHECK_AFTER", 30))))
+        return connection_pools[0]
+
+
+def get_source() -> str:
+    """ Returns where the dashboard reads from, from DASHBOARD_SOURCE: "postgres" queries
+        the database, "snapshot" the pipeline's latest Parquet export. """
+
+    return environ.get("DASHBOARD_SOURCE", "postgres").lower()
+
+
+def pooled_connection():
+    """ Lends a connection from the shared pool: with pooled_connection() as conn: ...
+        In snapshot mode, lends a connection to the latest exported snapshot instead. """
+
+    if get_source() == "snapshot":
+        return snapshot_connection()
+    return get_connection_pool().connection()
+
+
+PARAMETER = re.compile(r"%\((\w+)\)s|%s")
+
+
+class SnapshotCursor:
+    """ DuckDB cursor accepting the psycopg2 placeholders the loaders use,
+        %s and %(name)s, so the same queries run against a snapshot. """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cursor.close()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def execute(self, query: str, params=None):
+        """ Runs a query, rewriting %(name)s placeholders to $name and %s to ?.
+            DuckDB rejects named parameters the query does not use, so they are dropped. """
+
+        names = {match.group(1) for match in PARAMETER.finditer(query)}
+        if isinstance(params, dict):
+            params = {name: value for name, value in params.items() if name in names}
+        self.cursor.execute(PARAMETER.sub(
+            lambda match: f"${match.group(1)}" if match.group(1) else "?", query),
+            params or None)
+
+    def fetchall(self) -> list[tuple]:
+        return self.cursor.fetchall()
+
+    def fetchone(self) -> tuple:
+        return self.cursor.fetchone()
+
+
+class SnapshotConnection:
+    """ Connection to an exported snapshot, with the cursor() the loaders use. """
+
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self) -> SnapshotCursor:
+        return SnapshotCursor(self.database.cursor())
+
+
+snapshot_databases = {}
+snapshot_databases_lock = Lock()
+
+
+def get_snapshot_dir() -> str:
+    """ Returns directory of the latest snapshot, named by the CURRENT file in
+        DASHBOARD_SNAPSHOT_DIR. """
+
+    export_dir = environ.get("DASHBOARD_SNAPSHOT_DIR", "../pipeline/dashboard_snapshot")
+    with open(os.path.join(export_dir, "CURRENT"), encoding="utf-8") as f:
+        return os.path.join(export_dir, f.read().strip())
+
+
+def get_snapshot_database(snapshot_dir: str):
+    """ Returns in-memory DuckDB database with a view over each Parquet file of the
+        snapshot, created once per snapshot and shared by all sessions. """
+
+    import duckdb  # pylint: disable=import-outside-toplevel
+
+    with snapshot_databases_lock:
+        if snapshot_dir not in snapshot_databases:
+            database = duckdb.connect()
+            for file_name in sorted(os.listdir(snapshot_dir)):
+                if file_name.endswith(".parquet"):
+                    path = os.path.join(snapshot_dir, file_name).replace("'", "''")
+                    database.execute(f"CREATE VIEW {file_name[:-len('.parquet')]} AS "
+                                     f"SELECT * FROM read_parquet('{path}');")
+            snapshot_databases.clear()
+            snapshot_databases[snapshot_dir] = database
+            logging.info("Reading dashboard data from snapshot %s.", snapshot_dir)
+        return snapshot_databases[snapshot_dir]
+
+
+@contextmanager
+def snapshot_connection():
+    """ Lends a connection to the latest snapshot, with its own DuckDB cursor so
+        panels can query it from several threads at once. """
+
+    yield SnapshotConnection(get_snapshot_database(get_snapshot_dir()))
+
+
+def load_last_etl_run(conn: connection) -> str:
+    """ Returns when the latest pipeline run finished, as an ISO timestamp,
+        or None if the pipeline has not run yet. """
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT MAX(finished_at) FROM ETL_Run;")
+        finished_at = cur.fetchone()[0]
+
+    return finished_at.isoformat() if finished_at else None
+
+
+def load_sites(conn: connection) -> list[str]:
+    """ Returns names of the sites in the database, in alphabetical order. """
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT site FROM Site ORDER BY site;")
+        return [row[0] for row in cur.fetchall()]
 
 
 # my queries:
 
 
-def load_most_popular_tags(conn: connection) -> DataFrame:
-    """ Returns DataFrame of tags that appeared the most. """
+def load_most_popular_tags(conn: connection, site: str = None) -> DataFrame:
+    """ Returns DataFrame of tags that appeared the most, on one site or all of them. """
 
     with conn.cursor() as cur:
         cur.execute("""
-            SELECT t.tag, COUNT(qt.tag_id) AS tag_count
-            FROM Question_Tag_Assignment qt
-            JOIN Tag t ON qt.tag_id = t.tag_id
-            GROUP BY t.tag
+            SELECT r.tag, SUM(r.tag_count)::BIGINT AS tag_count
+            FROM Tag_Rollup r
+            JOIN Site s ON s.site_id = r.site_id
+            WHERE %(site)s IS NULL OR s.site = %(site)s
+            GROUP BY r.tag
             ORDER BY tag_count DESC
             LIMIT 10;
-                    """
+            """, {'site': site}
                     )
         data = cur.fetchall()
         column_names = [desc[0] for desc in cur.description]
@@ -49,20 +288,20 @@ def load_most_popular_tags(conn: connection) -> DataFrame:
     return DataFrame(data, columns=column_names)
 
 
-def load_most_popular_tags_this_week(conn: connection) -> DataFrame:
-    """ Returns DataFrame of tags that appeared the most within past week. """
+def load_most_popular_tags_this_week(conn: connection, site: str = None) -> DataFrame:
+    """ Returns DataFrame of tags that appeared the most within past week, on one site
+        or all of them. """
 
     with conn.cursor() as cur:
         cur.execute("""
-            SELECT t.tag, COUNT(qt.tag_id) AS tag_count
-            FROM Question_Tag_Assignment qt
-            JOIN Tag t ON qt.tag_id = t.tag_id
-            JOIN Question q ON qt.question_id = q.question_id
-            WHERE q.upload_timestamp >= CURRENT_TIMESTAMP - INTERVAL '7 days'
-            GROUP BY t.tag
+            SELECT r.tag, SUM(r.tag_count)::BIGINT AS tag_count
+            FROM Tag_Week_Rollup r
+            JOIN Site s ON s.site_id = r.site_id
+            WHERE %(site)s IS NULL OR s.site = %(site)s
+            GROUP BY r.tag
             ORDER BY tag_count DESC
             LIMIT 10;
-            """
+            """, {'site': site}
                     )
         data = cur.fetchall()
         column_names = [desc[0] for desc in cur.description]
@@ -70,37 +309,47 @@ def load_most_popular_tags_this_week(conn: connection) -> DataFrame:
     return DataFrame(data, columns=column_names)
 
 
-def load_num_questions_asked_before_12pm(conn: connection) -> DataFrame:
-    """ Returns DataFrame of number of questions asked before 12pm. """
-
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT DATE_PART('hour', q.upload_timestamp) AS upload_hour,
+def load_questions_per_hour(conn: connection, site: str = None, since: datetime = None,
+                            until: datetime = None, tag: str = None) -> DataFrame:
+    """ Returns DataFrame of number of questions asked in each of the 24 hours of the day,
+        on one site or all of them, optionally only those asked between since and until
+        or with the given tag. """
+
+    if since is None and until is None and tag is None:
+        counts = """
+            SELECT r.upload_hour::INT AS upload_hour,
+                SUM(r.question_count)::BIGINT AS question_count
+            FROM Question_Hour_Rollup r
+            JOIN Site s ON s.site_id = r.site_id
+            WHERE %(site)s IS NULL OR s.site = %(site)s
+            GROUP BY 1
+            """
+    else:
+        counts = """
+            SELECT DATE_PART('hour', q.upload_timestamp)::INT AS upload_hour,
                 COUNT(*) AS question_count
             FROM Question q
-            WHERE DATE_PART('HOUR', q.upload_timestamp) < 12
-            GROUP BY upload_hour
-            ORDER BY upload_hour;
+            JOIN Site s ON s.site_id = q.site_id
+            WHERE (%(site)s IS NULL OR s.site = %(site)s)
+                AND (%(since)s IS NULL OR q.upload_timestamp >= %(since)s)
+                AND (%(until)s IS NULL OR q.upload_timestamp < %(until)s)
+                AND (%(tag)s IS NULL OR EXISTS (
+                    SELECT 1
+                    FROM Question_Tag_Assignment qt
+                    JOIN Tag t ON qt.tag_id = t.tag_id
+                    WHERE qt.site_id = q.site_id
+                        AND qt.question_id = q.question_id
+                        AND t.tag = %(tag)s))
+            GROUP BY 1
             """
-                    )
-        data = cur.fetchall()
-        column_names = [desc[0] for desc in cur.description]
-    return DataFrame(data, columns=column_names)
-
-
-def load_num_questions_asked_between_12_5pm(conn: connection) -> DataFrame:
-    """ Returns DataFrame of number of questions asked between 12pm and 5pm. """
 
     with conn.cursor() as cur:
-        cur.execute("""
-            SELECT DATE_PART('hour', q.upload_timestamp) AS upload_hour,
-                COUNT(*) AS question_count
-            FROM Question q
-            WHERE DATE_PART('HOUR', q.upload_timestamp) >= 12
-                AND DATE_PART('HOUR', q.upload_timestamp) < 17
-            GROUP BY upload_hour
-            ORDER BY upload_hour;
-            """
+        cur.execute(f"""
+            SELECT h.upload_hour, COALESCE(c.question_count, 0) AS question_count
+            FROM GENERATE_SERIES(0, 23) AS h(upload_hour)
+            LEFT JOIN ({counts}) c ON c.upload_hour = h.upload_hour
+            ORDER BY h.upload_hour;
+            """, {'site': site, 'since': since, 'until': until, 'tag': tag}
                     )
         data = cur.fetchall()
         column_names = [desc[0] for desc in cur.description]
@@ -108,18 +357,20 @@ def load_num_questions_asked_between_12_5pm(conn: connection) -> DataFrame:
     return DataFrame(data, columns=column_names)
 
 
-def load_num_questions_asked_after_5pm(conn: connection) -> DataFrame:
-    """ Returns DataFrame of number of questions asked after 5pm. """
+def load_tags_for_questions_with_most_votes(conn: connection, site: str = None) -> DataFrame:
+    """ Returns DataFrame of tags for questions that have most votes, on one site or
+        all of them. """
 
     with conn.cursor() as cur:
         cur.execute("""
-            SELECT DATE_PART('hour', q.upload_timestamp) AS upload_hour,
-                COUNT(*) AS question_count
-            FROM Question q
-            WHERE DATE_PART('HOUR', q.upload_timestamp) >= 17
-            GROUP BY upload_hour
-            ORDER BY upload_hour;
-            """
+            SELECT r.tag, SUM(r.total_votes)::BIGINT AS total_votes
+            FROM Tag_Rollup r
+            JOIN Site s ON s.site_id = r.site_id
+            WHERE %(site)s IS NULL OR s.site = %(site)s
+            GROUP BY r.tag
+            ORDER BY total_votes DESC
+            LIMIT 10;
+            """, {'site': site}
                     )
         data = cur.fetchall()
         column_names = [desc[0] for desc in cur.description]
@@ -127,19 +378,21 @@ def load_num_questions_asked_after_5pm(conn: connection) -> DataFrame:
     return DataFrame(data, columns=column_names)
 
 
-def load_tags_for_questions_with_most_votes(conn: connection) -> DataFrame:
-    """ Returns DataFrame of tags for questions that have most votes. """
+def load_tags_for_questions_with_most_answers(conn: connection, site: str = None) -> DataFrame:
+    """ Returns DataFrame of tags for questions that have most answers, on one site or
+        all of them. """
 
     with conn.cursor() as cur:
         cur.execute("""
-            SELECT t.tag, SUM(q.votes) AS total_votes
-            FROM Tag t 
-            JOIN Question_Tag_Assignment qt ON t.tag_id = qt.tag_id
-            JOIN Question q ON q.question_id = qt.question_id
-            GROUP BY t.tag
-            ORDER BY total_votes DESC
+            SELECT r.tag, SUM(r.total_answers)::BIGINT AS total_answers
+            FROM Tag_Rollup r
+            JOIN Site s ON s.site_id = r.site_id
+            WHERE %(site)s IS NULL OR s.site = %(site)s
+            GROUP BY r.tag
+            HAVING SUM(r.total_answers) > 0
+            ORDER BY total_answers DESC
             LIMIT 10;
-            """
+            """, {'site': site}
                     )
         data = cur.fetchall()
         column_names = [desc[0] for desc in cur.description]
@@ -147,20 +400,21 @@ def load_tags_for_questions_with_most_votes(conn: connection) -> DataFrame:
     return DataFrame(data, columns=column_names)
 
 
-def load_tags_for_questions_with_most_answers(conn: connection) -> DataFrame:
-    """ Returns DataFrame of tags for questions that have most answers. """
+def load_author_asks_most_questions(conn: connection, site: str = None) -> DataFrame:
+    """ Returns DataFrame of authors who ask most questions, on one site or all of them. """
 
     with conn.cursor() as cur:
         cur.execute("""
-            SELECT t.tag, COUNT(a.answer_id) AS total_answers
-            FROM Tag t 
-            JOIN Question_Tag_Assignment qt ON t.tag_id = qt.tag_id
-            JOIN Question q ON q.question_id = qt.question_id
-            JOIN Answer a on a.question_id = q.question_id
-            GROUP BY t.tag
-            ORDER BY total_answers DESC
+            SELECT r.author_username, r.author_id,
+                SUM(r.num_questions_asked)::BIGINT AS num_questions_asked
+            FROM Author_Rollup r
+            JOIN Site s ON s.site_id = r.site_id
+            WHERE %(site)s IS NULL OR s.site = %(site)s
+            GROUP BY r.author_username, r.author_id
+            HAVING SUM(r.num_questions_asked) > 0
+            ORDER BY num_questions_asked DESC
             LIMIT 10;
-            """
+            """, {'site': site}
                     )
         data = cur.fetchall()
         column_names = [desc[0] for desc in cur.description]
@@ -168,18 +422,21 @@ def load_tags_for_questions_with_most_answers(conn: connection) -> DataFrame:
     return DataFrame(data, columns=column_names)
 
 
-def load_author_asks_most_questions(conn: connection) -> DataFrame:
-    """ Returns DataFrame of authors who ask most questions. """
+def load_author_writes_most_answers(conn: connection, site: str = None) -> DataFrame:
+    """ Returns DataFrame of authors who answer most questions, on one site or all of them. """
 
     with conn.cursor() as cur:
         cur.execute("""
-            SELECT a.author_username, a.author_id, COUNT(q.question_id) AS num_questions_asked
-            FROM Author a 
-            JOIN Question q on q.author_id = a.author_id
-            GROUP BY a.author_id, a.author_username
-            ORDER BY num_questions_asked DESC
+            SELECT r.author_username, r.author_id,
+                SUM(r.num_answers_written)::BIGINT AS num_answers_written
+            FROM Author_Rollup r
+            JOIN Site s ON s.site_id = r.site_id
+            WHERE %(site)s IS NULL OR s.site = %(site)s
+            GROUP BY r.author_username, r.author_id
+            HAVING SUM(r.num_answers_written) > 0
+            ORDER BY num_answers_written DESC
             LIMIT 10;
-            """
+            """, {'site': site}
                     )
         data = cur.fetchall()
         column_names = [desc[0] for desc in cur.description]
@@ -187,18 +444,30 @@ def load_author_asks_most_questions(conn: connection) -> DataFrame:
     return DataFrame(data, columns=column_names)
 
 
-def load_author_writes_most_answers(conn: connection) -> DataFrame:
-    """ Returns DataFrame of authors who answer most questions. """
+def load_fastest_rising_questions(conn: connection, site: str = None,
+                                  days: int = 7) -> DataFrame:
+    """ Returns DataFrame of questions that gained the most votes, then views, over the
+        past days, on one site or all of them. Only the snapshot partitions of those days
+        are read. """
+
+    since = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) \
+        - timedelta(days=days - 1)
 
     with conn.cursor() as cur:
         cur.execute("""
-            SELECT a.author_username, a.author_id, COUNT(aw.answer_id) AS num_answers_written
-            FROM Author a 
-            JOIN Answer aw on aw.author_id = a.author_id
-            GROUP BY a.author_id, a.author_username
-            ORDER BY num_answers_written DESC
+            SELECT q.question, SUM(s.votes_change) AS votes_gained,
+                SUM(s.views_change) AS views_gained
+            FROM Post_Snapshot s
+            JOIN Question q ON q.site_id = s.site_id AND q.question_id = s.post_id
+            JOIN Site site ON site.site_id = s.site_id
+            WHERE s.post_type = 'question'
+                AND s.captured_at >= %(since)s
+                AND (%(site)s IS NULL OR site.site = %(site)s)
+            GROUP BY q.site_id, q.question_id, q.question
+            HAVING SUM(s.votes_change) > 0 OR SUM(s.views_change) > 0
+            ORDER BY votes_gained DESC, views_gained DESC
             LIMIT 10;
-            """
+            """, {'site': site, 'since': since}
                     )
         data = cur.fetchall()
         column_names = [desc[0] for desc in cur.description]
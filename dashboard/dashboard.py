@@ -1,30 +1,118 @@
 """ Dashboard for displaying analytical data from the RDS containing 
     information about StackExchange History questions."""
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from os import environ
+
 import pandas as pd
 import streamlit as st
 import altair as alt
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import connect
 
+CACHE_TTL = int(environ.get("DASHBOARD_CACHE_TTL", 86400))
+CACHE_MAX_ENTRIES = int(environ.get("DASHBOARD_CACHE_MAX_ENTRIES", 64))
+ETL_RUN_CHECK_TTL = int(environ.get("DASHBOARD_ETL_RUN_CHECK_TTL", 60))
+PANEL_TIMEOUT = float(environ.get("DASHBOARD_PANEL_TIMEOUT", 20))
+TIMES_OF_DAY = {"All times": (0, 24),
+                "Morning (Before 12pm)": (0, 12),
+                "Afternoon (Before 5pm)": (12, 17),
+                "Night (After 5pm)": (17, 24)}
+ALL_SITES = "All sites"
+
+
+@st.cache_data(ttl=ETL_RUN_CHECK_TTL)
+def get_last_etl_run() -> str:
+    """ Returns when the latest pipeline run finished, checking the database at most
+        once per ETL_RUN_CHECK_TTL seconds. """
+
+    with connect.pooled_connection() as conn:
+        return connect.load_last_etl_run(conn)
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+def load_cached(loader_name: str, last_etl_run: str, *params) -> pd.DataFrame:
+    """ Runs a connect loader by name. Results are cached per loader, parameters and
+        pipeline run, so a new run invalidates them. """
+
+    with connect.pooled_connection() as conn:
+        return getattr(connect, loader_name)(conn, *params)
+
+
+def load(loader, *params) -> pd.DataFrame:
+    """ Returns the results of a connect loader, from memory unless the pipeline
+        has run since they were cached. """
+
+    return load_cached(loader.__name__, get_last_etl_run(), *params)
+
+
+def chart_panel(placeholder, get_data, make_chart) -> tuple:
+    """ Returns panel that draws make_chart of the DataFrame from get_data into placeholder. """
+
+    return placeholder, get_data, lambda df: placeholder.altair_chart(make_chart(df))
+
+
+def load_panels(panels: list[tuple]):
+    """ Runs the get_data of every (placeholder, get_data, render) panel concurrently,
+        each query on its own pooled connection, and renders each panel as soon as its
+        data arrives. A panel whose query fails or takes longer than PANEL_TIMEOUT
+        seconds shows an error instead. """
+
+    executor = ThreadPoolExecutor(max_workers=len(panels),
+                                  initializer=add_script_run_ctx,
+                                  initargs=(None, get_script_run_ctx()))
+    futures = {executor.submit(get_data): (placeholder, render)
+               for placeholder, get_data, render in panels}
+    rendered = set()
+
+    try:
+        for future in as_completed(futures, timeout=PANEL_TIMEOUT):
+            placeholder, render = futures[future]
+            rendered.add(future)
+            try:
+                render(future.result())
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                placeholder.error(f"Could not load this panel: {e}")
+    except TimeoutError:
+        for future, (placeholder, _) in futures.items():
+            if future not in rendered:
+                placeholder.error("Timed out loading this panel.")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_site_filter() -> str:
+    """ Displays a select box to choose the site the dashboard shows, and returns the
+        chosen site, or None for all sites. """
 
-def get_popular_tags_display(conn):
-    """ Displays graphs for popular tags in two columns. """
+    site_names = load(connect.load_sites)
+    chosen_site = st.selectbox("Site:", [ALL_SITES, *site_names])
+
+    return None if chosen_site == ALL_SITES else chosen_site
+
+
+def get_popular_tags_display(site: str) -> list[tuple]:
+    """ Lays out graphs for popular tags in two columns and returns their panels. """
 
     st.markdown('#')
     tags_columns = st.columns([1, 0.1, 1])  # spacer between columns
 
     with tags_columns[0]:
-        st.altair_chart(get_most_popular_tags_graph(conn))
+        all_time = st.empty()
 
     with tags_columns[2]:
-        st.altair_chart(get_most_popular_tags_this_week_graph(conn))
+        this_week = st.empty()
 
+    return [chart_panel(all_time, partial(load, connect.load_most_popular_tags, site),
+                        get_most_popular_tags_graph),
+            chart_panel(this_week, partial(load, connect.load_most_popular_tags_this_week, site),
+                        get_most_popular_tags_this_week_graph)]
 
-def get_most_popular_tags_graph(conn):
-    """ Retrieves most popular tags as a DataFrame and returns its
-        corresponding bar chart. """
 
-    popular_tags_df = connect.load_most_popular_tags(conn)
+def get_most_popular_tags_graph(popular_tags_df: pd.DataFrame) -> alt.Chart:
+    """ Returns bar chart of the most popular tags. """
+
     tag_column = popular_tags_df.columns[0]
     tag_count_column = popular_tags_df.columns[1]
 
@@ -46,11 +134,8 @@ def get_most_popular_tags_graph(conn):
     )
 
 
-def get_most_popular_tags_this_week_graph(conn) -> alt.Chart:
-    """ Retrieves most popular tags used this week as a DataFrame and returns its
-        corresponding bar chart. """
-
-    popular_tags_week_df = connect.load_most_popular_tags_this_week(conn)
+def get_most_popular_tags_this_week_graph(popular_tags_week_df: pd.DataFrame) -> alt.Chart:
+    """ Returns bar chart of the most popular tags used this week. """
 
     tag_column = popular_tags_week_df.columns[0]
     tag_count_column = popular_tags_week_df.columns[1]
@@ -74,9 +159,9 @@ def get_most_popular_tags_this_week_graph(conn) -> alt.Chart:
     )
 
 
-def get_questions_asked_by_times_display(conn):
-    """ Displays graph for time of day that questions are asked, and radio button to choose
-        what times the graph displays. In 2 columns. """
+def get_questions_asked_by_times_display(site: str) -> list[tuple]:
+    """ Displays radio button to choose what times of day the graph of when questions
+        are asked displays, and lays out the graph. In 2 columns. Returns its panel. """
 
     st.markdown('#')
     time_columns = st.columns([1, 0.5, 0.5])
@@ -84,30 +169,28 @@ def get_questions_asked_by_times_display(conn):
     with time_columns[1]:
         st.markdown('#')
         chosen_time = st.radio(
-            "Times:", ["All times",
-                       "Morning (Before 12pm)",
-                       "Afternoon (Before 5pm)",
-                       "Night (After 5pm)"])
+            "Times:", list(TIMES_OF_DAY))
 
     with time_columns[0]:
-        st.altair_chart(get_questions_asked_at_times_graph(conn, chosen_time))
+        questions_graph = st.empty()
+
+    return [chart_panel(questions_graph,
+                        partial(load_questions_asked_at_times, chosen_time, site),
+                        get_questions_asked_at_times_graph)]
+
+
+def load_questions_asked_at_times(time: str, site: str) -> pd.DataFrame:
+    """ Returns number of questions asked in each hour of the chosen time of day, sliced
+        from the cached counts for all 24 hours. """
+
+    questions_df = load(connect.load_questions_per_hour, site)
+    first_hour, end_hour = TIMES_OF_DAY[time]
 
+    return questions_df[questions_df["upload_hour"].between(first_hour, end_hour - 1)]
 
-def get_questions_asked_at_times_graph(conn, time) -> alt.Chart:
-    """ Retrieves number of questions asked at specific times of the day: morning, afternoon, night
-        as a DataFrame. Plots a scatter graph and returns it. """
 
-    if time == "Morning":
-        questions_df = connect.load_num_questions_asked_before_12pm(conn)
-    elif time == "Afternoon":
-        questions_df = connect.load_num_questions_asked_between_12_5pm(conn)
-    elif time == "Night":
-        questions_df = connect.load_num_questions_asked_after_5pm(conn)
-    else:
-        questions_df = pd.concat([connect.load_num_questions_asked_before_12pm(conn),
-                                  connect.load_num_questions_asked_between_12_5pm(
-                                      conn),
-                                  connect.load_num_questions_asked_after_5pm(conn)])
+def get_questions_asked_at_times_graph(questions_df: pd.DataFrame) -> alt.Chart:
+    """ Plots a scatter graph of number of questions asked per hour and returns it. """
 
     upload_hour = questions_df.columns[0]
     question_count = questions_df.columns[1]
@@ -130,25 +213,30 @@ def get_questions_asked_at_times_graph(conn, time) -> alt.Chart:
     )
 
 
-def get_tags_by_votes_and_answers_display(conn):
-    """ Displays graphs for tags that are most visible per votes and answers their corresponding 
-        questions receive. In 2 columns."""
+def get_tags_by_votes_and_answers_display(site: str) -> list[tuple]:
+    """ Lays out graphs for tags that are most visible per votes and answers their corresponding 
+        questions receive. In 2 columns. Returns their panels. """
 
     st.markdown('#')
     tags_columns = st.columns([1, 0.1, 1])
 
     with tags_columns[0]:
-        st.altair_chart(get_tags_most_votes_graph(conn))
+        most_votes = st.empty()
 
     with tags_columns[2]:
-        st.altair_chart(get_tags_most_answers_graph(conn))
+        most_answers = st.empty()
 
+    return [chart_panel(most_votes,
+                        partial(load, connect.load_tags_for_questions_with_most_votes, site),
+                        get_tags_most_votes_graph),
+            chart_panel(most_answers,
+                        partial(load, connect.load_tags_for_questions_with_most_answers, site),
+                        get_tags_most_answers_graph)]
 
-def get_tags_most_votes_graph(conn) -> alt.Chart:
-    """ Retrieves tags and the total number of votes their corresponding questions receive 
-        as a DataFrame. Plots a bar chart and returns it. """
 
-    tags_most_votes_df = connect.load_tags_for_questions_with_most_votes(conn)
+def get_tags_most_votes_graph(tags_most_votes_df: pd.DataFrame) -> alt.Chart:
+    """ Plots a bar chart of tags and the total number of votes their corresponding
+        questions receive, and returns it. """
 
     tag_column = tags_most_votes_df.columns[0]
     tag_votes_column = tags_most_votes_df.columns[1]
@@ -172,12 +260,9 @@ def get_tags_most_votes_graph(conn) -> alt.Chart:
     )
 
 
-def get_tags_most_answers_graph(conn) -> alt.Chart:
-    """ Retrieves tags and the total number of answers their corresponding questions receive
-        as a DataFrame. Plots a bar chart and returns it. """
-
-    tags_most_answers_df = connect.load_tags_for_questions_with_most_answers(
-        conn)
+def get_tags_most_answers_graph(tags_most_answers_df: pd.DataFrame) -> alt.Chart:
+    """ Plots a bar chart of tags and the total number of answers their corresponding
+        questions receive, and returns it. """
 
     tag_column = tags_most_answers_df.columns[0]
     tag_answers_column = tags_most_answers_df.columns[1]
@@ -201,9 +286,9 @@ def get_tags_most_answers_graph(conn) -> alt.Chart:
     )
 
 
-def get_authors_with_most_questions_and_answers_display(conn):
-    """ Displays graphs for authors who ask most questions and authors
-        who write most answers. In 2 columns."""
+def get_authors_with_most_questions_and_answers_display(site: str) -> list[tuple]:
+    """ Lays out tables for authors who ask most questions and authors
+        who write most answers. In 2 columns. Returns their panels. """
 
     st.markdown('#')
     tags_columns = st.columns([1, 0.1, 1])
@@ -211,13 +296,30 @@ def get_authors_with_most_questions_and_answers_display(conn):
     with tags_columns[0]:
         st.markdown(f"""<h4 style='font-size:{'18px'}; color:{
             'black'};'> Users who have written the most questions: 👥</h4>""", unsafe_allow_html=True)
-        st.dataframe(connect.load_author_asks_most_questions(
-            conn))
+        most_questions = st.empty()
 
     with tags_columns[2]:
         st.markdown(f"""<h4 style='font-size:{'18px'}; color:{
                     'black'};'> Users who have written the most answers: 👥</h4>""", unsafe_allow_html=True)
-        st.dataframe(connect.load_author_writes_most_answers(conn))
+        most_answers = st.empty()
+
+    return [(most_questions, partial(load, connect.load_author_asks_most_questions, site),
+             most_questions.dataframe),
+            (most_answers, partial(load, connect.load_author_writes_most_answers, site),
+             most_answers.dataframe)]
+
+
+def get_fastest_rising_questions_display(site: str) -> list[tuple]:
+    """ Lays out table of questions whose votes and views rose fastest this week.
+        Returns its panel. """
+
+    st.markdown('#')
+    st.markdown(f"""<h4 style='font-size:{'18px'}; color:{
+        'black'};'> Fastest rising questions this week: 📈</h4>""", unsafe_allow_html=True)
+    rising_questions = st.empty()
+
+    return [(rising_questions, partial(load, connect.load_fastest_rising_questions, site),
+             rising_questions.dataframe)]
 
 
 def set_up_dashboard():
@@ -229,17 +331,21 @@ def set_up_dashboard():
                        initial_sidebar_state="collapsed")
     st.title("StackExchange - History Analytics")
 
-    conn = connect.get_connection()
+    get_last_etl_run()
+
+    site = get_site_filter()
+
+    panels = get_popular_tags_display(site)
 
-    get_popular_tags_display(conn)
+    panels += get_questions_asked_by_times_display(site)
 
-    get_questions_asked_by_times_display(conn)
+    panels += get_tags_by_votes_and_answers_display(site)
 
-    get_tags_by_votes_and_answers_display(conn)
+    panels += get_authors_with_most_questions_and_answers_display(site)
 
-    get_authors_with_most_questions_and_answers_display(conn)
+    panels += get_fastest_rising_questions_display(site)
 
-    conn.close()
+    load_panels(panels)
 
 
 if __name__ == "__main__":
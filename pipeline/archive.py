@@ -0,0 +1,158 @@
+""" Local archive of every fetched listing and question page, so pages can be parsed
+    again later without the network. Page bodies are compressed and stored once per
+    content hash; a SQLite index records which URL returned which body, and when. """
+
+import gzip
+import hashlib
+import os
+import sqlite3
+from datetime import datetime
+from functools import lru_cache
+from importlib.util import find_spec
+from os import environ
+from threading import Lock, get_ident
+
+import requests as req
+
+COMPRESSION_EXTENSIONS = {"zstd": "zst", "gzip": "gz"}
+
+index_lock = Lock()
+
+
+def get_archive_dir() -> str:
+    """ Returns directory of the page archive, from ARCHIVE_DIR.
+        An empty value disables archiving. """
+
+    return environ.get("ARCHIVE_DIR", "page_archive")
+
+
+def get_compression() -> str:
+    """ Returns compression of newly archived pages from ARCHIVE_COMPRESSION,
+        defaulting to zstd when zstandard is installed, otherwise gzip. """
+
+    compression = environ.get("ARCHIVE_COMPRESSION")
+    if compression:
+        return compression
+    return "zstd" if find_spec("zstandard") else "gzip"
+
+
+def compress(body: bytes, compression: str) -> bytes:
+    """ Returns body compressed with zstd or gzip. """
+
+    if compression == "zstd":
+        import zstandard  # pylint: disable=import-outside-toplevel
+        return zstandard.ZstdCompressor(level=10).compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    """ Returns body of a compressed archived page. """
+
+    if compression == "zstd":
+        import zstandard  # pylint: disable=import-outside-toplevel
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def get_object_path(archive_dir: str, sha256: str, compression: str) -> str:
+    """ Returns path of the body with the given hash, in a directory named after
+        the first two characters of the hash. """
+
+    return os.path.join(archive_dir, "objects", sha256[:2],
+                        f"{sha256}.{COMPRESSION_EXTENSIONS[compression]}")
+
+
+@lru_cache(maxsize=None)
+def get_index(archive_dir: str) -> sqlite3.Connection:
+    """ Returns connection to the archive's index, creating it on first use.
+        The connection is shared by all threads, guarded by index_lock. """
+
+    os.makedirs(archive_dir, exist_ok=True)
+    index = sqlite3.connect(os.path.join(archive_dir, "index.sqlite"),
+                            check_same_thread=False, timeout=30)
+    index.execute("PRAGMA journal_mode=WAL;")
+    index.execute("""
+        CREATE TABLE IF NOT EXISTS Page (
+            url TEXT NOT NULL,
+            fetched_at TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            encoding TEXT,
+            sha256 TEXT NOT NULL,
+            compression TEXT NOT NULL,
+            size INTEGER NOT NULL
+        );
+    """)
+    index.execute("CREATE INDEX IF NOT EXISTS page_url_fetched_at ON Page (url, fetched_at);")
+    index.execute("CREATE INDEX IF NOT EXISTS page_sha256 ON Page (sha256);")
+    index.commit()
+    return index
+
+
+def archive_page(url: str, response: req.Response):
+    """ Archives the body of a successful response, or of a cached page the server
+        confirmed unchanged. A body already in the archive is not stored again; only
+        the fetch is added to the index. """
+
+    if response.status_code == 200 or getattr(response, "from_cache", False):
+        archive_body(url, response.status_code, response.encoding, response.content)
+
+
+def archive_body(url: str, status: int, encoding: str, body: bytes):
+    """ Archives a page body fetched from URL, as archive_page does for a response. """
+
+    archive_dir = get_archive_dir()
+    if not archive_dir:
+        return
+
+    sha256 = hashlib.sha256(body).hexdigest()
+    index = get_index(archive_dir)
+
+    with index_lock:
+        row = index.execute("SELECT compression FROM Page WHERE sha256 = ? LIMIT 1;",
+                            (sha256,)).fetchone()
+    compression = row[0] if row else get_compression()
+
+    path = get_object_path(archive_dir, sha256, compression)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(compress(body, compression))
+        os.replace(temp_path, path)
+
+    with index_lock:
+        index.execute("INSERT INTO Page VALUES (?, ?, ?, ?, ?, ?, ?);",
+                      (url, datetime.now().isoformat(), status, encoding, sha256,
+                       compression, len(body)))
+        index.commit()
+
+
+def get_latest_pages(archive_dir: str = None) -> list[dict]:
+    """ Returns the most recent fetch of every archived URL, oldest first, as
+        url, fetched_at, encoding, sha256 and compression. """
+
+    archive_dir = archive_dir or get_archive_dir()
+    if not archive_dir or not os.path.exists(os.path.join(archive_dir, "index.sqlite")):
+        return []
+
+    index = get_index(archive_dir)
+    with index_lock:
+        rows = index.execute("""
+            SELECT url, MAX(fetched_at), encoding, sha256, compression
+            FROM Page
+            GROUP BY url
+            ORDER BY MAX(fetched_at);
+        """).fetchall()
+    return [{'url': url, 'fetched_at': datetime.fromisoformat(fetched_at),
+             'encoding': encoding, 'sha256': sha256, 'compression': compression,
+             'archive_dir': archive_dir}
+            for url, fetched_at, encoding, sha256, compression in rows]
+
+
+def read_page(page: dict) -> str:
+    """ Returns the text of an archived page returned by get_latest_pages. """
+
+    with open(get_object_path(page['archive_dir'], page['sha256'], page['compression']),
+              "rb") as f:
+        body = decompress(f.read(), page['compression'])
+    return body.decode(page['encoding'] or "utf-8", "replace")
@@ -0,0 +1,442 @@
+""" Asynchronous pipeline mode: listing and question pages of every site are fetched with
+    aiohttp, parsed in worker processes and written to the database with asyncpg, all
+    driven by one event loop. Each stage is bounded: requests by the connection pool,
+    pages being parsed by the parse workers, and batches by the queue to the database
+    writers, so a slow stage holds back the ones before it. """
+
+import asyncio
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import count
+from multiprocessing import get_context
+from os import environ
+from urllib.parse import urlparse
+
+import aiohttp
+import asyncpg
+from dotenv import load_dotenv
+
+import archive
+import crawl
+import fetch
+import insert
+import metrics
+import records
+import scrape
+import sites
+
+PARAMETER = re.compile(r"%s")
+ROW_COUNT = re.compile(r"(\d+)$")
+
+
+@dataclass
+class Stages:
+    """ Shared state of the stages of an asynchronous run. """
+
+    session: aiohttp.ClientSession
+    executor: ProcessPoolExecutor
+    parse_slots: asyncio.Semaphore
+    pool: asyncpg.Pool
+    batches: asyncio.Queue
+    batch_size: int
+    incremental: bool
+    partitions: set = field(default_factory=set)
+    partitions_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+def get_parse_workers() -> int:
+    """ Returns number of processes parsing pages, from ASYNC_PARSE_WORKERS,
+        defaulting to one per CPU. """
+
+    return max(1, int(environ.get("ASYNC_PARSE_WORKERS", os.cpu_count() or 1)))
+
+
+def get_db_writers() -> int:
+    """ Returns number of batches written to the database at once, from ASYNC_DB_WRITERS. """
+
+    return max(1, int(environ.get("ASYNC_DB_WRITERS", 2)))
+
+
+def get_listing_urls(host: str) -> list[str]:
+    """ Returns URLs of the listing pages scraped from the site at host: the newest
+        questions listing, as in latest mode, or its first ASYNC_LISTING_PAGES pages of
+        50 questions, as a crawl would request them. """
+
+    pages = max(1, int(environ.get("ASYNC_LISTING_PAGES", 1)))
+    if pages == 1:
+        return [scrape.get_listing_url(host)]
+    return [crawl.get_listing_url(page, host) for page in range(1, pages + 1)]
+
+
+def to_asyncpg(query: str) -> str:
+    """ Returns a query with psycopg2's %s parameters numbered $1, $2, ... for asyncpg. """
+
+    numbers = count(1)
+    return PARAMETER.sub(lambda _: f"${next(numbers)}", query)
+
+
+def record_statement(query: str, status: str, tables: set):
+    """ Records a statement sent to the server and the rows its status reports,
+        as metrics.InstrumentedConnection does, adding its table to tables. """
+
+    table = metrics.get_statement_table(query)
+    rows = ROW_COUNT.search(status or "")
+    metrics.increment("db_round_trips_total", table=table)
+    metrics.increment("db_rows_total", int(rows.group(1)) if rows else 0, table=table)
+    tables.add(table)
+
+
+def record_transaction_end(tables: set, committed: bool):
+    """ Records the commit or rollback of a transaction that wrote to tables. """
+
+    metrics.increment("db_round_trips_total", table="commit" if committed else "rollback")
+    for table in tables:
+        metrics.increment("db_commits_total" if committed else "db_rollbacks_total",
+                          table=table)
+
+
+async def execute(conn: asyncpg.Connection, tables: set, query: str, *args) -> str:
+    """ Runs a statement and records it. """
+
+    status = await conn.execute(query, *args)
+    record_statement(query, status, tables)
+    return status
+
+
+async def fetch_rows(conn: asyncpg.Connection, tables: set, query: str, *args) -> list:
+    """ Runs a query, records it and returns its rows. """
+
+    rows = await conn.fetch(query, *args)
+    record_statement(query, f"SELECT {len(rows)}", tables)
+    return rows
+
+
+def create_pool(size: int) -> asyncpg.Pool:
+    """ Returns pool of up to size connections to the database given by the DB_
+        environment variables, opened when entered with async with. """
+
+    load_dotenv()
+    return asyncpg.create_pool(
+        user=environ['DB_USERNAME'],
+        password=environ['DB_PASSWORD'],
+        host=environ['DB_IP'],
+        port=int(environ['DB_PORT']),
+        database=environ['DB_NAME'],
+        min_size=1,
+        max_size=size)
+
+
+async def warm_id_caches(pool: asyncpg.Pool):
+    """ Fills the id caches with the most recently added authors, tags and sites. """
+
+    async with pool.acquire() as conn:
+        rows = await fetch_rows(conn, set(), to_asyncpg(insert.WARM_ID_CACHES_QUERY),
+                                insert.author_ids.max_size, insert.tag_ids.max_size,
+                                insert.site_ids.max_size)
+    insert.put_warm_ids(rows)
+
+
+async def load_question_states(stages: Stages, site: str, question_ids: list[int]) -> dict:
+    """ Returns stored {question_id: (answer_count, last_activity, votes, views)} of
+        known questions of a site, as insert.load_question_states does. """
+
+    async with stages.pool.acquire() as conn:
+        rows = await fetch_rows(conn, set(), to_asyncpg(insert.QUESTION_STATES_QUERY),
+                                site, question_ids)
+    return {row['question_id']: (row['answer_count'], row['last_activity'], row['votes'],
+                                 row['views'])
+            for row in rows}
+
+
+async def fetch_page(session: aiohttp.ClientSession, url: str) -> tuple[int, bytes, str]:
+    """ Gets URL under its host's rate limit, retrying connection errors, timeouts and
+        429/5xx responses as fetch.get_with_retries does, without blocking the event loop.
+        Returns (status, body, encoding) of the last response, or raises the last
+        connection error once retries run out. """
+
+    host = urlparse(url).netloc
+    rate_limit = fetch.get_rate_limit(host)
+    max_retries = int(environ.get("HTTP_MAX_RETRIES", 4))
+
+    for attempt in range(max_retries + 1):
+        await asyncio.sleep(rate_limit.reserve())
+        start = time.perf_counter()
+        try:
+            async with session.get(url) as response:
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics.increment("http_errors_total", host=host, error=type(e).__name__)
+            if attempt == max_retries:
+                raise
+            metrics.increment("http_retries_total", host=host, reason=type(e).__name__)
+            await asyncio.sleep(fetch.get_backoff(attempt))
+            continue
+
+        fetch.record_response(url, response.status, len(body), time.perf_counter() - start,
+                              "disabled")
+        if response.status not in fetch.RETRY_STATUSES:
+            rate_limit.on_success()
+            break
+
+        retry_after = fetch.get_retry_after(response)
+        if response.status in fetch.THROTTLE_STATUSES:
+            rate_limit.on_throttled(retry_after or 0.0)
+        if attempt == max_retries:
+            break
+        metrics.increment("http_retries_total", host=host, reason=str(response.status))
+        await asyncio.sleep(retry_after if retry_after is not None
+                            else fetch.get_backoff(attempt))
+
+    return response.status, body, response.charset or "utf-8"
+
+
+def parse_page(kind: str, body: bytes, encoding: str, host: str) -> tuple[list, float]:
+    """ Returns question summaries of a listing page or answers of a question page, and
+        the seconds spent parsing it. Runs in a worker process. """
+
+    start = time.perf_counter()
+    html = body.decode(encoding, "replace")
+    if kind == "listing":
+        parsed = scrape.parse_listing_page(html, host)
+    else:
+        parsed = scrape.parse_question_page(html)
+    return parsed, time.perf_counter() - start
+
+
+async def get_parsed_page(stages: Stages, kind: str, url: str) -> list:
+    """ Fetches, archives and parses a listing or question page.
+        Raises aiohttp.ClientError if it could not be fetched. """
+
+    status, body, encoding = await fetch_page(stages.session, url)
+    if status != 200:
+        raise aiohttp.ClientError(f"{url} returned {status}.")
+    if archive.get_archive_dir():
+        await asyncio.to_thread(archive.archive_body, url, status, encoding, body)
+
+    async with stages.parse_slots:
+        parsed, seconds = await asyncio.get_running_loop().run_in_executor(
+            stages.executor, parse_page, kind, body, encoding, urlparse(url).netloc)
+    metrics.observe("page_parse_seconds", seconds, page=kind)
+    return parsed
+
+
+async def get_question(stages: Stages, summary: dict, known_states: dict) -> records.Question:
+    """ Returns record of a listed question with its answers, fetched unless the
+        question is unchanged since it was stored. None if its page could not be fetched. """
+
+    answers = []
+    if known_states is None or scrape.has_question_changed(summary, known_states):
+        try:
+            answers = await get_parsed_page(stages, "question", summary['link'])
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning("Skipping question %s, its answers could not be fetched: %s",
+                            summary['question_id'], e)
+            metrics.increment("questions_skipped_total")
+            return None
+
+    return scrape.question_from_summary(summary, answers)
+
+
+async def put_questions(stages: Stages, summaries, known_states: dict, batch: list):
+    """ Scrapes listed questions one at a time, adding them to the site's batch and
+        queuing the batch for the writers once full. Several run per site, sharing the
+        summaries iterator and the batch. """
+
+    for summary in summaries:
+        question = await get_question(stages, summary, known_states)
+        if question is None:
+            continue
+        batch.append(question)
+        if len(batch) >= stages.batch_size:
+            full_batch = batch.copy()
+            batch.clear()
+            await stages.batches.put(full_batch)
+
+
+async def scrape_site(stages: Stages, host: str):
+    """ Scrapes the listing pages of the site at host, then its questions, SCRAPE_WORKERS
+        at a time, queuing them in batches of PIPELINE_BATCH_SIZE. """
+
+    urls = get_listing_urls(host)
+    listings = await asyncio.gather(*(get_parsed_page(stages, "listing", url) for url in urls))
+
+    summaries = {}
+    for summary in (summary for listing in listings for summary in listing):
+        summaries.setdefault(summary['question_id'], summary)
+    logging.info("Found %s questions on %s listing pages of %s.",
+                 len(summaries), len(urls), host)
+
+    known_states = None
+    if stages.incremental:
+        known_states = await load_question_states(stages, sites.get_site_name(host),
+                                                  list(summaries))
+        changed = sum(scrape.has_question_changed(summary, known_states)
+                      for summary in summaries.values())
+        logging.info("Incremental scrape: fetching %s answer pages, skipped %s unchanged.",
+                     changed, len(summaries) - changed)
+
+    batch = []
+    remaining = iter(summaries.values())
+    await asyncio.gather(*(put_questions(stages, remaining, known_states, batch)
+                           for _ in range(scrape.get_worker_count())))
+    if batch:
+        await stages.batches.put(batch)
+
+
+async def create_snapshot_partition(stages: Stages, conn: asyncpg.Connection, day: datetime):
+    """ Creates the Post_Snapshot partition holding the given day if it does not exist
+        yet, in its own transaction, as insert.create_snapshot_partition does: one
+        writer at a time here, and under an advisory lock against other processes. """
+
+    name, create_query = insert.get_snapshot_partition(day)
+    async with stages.partitions_lock:
+        if name in stages.partitions:
+            return
+        try:
+            async with conn.transaction():
+                if await conn.fetchval(to_asyncpg(insert.SNAPSHOT_PARTITION_QUERY), name):
+                    await conn.execute(to_asyncpg(insert.SNAPSHOT_PARTITION_LOCK_QUERY), name)
+                    await conn.execute(create_query)
+        except (asyncpg.DuplicateTableError, asyncpg.UniqueViolationError):
+            pass
+        stages.partitions.add(name)
+
+
+async def upload_names(conn: asyncpg.Connection, tables: set, cache, table: str,
+                       id_column: str, name_column: str, names: set) -> tuple[dict, dict]:
+    """ Uploads names missing from the id cache to a dimension table in sorted order,
+        as insert.bulk_upload_authors does. Returns ({name: id} for every given name,
+        {name: id} read from the database, to cache once committed). """
+
+    cached, missing = cache.get_many(names)
+    if not missing:
+        return cached, {}
+
+    await execute(conn, tables, f"""
+        INSERT INTO {table} ({name_column})
+        SELECT unnest($1::TEXT[])
+        ON CONFLICT ({name_column}) DO NOTHING;
+    """, sorted(missing))
+
+    rows = await fetch_rows(conn, tables, f"""
+        SELECT {id_column} AS id, {name_column} AS name
+        FROM {table} WHERE {name_column} = ANY($1::TEXT[]);
+    """, list(missing))
+
+    loaded = {row['name']: row['id'] for row in rows}
+    return cached | loaded, loaded
+
+
+async def copy_batch(conn: asyncpg.Connection, tables: set, table: str,
+                     batch: records.ColumnBatch):
+    """ Writes a column batch to a table with binary COPY. """
+
+    status = await conn.copy_records_to_table(table.lower(), records=zip(*batch.columns),
+                                              columns=batch.names)
+    record_statement(f"COPY {table}", status, tables)
+
+
+async def write_batch(stages: Stages, questions_data: list[records.Question]):
+    """ Uploads a batch of question data in a single transaction, with the same staging,
+        rollup, snapshot and merge statements as insert.bulk_insert_data_to_database. """
+
+    authors = insert.get_batch_authors(questions_data)
+    tags = {tag for question in questions_data for tag in question.tags}
+    site_names = {question.site for question in questions_data}
+
+    async with stages.pool.acquire() as conn:
+        captured_at = datetime.now()
+        await create_snapshot_partition(stages, conn, captured_at)
+
+        tables = set()
+        try:
+            async with conn.transaction():
+                await execute(conn, tables, insert.STAGE_TABLES_QUERY)
+                batch_site_ids, new_site_ids = await upload_names(
+                    conn, tables, insert.site_ids, "Site", "site_id", "site", site_names)
+                batch_author_ids, new_author_ids = await upload_names(
+                    conn, tables, insert.author_ids, "Author", "author_id", "author_username",
+                    authors)
+                batch_tag_ids, new_tag_ids = await upload_names(
+                    conn, tables, insert.tag_ids, "Tag", "tag_id", "tag", tags)
+
+                questions = {(question.site, question.question_id): question
+                             for question in questions_data}
+                answers = {(question.site, answer.answer_id): (answer, question)
+                           for question in questions.values()
+                           for answer in question.answers}
+                await copy_batch(conn, tables, "Question_Stage", insert.get_question_batch(
+                    questions.values(), batch_site_ids, batch_author_ids))
+                await copy_batch(conn, tables, "Answer_Stage", insert.get_answer_batch(
+                    answers.values(), batch_site_ids, batch_author_ids))
+                await copy_batch(conn, tables, "Question_Tag_Stage",
+                                 insert.get_question_tag_batch(
+                                     questions.values(), batch_site_ids, batch_tag_ids))
+                await execute(conn, tables, insert.ROLLUP_STAGED_QUERY)
+
+                await execute(conn, tables, to_asyncpg(insert.SNAPSHOT_STAGED_QUESTIONS_QUERY),
+                              captured_at)
+                await execute(conn, tables, to_asyncpg(insert.SNAPSHOT_STAGED_ANSWERS_QUERY),
+                              captured_at)
+                await execute(conn, tables, insert.MERGE_STAGED_QUESTIONS_QUERY)
+                await execute(conn, tables, insert.MERGE_STAGED_QUESTION_TAGS_QUERY)
+                await execute(conn, tables, insert.MERGE_STAGED_ANSWERS_QUERY)
+        except Exception:
+            record_transaction_end(tables, committed=False)
+            raise
+        record_transaction_end(tables, committed=True)
+
+    insert.site_ids.put_many(new_site_ids)
+    insert.author_ids.put_many(new_author_ids)
+    insert.tag_ids.put_many(new_tag_ids)
+
+
+async def write_batches(stages: Stages):
+    """ Database writer: writes batches from the queue until it receives None. """
+
+    while (questions := await stages.batches.get()) is not None:
+        with metrics.span("insert_batch"):
+            await write_batch(stages, questions)
+
+
+async def run_sites(hosts: list[str]):
+    """ Scrapes every site at once and inserts their questions, on one event loop.
+        A failing stage cancels the others; its error is raised in an ExceptionGroup. """
+
+    if scrape.get_answer_source() == "api":
+        logging.warning("SCRAPE_ANSWER_SOURCE=api is not supported in async mode; "
+                        "answers are scraped from question pages.")
+
+    writers = get_db_writers()
+    connector = aiohttp.TCPConnector(limit=int(environ.get("HTTP_POOL_SIZE", 10)),
+                                     limit_per_host=scrape.get_host_concurrency())
+    parse_workers = get_parse_workers()
+
+    # Spawned rather than forked, so workers do not inherit the loop's open sockets.
+    with ProcessPoolExecutor(max_workers=parse_workers,
+                             mp_context=get_context("spawn")) as executor:
+        async with aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=fetch.get_timeout())) as session, \
+                create_pool(writers + 1) as pool:
+            with metrics.span("warm_id_caches"):
+                await warm_id_caches(pool)
+
+            stages = Stages(
+                session=session, executor=executor,
+                parse_slots=asyncio.Semaphore(parse_workers * 2), pool=pool,
+                batches=asyncio.Queue(maxsize=int(environ.get("PIPELINE_QUEUE_SIZE", 4))),
+                batch_size=int(environ.get("PIPELINE_BATCH_SIZE", 10)),
+                incremental=environ.get("SCRAPE_INCREMENTAL", "false").lower() == "true")
+
+            async with asyncio.TaskGroup() as group:
+                for _ in range(writers):
+                    group.create_task(write_batches(stages))
+                await asyncio.gather(*(scrape_site(stages, host) for host in hosts))
+                for _ in range(writers):
+                    await stages.batches.put(None)
@@ -1,6 +1,5 @@
-# Connects to database, drops and builds table, displays tables.
+# Connects to database and displays tables. Tables are created by migrations: python3 migrate.py
 source .env
 export PGPASSWORD=$DB_PASSWORD
-# psql --host $DB_IP -U $DB_USERNAME -p $DB_PORT -d $DB_NAME -f schema.sql
 psql --host $DB_IP -U $DB_USERNAME -p $DB_PORT -d $DB_NAME -f queries.sql
 
@@ -0,0 +1,135 @@
+""" Crawls StackExchange history listing pages, newest first, to backfill the database.
+    A checkpoint is saved after each inserted page so an interrupted crawl resumes
+    where it stopped. Other sites are crawled the same way, each with its own checkpoint. """
+
+import json
+import logging
+import os
+from datetime import datetime
+from functools import partial
+from os import environ
+
+import scrape
+import sites
+
+LISTING_URL = "https://{host}/questions?tab=Newest&page={page}&pagesize=50"
+
+
+def get_listing_url(page: int, host: str = sites.DEFAULT_HOST) -> str:
+    """ Returns URL of a page of the newest questions listing of the site at host. """
+
+    return LISTING_URL.format(host=host, page=page)
+
+
+def parse_date(date: str) -> datetime:
+    """ Parses a YYYY-MM-DD date, returning None for an empty value. """
+
+    return datetime.strptime(date, "%Y-%m-%d") if date else None
+
+
+def get_summary_date(summary: dict) -> datetime:
+    """ Returns when a listed question was asked, falling back to its last activity
+        when the listing does not show the asked time. """
+
+    return summary['timestamp'] or summary['last_activity']
+
+
+def is_in_range(date: datetime, since: datetime, until: datetime) -> bool:
+    """ Returns whether a question asked at date is in the crawled range. Questions
+        whose date is unknown are kept. """
+
+    return date is None or ((since is None or date >= since) and (until is None or date < until))
+
+
+def include_in_range(since: datetime, until: datetime, dates: list, summary: dict) -> bool:
+    """ Listing summary filter of crawl_history: returns whether a question is in range,
+        adding its date to dates. """
+
+    date = get_summary_date(summary)
+    dates.append(date)
+    return is_in_range(date, since, until)
+
+
+def load_checkpoint(checkpoint_path: str) -> int:
+    """ Returns next page to crawl saved in the checkpoint, or None if there is none. """
+
+    try:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            return json.load(f)['next_page']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_checkpoint(checkpoint_path: str, next_page: int):
+    """ Saves next page to crawl, replacing the checkpoint atomically. """
+
+    temp_path = f"{checkpoint_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'next_page': next_page, 'saved_at': datetime.now().isoformat()}, f)
+    os.replace(temp_path, checkpoint_path)
+
+
+def remove_checkpoint(checkpoint_path: str):
+    """ Removes the checkpoint once a crawl has finished. """
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def crawl_history(first_page: int = 1, last_page: int = None, since: datetime = None,
+                  until: datetime = None, get_known_states=None,
+                  host: str = sites.DEFAULT_HOST):
+    """ Yields (page number, scraped questions, skipped count) of the site at host one
+        listing page at a time, between first_page and last_page and asked between since
+        and until. Questions out of range are filtered from the listing before their
+        answer pages are fetched. The skipped count is of questions in range left out
+        because their answers could not be fetched. Pages are scraped lazily, so the
+        caller saves the checkpoint once it has inserted a page. """
+
+    page = first_page
+
+    while last_page is None or page <= last_page:
+        dates = []
+        questions = scrape.extract_stack_exchange_history_data(
+            get_known_states, url=get_listing_url(page, host),
+            include=partial(include_in_range, since, until, dates))
+        if not dates:
+            break
+
+        in_range = sum(is_in_range(date, since, until) for date in dates)
+        logging.info("Crawled page %s: %s questions, %s in range, %s skipped.",
+                     page, len(dates), in_range, in_range - len(questions))
+        yield page, questions, in_range - len(questions)
+
+        known_dates = [date for date in dates if date is not None]
+        if since is not None and known_dates and min(known_dates) < since:
+            break
+        page += 1
+
+
+def get_checkpoint_path(host: str = sites.DEFAULT_HOST) -> str:
+    """ Returns path of the crawl checkpoint of the site at host: CRAWL_CHECKPOINT
+        with the site's name added, e.g. crawl_checkpoint_history.json. """
+
+    root, extension = os.path.splitext(environ.get("CRAWL_CHECKPOINT", "crawl_checkpoint.json"))
+    return f"{root}_{sites.get_site_name(host)}{extension}"
+
+
+def crawl_history_from_environment(get_known_states=None, host: str = sites.DEFAULT_HOST):
+    """ Runs crawl_history of the site at host with its range read from CRAWL_*
+        variables, resuming from the site's checkpoint if one was saved. """
+
+    first_page = int(environ.get("CRAWL_FIRST_PAGE", 1))
+    next_page = load_checkpoint(get_checkpoint_path(host))
+    if next_page and next_page > first_page:
+        logging.info("Resuming crawl from page %s.", next_page)
+        first_page = next_page
+
+    last_page = environ.get("CRAWL_LAST_PAGE")
+    return crawl_history(
+        first_page=first_page,
+        last_page=int(last_page) if last_page else None,
+        since=parse_date(environ.get("CRAWL_SINCE")),
+        until=parse_date(environ.get("CRAWL_UNTIL")),
+        get_known_states=get_known_states,
+        host=host)
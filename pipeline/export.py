@@ -0,0 +1,128 @@
+""" Exports what the dashboard reads - its rollups and the columns of the tables its
+    filtered queries scan - as a Parquet snapshot after each run, so the dashboard can
+    serve it without querying the database. Each export is written to a new directory
+    and published by replacing the CURRENT file, so readers never see a partial one. """
+
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+from os import environ
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from psycopg2.extensions import connection
+
+EXPORT_BATCH_SIZE = 50000
+EXPORTS_KEPT = 2
+ARROW_TYPES = {16: pa.bool_(), 20: pa.int64(), 21: pa.int64(), 23: pa.int64(),
+               700: pa.float64(), 701: pa.float64(), 1700: pa.float64(),
+               1114: pa.timestamp("us"), 1184: pa.timestamp("us", tz="UTC")}
+SNAPSHOT_QUERIES = {
+    "site": "SELECT site_id, site FROM Site",
+    "tag_rollup": """
+        SELECT site_id, tag, tag_count, total_votes, total_answers::BIGINT AS total_answers
+        FROM Tag_Rollup
+        """,
+    "tag_week_rollup": "SELECT site_id, tag, tag_count FROM Tag_Week_Rollup",
+    "question_hour_rollup": """
+        SELECT site_id, upload_hour, question_count FROM Question_Hour_Rollup
+        """,
+    "author_rollup": """
+        SELECT site_id, author_id, author_username, num_questions_asked, num_answers_written
+        FROM Author_Rollup
+        """,
+    "question": "SELECT site_id, question_id, question, upload_timestamp FROM Question",
+    "tag": "SELECT tag_id, tag FROM Tag",
+    "question_tag_assignment": """
+        SELECT tag_id, site_id, question_id FROM Question_Tag_Assignment
+        """,
+    "post_snapshot": """
+        SELECT post_type, site_id, post_id, captured_at, votes_change, views_change
+        FROM Post_Snapshot
+        WHERE post_type = 'question' AND captured_at >= %(since)s
+        """,
+    "etl_run": "SELECT run_id, mode, started_at, finished_at FROM ETL_Run",
+}
+
+
+def get_export_dir() -> str:
+    """ Returns directory of the dashboard snapshots, from EXPORT_DIR.
+        Exporting is off unless it is set. """
+
+    return environ.get("EXPORT_DIR", "")
+
+
+def get_schema(description) -> pa.Schema:
+    """ Returns Arrow schema of a query's columns, from their Postgres type OIDs.
+        Types without an Arrow equivalent listed in ARROW_TYPES are exported as text. """
+
+    return pa.schema([(column.name, ARROW_TYPES.get(column.type_code, pa.string()))
+                      for column in description])
+
+
+def to_arrow_array(values, arrow_type: pa.DataType) -> pa.Array:
+    """ Returns column values as an Arrow array, converting numerics to floats and
+        values exported as text to strings. """
+
+    if arrow_type == pa.float64():
+        values = [None if value is None else float(value) for value in values]
+    elif arrow_type == pa.string():
+        values = [None if value is None else str(value) for value in values]
+    return pa.array(values, type=arrow_type)
+
+
+def export_query(query: str, params: dict, path: str, conn: connection) -> int:
+    """ Writes the rows of a query to a Parquet file, EXPORT_BATCH_SIZE rows at a time
+        through a server-side cursor. Returns the number of rows written. """
+
+    rows_written = 0
+    with conn.cursor(name="export") as cur:
+        cur.itersize = EXPORT_BATCH_SIZE
+        cur.execute(query, params)
+        rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+        schema = get_schema(cur.description)
+
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            while True:
+                columns = list(zip(*rows)) if rows else [[] for _ in schema]
+                writer.write_table(pa.Table.from_arrays(
+                    [to_arrow_array(column, field.type)
+                     for column, field in zip(columns, schema)], schema=schema))
+                rows_written += len(rows)
+                rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+
+    return rows_written
+
+
+def export_snapshot(conn: connection, export_dir: str = None) -> str:
+    """ Exports the dashboard's data to a new snapshot directory and points CURRENT at
+        it, then removes all but the newest EXPORTS_KEPT snapshots. Votes and views
+        history of the past EXPORT_SNAPSHOT_DAYS days (default 30) is included.
+        Returns the snapshot directory. """
+
+    export_dir = export_dir or get_export_dir()
+    name = datetime.now().strftime("snapshot_%Y%m%dT%H%M%S%f")
+    snapshot_dir = os.path.join(export_dir, name)
+    os.makedirs(snapshot_dir)
+
+    since = datetime.now() - timedelta(days=int(environ.get("EXPORT_SNAPSHOT_DAYS", 30)))
+    for table, query in SNAPSHOT_QUERIES.items():
+        rows = export_query(query, {'since': since},
+                            os.path.join(snapshot_dir, f"{table}.parquet"), conn)
+        logging.info("Exported %s rows of %s.", rows, table)
+    conn.commit()
+
+    temp_path = os.path.join(export_dir, f"CURRENT.{os.getpid()}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(name)
+    os.replace(temp_path, os.path.join(export_dir, "CURRENT"))
+
+    snapshots = sorted(entry for entry in os.listdir(export_dir)
+                       if entry.startswith("snapshot_"))
+    for old in snapshots[:-EXPORTS_KEPT]:
+        shutil.rmtree(os.path.join(export_dir, old), ignore_errors=True)
+
+    return snapshot_dir
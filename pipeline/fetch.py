@@ -0,0 +1,291 @@
+""" Shared HTTP session and on-disk response cache for the StackExchange scraper.
+    Cached pages are revalidated with ETag/Last-Modified headers, so unchanged pages
+    come back as 304 responses carrying the cached body. Requests to each host are
+    rate limited, and throttled or failed requests are retried with backoff. """
+
+import hashlib
+import json
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from os import environ
+from threading import Lock, get_ident
+from urllib.parse import urlparse
+
+import requests as req
+from requests.adapters import HTTPAdapter
+
+import metrics
+from rate_limit import AdaptiveTokenBucket
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_STATUSES = {429, 503}
+
+cache_lock = Lock()
+rate_limits = {}
+rate_limits_lock = Lock()
+
+
+@lru_cache(maxsize=1)
+def get_session() -> req.Session:
+    """ Returns the session shared by the whole pipeline, keeping connections alive
+        in a pool sized by HTTP_POOL_SIZE. """
+
+    pool_size = int(environ.get("HTTP_POOL_SIZE", 10))
+    session = req.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_cache_dir() -> str:
+    """ Returns directory of the response cache, from HTTP_CACHE_DIR.
+        An empty value disables the cache. """
+
+    return environ.get("HTTP_CACHE_DIR", "http_cache")
+
+
+def get_cache_paths(url: str) -> tuple[str, str]:
+    """ Returns paths of the body and metadata files caching a URL. """
+
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    base = os.path.join(get_cache_dir(), key)
+    return f"{base}.body", f"{base}.json"
+
+
+def write_file(path: str, content: bytes):
+    """ Writes file atomically so readers never see a partial entry. The temporary file
+        is named after the process and thread, so concurrent writers never share it. """
+
+    temp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def read_cache_entry(url: str) -> dict:
+    """ Returns cached metadata and body for a URL, or None if it is not cached. """
+
+    body_path, meta_path = get_cache_paths(url)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        with open(body_path, "rb") as f:
+            entry["body"] = f.read()
+    except (OSError, ValueError):
+        return None
+    return entry
+
+
+def write_cache_entry(url: str, response: req.Response):
+    """ Stores response body and its validators. Responses without an ETag or
+        Last-Modified header cannot be revalidated and are not cached. """
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if not etag and not last_modified:
+        return
+
+    body_path, meta_path = get_cache_paths(url)
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    write_file(body_path, response.content)
+    write_meta(meta_path, {"url": url,
+                           "etag": etag,
+                           "last_modified": last_modified,
+                           "encoding": response.encoding,
+                           "validated_at": time.time()})
+
+
+def write_meta(meta_path: str, meta: dict):
+    """ Writes metadata of a cache entry. """
+
+    write_file(meta_path, json.dumps(meta).encode("utf-8"))
+
+
+def record_response(url: str, status: int, size: int, seconds: float, cache: str):
+    """ Records latency, status and body size of a response received from the network. """
+
+    host = urlparse(url).netloc
+    metrics.observe("http_request_duration_seconds", seconds, host=host)
+    metrics.increment("http_requests_total", host=host, status=status, cache=cache)
+    metrics.increment("http_response_bytes_total", size, host=host)
+
+
+def get_rate_limit(host: str) -> AdaptiveTokenBucket:
+    """ Returns the rate limiter shared by all requests to a host. It starts at HTTP_RATE
+        requests per second with bursts of HTTP_BURST, and adapts between HTTP_MIN_RATE
+        and HTTP_MAX_RATE, gaining HTTP_RATE_INCREASE per successful request. """
+
+    with rate_limits_lock:
+        if host not in rate_limits:
+            rate_limits[host] = AdaptiveTokenBucket(
+                host,
+                rate=float(environ.get("HTTP_RATE", 4)),
+                burst=int(environ.get("HTTP_BURST", 8)),
+                min_rate=float(environ.get("HTTP_MIN_RATE", 0.2)),
+                max_rate=float(environ.get("HTTP_MAX_RATE", 15)),
+                increase=float(environ.get("HTTP_RATE_INCREASE", 0.1)))
+        return rate_limits[host]
+
+
+def get_rate_limit_stats() -> list[dict]:
+    """ Returns statistics of every host's rate limiter for this run. """
+
+    with rate_limits_lock:
+        buckets = list(rate_limits.values())
+    return [bucket.stats() for bucket in buckets]
+
+
+def get_backoff_max() -> float:
+    """ Returns the longest wait before a retry, from HTTP_BACKOFF_MAX. """
+
+    return float(environ.get("HTTP_BACKOFF_MAX", 60))
+
+
+def get_retry_after(response: req.Response) -> float:
+    """ Returns seconds the server asked to wait in Retry-After, as a number of seconds
+        or an HTTP date, capped at HTTP_BACKOFF_MAX. None if it did not ask. """
+
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    try:
+        seconds = float(retry_after)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(retry_after).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), get_backoff_max())
+
+
+def get_backoff(attempt: int) -> float:
+    """ Returns a random wait before retry number attempt + 1: exponential backoff from
+        HTTP_BACKOFF_BASE seconds with full jitter, capped at HTTP_BACKOFF_MAX. """
+
+    base = float(environ.get("HTTP_BACKOFF_BASE", 0.5))
+    return random.uniform(0, min(get_backoff_max(), base * 2 ** attempt))
+
+
+def get_timeout() -> float:
+    """ Returns seconds before a request times out, from HTTP_TIMEOUT. """
+
+    return float(environ.get("HTTP_TIMEOUT", 15))
+
+
+def get_with_retries(url: str, headers: dict, timeout: float, cache: str) -> req.Response:
+    """ Gets URL through the shared session under its host's rate limit. Connection
+        errors, timeouts and 429/5xx responses are retried up to HTTP_MAX_RETRIES times,
+        waiting for Retry-After when given, otherwise backing off. Returns the last
+        response, or raises the last connection error, once retries run out. """
+
+    host = urlparse(url).netloc
+    rate_limit = get_rate_limit(host)
+    max_retries = int(environ.get("HTTP_MAX_RETRIES", 4))
+
+    for attempt in range(max_retries + 1):
+        rate_limit.acquire()
+        start = time.perf_counter()
+        try:
+            response = get_session().get(url, headers=headers, timeout=timeout)
+        except (req.ConnectionError, req.Timeout) as e:
+            metrics.increment("http_errors_total", host=host, error=type(e).__name__)
+            if attempt == max_retries:
+                raise
+            metrics.increment("http_retries_total", host=host, reason=type(e).__name__)
+            time.sleep(get_backoff(attempt))
+            continue
+
+        record_response(url, response.status_code, len(response.content),
+                        time.perf_counter() - start,
+                        "revalidated" if cache == "miss" and response.status_code == 304
+                        else cache)
+        if response.status_code not in RETRY_STATUSES:
+            rate_limit.on_success()
+            return response
+
+        retry_after = get_retry_after(response)
+        if response.status_code in THROTTLE_STATUSES:
+            rate_limit.on_throttled(retry_after or 0.0)
+        if attempt == max_retries:
+            return response
+        metrics.increment("http_retries_total", host=host, reason=str(response.status_code))
+        time.sleep(retry_after if retry_after is not None else get_backoff(attempt))
+
+    return response
+
+
+def cached_get(url: str, timeout: float = None) -> req.Response:
+    """ Gets URL through the shared session, timing out after HTTP_TIMEOUT seconds
+        unless timeout is given. If the page is cached, sends a conditional request and,
+        on 304 Not Modified, fills the response with the cached body. """
+
+    timeout = timeout or get_timeout()
+    if not get_cache_dir():
+        return get_with_retries(url, {}, timeout, "disabled")
+
+    entry = read_cache_entry(url)
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = get_with_retries(url, headers, timeout, "miss")
+
+    if response.status_code == 304 and entry:
+        response._content = entry["body"]  # pylint: disable=protected-access
+        response.encoding = entry["encoding"]
+        response.from_cache = True
+        entry["validated_at"] = time.time()
+        write_meta(get_cache_paths(url)[1],
+                   {key: value for key, value in entry.items() if key != "body"})
+    elif response.status_code == 200:
+        response.from_cache = False
+        write_cache_entry(url, response)
+
+    return response
+
+
+def evict_cache():
+    """ Removes cache entries not validated within HTTP_CACHE_MAX_AGE_DAYS, then the
+        least recently validated entries until the cache fits in HTTP_CACHE_MAX_MB. """
+
+    cache_dir = get_cache_dir()
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return
+
+    max_age = float(environ.get("HTTP_CACHE_MAX_AGE_DAYS", 7)) * 86400
+    max_bytes = float(environ.get("HTTP_CACHE_MAX_MB", 200)) * 1024 * 1024
+    now = time.time()
+
+    with cache_lock:
+        entries = []
+        for name in os.listdir(cache_dir):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(cache_dir, name)
+            body_path = f"{meta_path[:-len('.json')]}.body"
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    validated_at = json.load(f).get("validated_at", 0)
+                size = os.path.getsize(body_path) + os.path.getsize(meta_path)
+            except (OSError, ValueError):
+                validated_at, size = 0, 0
+            entries.append((validated_at, size, meta_path, body_path))
+
+        entries.sort()
+        total = sum(size for _, size, _, _ in entries)
+
+        for validated_at, size, meta_path, body_path in entries:
+            if now - validated_at <= max_age and total <= max_bytes:
+                break
+            for path in (meta_path, body_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
@@ -0,0 +1,66 @@
+""" In-process cache of database ids for names that repeat across a run,
+    such as author usernames and tags. """
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class IdCache:
+    """ Size-bounded mapping of name to id, evicting the least recently used name.
+        Counts hits and misses so the pipeline can report how well it is warmed. """
+
+    def __init__(self, name: str, max_size: int):
+        self.name = name
+        self.max_size = max_size
+        self.ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key) -> int:
+        """ Returns cached id for key, or None on a miss. """
+
+        with self.lock:
+            if key in self.ids:
+                self.ids.move_to_end(key)
+                self.hits += 1
+                return self.ids[key]
+            self.misses += 1
+            return None
+
+    def get_many(self, keys) -> tuple[dict, list]:
+        """ Returns ({key: id} for cached keys, [keys that missed]). """
+
+        found, missing = {}, []
+        for key in keys:
+            key_id = self.get(key)
+            if key_id is None:
+                missing.append(key)
+            else:
+                found[key] = key_id
+        return found, missing
+
+    def put(self, key, key_id: int):
+        """ Caches id for key, evicting the least recently used key when full. """
+
+        self.put_many({key: key_id})
+
+    def put_many(self, ids: dict):
+        """ Caches all given {key: id}. """
+
+        with self.lock:
+            for key, key_id in ids.items():
+                self.ids[key] = key_id
+                self.ids.move_to_end(key)
+            while len(self.ids) > self.max_size:
+                self.ids.popitem(last=False)
+
+    def stats(self) -> dict:
+        """ Returns size, hits, misses and hit ratio of the cache. """
+
+        lookups = self.hits + self.misses
+        return {'cache': self.name,
+                'size': len(self.ids),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0}
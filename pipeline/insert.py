@@ -2,23 +2,219 @@
     (Relational database). """
 
 import json
+from datetime import datetime, timedelta
 from os import environ
 from dotenv import load_dotenv
 
-from psycopg2 import connect
+from psycopg2 import connect, errors, sql
 from psycopg2.extensions import connection, cursor
 from psycopg2.extras import RealDictCursor, execute_values
 
+import id_cache
+import metrics
+import records
+import sites
+
+BULK_PAGE_SIZE = 1000
+ID_CACHE_SIZE = int(environ.get("ID_CACHE_SIZE", 50000))
+
+author_ids = id_cache.IdCache("author", ID_CACHE_SIZE)
+tag_ids = id_cache.IdCache("tag", ID_CACHE_SIZE)
+site_ids = id_cache.IdCache("site", ID_CACHE_SIZE)
+snapshot_partitions = set()
+
+# Statements shared with the asyncio pipeline, which numbers their %s parameters.
+SNAPSHOT_PARTITION_QUERY = "SELECT to_regclass(%s) IS NULL AS missing;"
+
+SNAPSHOT_PARTITION_LOCK_QUERY = "SELECT pg_advisory_xact_lock(hashtext(%s));"
+
+WARM_ID_CACHES_QUERY = """
+    (SELECT 'author' AS kind, author_username AS name, author_id AS id
+     FROM Author ORDER BY author_id DESC LIMIT %s)
+    UNION ALL
+    (SELECT 'tag' AS kind, tag AS name, tag_id AS id
+     FROM Tag ORDER BY tag_id DESC LIMIT %s)
+    UNION ALL
+    (SELECT 'site' AS kind, site AS name, site_id AS id
+     FROM Site ORDER BY site_id DESC LIMIT %s);
+"""
+
+QUESTION_STATES_QUERY = """
+    SELECT q.question_id, q.answer_count, q.last_activity, q.votes, q.views
+    FROM Question q
+    JOIN Site s ON s.site_id = q.site_id
+    WHERE s.site = %s AND q.question_id = ANY(%s);
+"""
+
+STAGE_TABLES_QUERY = """
+    CREATE TEMP TABLE IF NOT EXISTS Question_Stage (
+        site_id SMALLINT, question_id INT, author_id INT, question TEXT, votes INT,
+        views INT, upload_timestamp TIMESTAMP, last_activity TIMESTAMP, answer_count INT
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS Answer_Stage (
+        site_id SMALLINT, answer_id INT, answer TEXT, votes INT, question_id INT,
+        author_id INT, upload_timestamp TIMESTAMP
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS Question_Tag_Stage (
+        tag_id INT, site_id SMALLINT, question_id INT
+    ) ON COMMIT DELETE ROWS;
+"""
+
+# Adds what the staged batch changes to the dashboard rollups, comparing it with the
+# stored rows, so it runs before the batch is merged. Only new questions, answers and
+# tag assignments and changed question votes count, as merges change nothing else.
+# Each rollup is upserted in key order, so concurrent writers lock rows in one order.
+ROLLUP_STAGED_QUERY = """
+    WITH new_questions AS (
+        SELECT s.site_id, s.author_id, s.upload_timestamp
+        FROM Question_Stage s
+        WHERE NOT EXISTS (SELECT 1 FROM Question q
+                          WHERE q.site_id = s.site_id AND q.question_id = s.question_id)
+    ), new_answers AS (
+        SELECT s.site_id, s.question_id, s.author_id
+        FROM Answer_Stage s
+        WHERE NOT EXISTS (SELECT 1 FROM Answer a
+                          WHERE a.site_id = s.site_id AND a.answer_id = s.answer_id)
+    ), new_answer_counts AS (
+        SELECT site_id, question_id, COUNT(*) AS answer_count
+        FROM new_answers
+        GROUP BY site_id, question_id
+    ), assignments AS (
+        SELECT qt.tag_id, qt.site_id, qt.question_id, FALSE AS is_new
+        FROM Question_Tag_Assignment qt
+        JOIN Question_Stage s ON s.site_id = qt.site_id AND s.question_id = qt.question_id
+        UNION ALL
+        SELECT DISTINCT st.tag_id, st.site_id, st.question_id, TRUE
+        FROM Question_Tag_Stage st
+        WHERE NOT EXISTS (SELECT 1 FROM Question_Tag_Assignment qt
+                          WHERE qt.tag_id = st.tag_id AND qt.site_id = st.site_id
+                              AND qt.question_id = st.question_id)
+    ), tag_changes AS (
+        SELECT qt.site_id, t.tag,
+            COUNT(*) FILTER (WHERE qt.is_new) AS tag_count,
+            SUM(COALESCE(s.votes, 0) - CASE WHEN qt.is_new THEN 0
+                                            ELSE COALESCE(q.votes, 0) END) AS total_votes,
+            SUM(COALESCE(n.answer_count, 0)
+                + CASE WHEN qt.is_new THEN (SELECT COUNT(*) FROM Answer a
+                                            WHERE a.site_id = qt.site_id
+                                                AND a.question_id = qt.question_id)
+                       ELSE 0 END) AS total_answers
+        FROM assignments qt
+        JOIN Tag t ON t.tag_id = qt.tag_id
+        JOIN Question_Stage s ON s.site_id = qt.site_id AND s.question_id = qt.question_id
+        LEFT JOIN Question q ON q.site_id = qt.site_id AND q.question_id = qt.question_id
+        LEFT JOIN new_answer_counts n
+            ON n.site_id = qt.site_id AND n.question_id = qt.question_id
+        GROUP BY qt.site_id, t.tag
+    ), tag_rollup AS (
+        INSERT INTO Tag_Rollup (site_id, tag, tag_count, total_votes, total_answers)
+        SELECT site_id, tag, tag_count, total_votes, total_answers
+        FROM tag_changes
+        WHERE (tag_count, total_votes, total_answers) <> (0, 0, 0)
+        ORDER BY site_id, tag
+        ON CONFLICT (site_id, tag)
+        DO UPDATE SET
+            tag_count = Tag_Rollup.tag_count + EXCLUDED.tag_count,
+            total_votes = Tag_Rollup.total_votes + EXCLUDED.total_votes,
+            total_answers = Tag_Rollup.total_answers + EXCLUDED.total_answers
+    ), question_hour_rollup AS (
+        INSERT INTO Question_Hour_Rollup (site_id, upload_hour, question_count)
+        SELECT site_id, DATE_PART('hour', upload_timestamp), COUNT(*)
+        FROM new_questions
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (site_id, upload_hour)
+        DO UPDATE SET
+            question_count = Question_Hour_Rollup.question_count + EXCLUDED.question_count
+    )
+    INSERT INTO Author_Rollup (site_id, author_id, author_username, num_questions_asked,
+                               num_answers_written)
+    SELECT posts.site_id, posts.author_id, a.author_username,
+        COUNT(*) FILTER (WHERE posts.is_question),
+        COUNT(*) FILTER (WHERE NOT posts.is_question)
+    FROM (
+        SELECT site_id, author_id, TRUE AS is_question FROM new_questions
+        UNION ALL
+        SELECT site_id, author_id, FALSE FROM new_answers
+    ) posts
+    JOIN Author a ON a.author_id = posts.author_id
+    GROUP BY posts.site_id, posts.author_id, a.author_username
+    ORDER BY posts.site_id, posts.author_id
+    ON CONFLICT (site_id, author_id)
+    DO UPDATE SET
+        num_questions_asked = Author_Rollup.num_questions_asked
+            + EXCLUDED.num_questions_asked,
+        num_answers_written = Author_Rollup.num_answers_written
+            + EXCLUDED.num_answers_written;
+"""
+
+SNAPSHOT_STAGED_QUESTIONS_QUERY = """
+    INSERT INTO Post_Snapshot (post_type, site_id, post_id, captured_at, votes, views,
+                               votes_change, views_change)
+    SELECT 'question', s.site_id, s.question_id, %s::TIMESTAMP, s.votes, s.views,
+        s.votes - q.votes, s.views - q.views
+    FROM Question_Stage s
+    LEFT JOIN Question q ON q.site_id = s.site_id AND q.question_id = s.question_id
+    WHERE q.question_id IS NULL
+        OR (q.votes, q.views) IS DISTINCT FROM (s.votes, s.views);
+"""
+
+SNAPSHOT_STAGED_ANSWERS_QUERY = """
+    INSERT INTO Post_Snapshot (post_type, site_id, post_id, captured_at, votes,
+                               votes_change)
+    SELECT 'answer', s.site_id, s.answer_id, %s::TIMESTAMP, s.votes, s.votes - a.votes
+    FROM Answer_Stage s
+    LEFT JOIN Answer a ON a.site_id = s.site_id AND a.answer_id = s.answer_id
+    WHERE a.answer_id IS NULL OR a.votes IS DISTINCT FROM s.votes;
+"""
+
+MERGE_STAGED_QUESTIONS_QUERY = """
+    INSERT INTO Question (site_id, question_id, author_id, question, votes, views,
+                          upload_timestamp, last_activity, answer_count)
+    SELECT site_id, question_id, author_id, question, votes, views, upload_timestamp,
+        last_activity, answer_count
+    FROM Question_Stage
+    ON CONFLICT (site_id, question_id)
+    DO UPDATE SET
+        votes = EXCLUDED.votes,
+        views = EXCLUDED.views,
+        last_activity = EXCLUDED.last_activity,
+        answer_count = EXCLUDED.answer_count
+    WHERE (Question.votes, Question.views, Question.last_activity, Question.answer_count)
+        IS DISTINCT FROM (EXCLUDED.votes, EXCLUDED.views, EXCLUDED.last_activity,
+                          EXCLUDED.answer_count);
+"""
+
+MERGE_STAGED_QUESTION_TAGS_QUERY = """
+    INSERT INTO Question_Tag_Assignment (tag_id, site_id, question_id)
+    SELECT tag_id, site_id, question_id
+    FROM Question_Tag_Stage
+    ON CONFLICT DO NOTHING;
+"""
+
+MERGE_STAGED_ANSWERS_QUERY = """
+    INSERT INTO Answer (site_id, answer_id, answer, votes, question_id, author_id,
+                        upload_timestamp)
+    SELECT site_id, answer_id, answer, votes, question_id, author_id, upload_timestamp
+    FROM Answer_Stage
+    ON CONFLICT (site_id, answer_id)
+    DO UPDATE SET
+        votes = EXCLUDED.votes
+    WHERE Answer.votes IS DISTINCT FROM EXCLUDED.votes;
+"""
+
 
 def get_connection() -> connection:
-    """ Retrieves connection and returns it. """
+    """ Retrieves connection and returns it. Its statements and commits are
+        recorded in the run's metrics. """
     load_dotenv()
     return connect(
         user=environ['DB_USERNAME'],
         password=environ['DB_PASSWORD'],
         host=environ['DB_IP'],
         port=environ['DB_PORT'],
-        dbname=environ['DB_NAME']
+        dbname=environ['DB_NAME'],
+        connection_factory=metrics.InstrumentedConnection
     )
 
 
@@ -27,17 +223,55 @@ def get_cursor(conn: connection) -> cursor:
     return conn.cursor(cursor_factory=RealDictCursor)
 
 
-def load_data():
-    """ Load json as dictionary """
+def load_data() -> list[records.Question]:
+    """ Load json as question records """
     with open('data.json', 'r', encoding='utf-8') as f:
         data = json.load(f)
 
-    return data
+    return [records.question_from_dict(question) for question in data]
+
+
+def warm_id_caches(conn: connection):
+    """ Fills the author, tag and site id caches with the most recently added authors,
+        tags and sites, in one query. """
+
+    with get_cursor(conn) as cur:
+        cur.execute(WARM_ID_CACHES_QUERY,
+                    (author_ids.max_size, tag_ids.max_size, site_ids.max_size))
+        put_warm_ids(cur.fetchall())
+
+
+def put_warm_ids(rows):
+    """ Fills the id caches from rows of WARM_ID_CACHES_QUERY. """
+
+    author_ids.put_many({row['name']: row['id'] for row in rows if row['kind'] == 'author'})
+    tag_ids.put_many({row['name']: row['id'] for row in rows if row['kind'] == 'tag'})
+    site_ids.put_many({row['name']: row['id'] for row in rows if row['kind'] == 'site'})
+
+
+def load_question_states(question_ids: list[int], conn: connection,
+                         site: str = sites.DEFAULT_SITE) -> dict:
+    """ Returns the listing's answer count, last activity time, votes and views stored
+        for each known question of a site, as
+        {question_id: (answer_count, last_activity, votes, views)}. """
 
+    with get_cursor(conn) as cur:
+        cur.execute(QUESTION_STATES_QUERY, (site, list(question_ids)))
+        rows = cur.fetchall()
 
-def upload_author(author: str, conn: connection) -> int:
-    """ Uploads author details to database and returns author id.
-        If author exists, returns author id. """
+    return {row['question_id']: (row['answer_count'], row['last_activity'],
+                                 row['votes'], row['views'])
+            for row in rows}
+
+
+def upload_author(author: str, conn: connection, new_ids: dict) -> int:
+    """ Uploads author details to database and returns author id, without committing.
+        If author exists, returns author id. Ids not already cached are added to new_ids,
+        for the caller to cache once it has committed. """
+
+    author_id = author_ids.get(author) or new_ids.get(author)
+    if author_id is not None:
+        return author_id
 
     query = """
         WITH new_authors AS (
@@ -57,44 +291,166 @@ def upload_author(author: str, conn: connection) -> int:
 
     author_id = cur.fetchall()[0]['author_id']
 
-    conn.commit()
     cur.close()
+    new_ids[author] = author_id
 
     return author_id
 
 
+def upload_site(site: str, conn: connection, new_ids: dict) -> int:
+    """ Uploads site to database and returns its site id, without committing.
+        If site exists, returns site id. Ids not already cached are added to new_ids. """
+
+    site_id = site_ids.get(site) or new_ids.get(site)
+    if site_id is not None:
+        return site_id
+
+    query = """
+        WITH new_sites AS (
+            INSERT INTO Site (site)
+            VALUES (%s)
+            ON CONFLICT (site) DO NOTHING
+            RETURNING site_id
+        )
+        SELECT site_id FROM new_sites
+        UNION ALL
+        SELECT site_id FROM Site WHERE site = %s
+        LIMIT 1;
+    """
+
+    cur = get_cursor(conn)
+    cur.execute(query, (site, site))
+    site_id = cur.fetchall()[0]['site_id']
+
+    cur.close()
+    new_ids[site] = site_id
+
+    return site_id
+
+
+def get_snapshot_partition(day: datetime) -> tuple[str, str]:
+    """ Returns name of the Post_Snapshot partition holding the given day, and the
+        statement creating it if it does not exist. """
+
+    name = f"post_snapshot_{day:%Y%m%d}"
+    start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    return name, f"""
+        CREATE TABLE IF NOT EXISTS {name} PARTITION OF Post_Snapshot
+        FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{start + timedelta(days=1):%Y-%m-%d}');
+    """
+
+
+def create_snapshot_partition(day: datetime, conn: connection) -> str:
+    """ Creates the Post_Snapshot partition holding the given day if it does not exist
+        yet, in its own committed transaction, and returns its name. Run before a batch's
+        transaction starts. Site processes creating the same partition at once take an
+        advisory lock on its name, so only the first creates it. Partitions known to
+        exist in a database are not checked again. """
+
+    name, create_query = get_snapshot_partition(day)
+    if (conn.dsn, name) in snapshot_partitions:
+        return name
+
+    try:
+        with get_cursor(conn) as cur:
+            cur.execute(SNAPSHOT_PARTITION_QUERY, (name,))
+            if cur.fetchone()['missing']:
+                cur.execute(SNAPSHOT_PARTITION_LOCK_QUERY, (name,))
+                cur.execute(create_query)
+        conn.commit()
+    except (errors.DuplicateTable, errors.UniqueViolation):
+        conn.rollback()
+
+    snapshot_partitions.add((conn.dsn, name))
+    return name
+
+
+def snapshot_questions(question_rows: list[tuple], captured_at: datetime, cur: cursor):
+    """ Records (site_id, question_id, votes, views) in Post_Snapshot for questions that are new
+        or whose votes or views differ from the stored question, with the change since it
+        was stored. Run before the questions are upserted, once the partition of captured_at
+        exists. """
+
+    if not question_rows:
+        return
+
+    execute_values(cur, """
+        INSERT INTO Post_Snapshot (post_type, site_id, post_id, captured_at, votes, views,
+                                   votes_change, views_change)
+        SELECT 'question', v.site_id, v.question_id, v.captured_at, v.votes, v.views,
+            v.votes - q.votes, v.views - q.views
+        FROM (VALUES %s) AS v(site_id, question_id, votes, views, captured_at)
+        LEFT JOIN Question q ON q.site_id = v.site_id AND q.question_id = v.question_id
+        WHERE q.question_id IS NULL
+            OR (q.votes, q.views) IS DISTINCT FROM (v.votes, v.views);
+    """, [(*row, captured_at) for row in question_rows],
+        template="(%s::SMALLINT, %s::INT, %s::INT, %s::INT, %s::TIMESTAMP)",
+        page_size=BULK_PAGE_SIZE)
+
+
+def snapshot_answers(answer_rows: list[tuple], captured_at: datetime, cur: cursor):
+    """ Records (site_id, answer_id, votes) in Post_Snapshot for answers that are new or whose
+        votes differ from the stored answer. Run before the answers are upserted. """
+
+    if not answer_rows:
+        return
+
+    execute_values(cur, """
+        INSERT INTO Post_Snapshot (post_type, site_id, post_id, captured_at, votes,
+                                   votes_change)
+        SELECT 'answer', v.site_id, v.answer_id, v.captured_at, v.votes, v.votes - a.votes
+        FROM (VALUES %s) AS v(site_id, answer_id, votes, captured_at)
+        LEFT JOIN Answer a ON a.site_id = v.site_id AND a.answer_id = v.answer_id
+        WHERE a.answer_id IS NULL OR a.votes IS DISTINCT FROM v.votes;
+    """, [(*row, captured_at) for row in answer_rows],
+        template="(%s::SMALLINT, %s::INT, %s::INT, %s::TIMESTAMP)", page_size=BULK_PAGE_SIZE)
+
+
 def upload_question(question_data: dict, author_id: int,  conn: connection) -> int:
-    """ Uploads question details to database and returns question id
-        If question exists, updates votes and views. """
+    """ Uploads question details to database and returns question id, without committing.
+        If question exists, updates votes and views when they changed.
+        Its snapshot is recorded beforehand, by insert_data_to_database. """
 
+    site_id = question_data['site_id']
     question_id = question_data['question_id']
     question = question_data['question']
     timestamp = question_data['timestamp']
     votes = question_data['votes']
     views = question_data['views']
+    last_activity = question_data.get('last_activity')
+    answer_count = question_data.get('answer_count')
 
     query = """
-        INSERT INTO Question (question_id, author_id, question, votes, views, upload_timestamp)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        ON CONFLICT (question_id)
+        INSERT INTO Question (site_id, question_id, author_id, question, votes, views,
+                              upload_timestamp, last_activity, answer_count)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (site_id, question_id)
         DO UPDATE SET
             votes = EXCLUDED.votes,
-            views = EXCLUDED.views;
+            views = EXCLUDED.views,
+            last_activity = EXCLUDED.last_activity,
+            answer_count = EXCLUDED.answer_count
+        WHERE (Question.votes, Question.views, Question.last_activity, Question.answer_count)
+            IS DISTINCT FROM (EXCLUDED.votes, EXCLUDED.views, EXCLUDED.last_activity,
+                              EXCLUDED.answer_count);
     """
 
     cur = get_cursor(conn)
-    cur.execute(query, (question_id, author_id,
-                        question, votes, views, timestamp))
+    cur.execute(query, (site_id, question_id, author_id,
+                        question, votes, views, timestamp, last_activity, answer_count))
 
-    conn.commit()
     cur.close()
 
     return question_id
 
 
-def upload_tag(tag: str, conn: connection) -> int:
-    """ Uploads tag to database and returns its tag id. 
-        If tag exists, returns tag id"""
+def upload_tag(tag: str, conn: connection, new_ids: dict) -> int:
+    """ Uploads tag to database and returns its tag id, without committing.
+        If tag exists, returns tag id. Ids not already cached are added to new_ids. """
+
+    tag_id = tag_ids.get(tag) or new_ids.get(tag)
+    if tag_id is not None:
+        return tag_id
 
     query = """
         WITH new_tags AS (
@@ -113,17 +469,18 @@ def upload_tag(tag: str, conn: connection) -> int:
     cur.execute(query, (tag, tag))
     tag_id = cur.fetchall()[0]['tag_id']
 
-    conn.commit()
     cur.close()
+    new_ids[tag] = tag_id
 
     return tag_id
 
 
 def upload_tags_question_assignment(question_tags_data: list[tuple], conn: connection):
-    """ Uploads tag and question link to database by their ids. """
+    """ Uploads tag and question links to database by their (tag_id, site_id, question_id),
+        without committing. """
 
     query = """
-        INSERT INTO Question_Tag_Assignment (tag_id, question_id)
+        INSERT INTO Question_Tag_Assignment (tag_id, site_id, question_id)
         VALUES %s
         ON CONFLICT DO NOTHING;
     """
@@ -131,75 +488,395 @@ def upload_tags_question_assignment(question_tags_data: list[tuple], conn: conne
     with conn.cursor() as cur:
         execute_values(cur, query, question_tags_data)
 
-    conn.commit()
-
 
 def upload_answer(answer_data: dict, question_id: int, author_id: int, conn: connection) -> int:
-    """ Uploads answer details to database and returns answer id.
-        If answer exists, updates votes. """
+    """ Uploads answer details to database and returns answer id, without committing.
+        If answer exists, updates votes when they changed.
+        Its snapshot is recorded beforehand, by insert_data_to_database. """
 
+    site_id = answer_data['site_id']
     answer_id = answer_data['answer_id']
     answer = answer_data['answer']
     votes = answer_data['votes']
     timestamp = answer_data['timestamp']
 
     query = """
-        INSERT INTO Answer (answer_id, answer, votes, question_id, author_id, upload_timestamp)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        ON CONFLICT (answer_id)
+        INSERT INTO Answer (site_id, answer_id, answer, votes, question_id, author_id,
+                            upload_timestamp)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (site_id, answer_id)
         DO UPDATE SET
-            votes = EXCLUDED.votes;
+            votes = EXCLUDED.votes
+        WHERE Answer.votes IS DISTINCT FROM EXCLUDED.votes;
     """
 
     cur = get_cursor(conn)
-    cur.execute(query, (answer_id, answer, votes,
+    cur.execute(query, (site_id, answer_id, answer, votes,
                         question_id, author_id, timestamp))
 
-    conn.commit()
     cur.close()
 
     return answer_id
 
 
-def insert_data_to_database(questions_data: dict):
+def snapshot_batch(questions_data: list[records.Question], batch_site_ids: dict,
+                   conn: connection):
+    """ Records changed votes and views of a batch's questions and answers in
+        Post_Snapshot, with one statement each, before any of them is upserted, without
+        committing. A question or answer appearing twice in the batch keeps its last
+        details. The day's partition is created first, in its own transaction. """
+
+    questions = {(question.site, question.question_id): question
+                 for question in questions_data}
+    answers = {(question.site, answer.answer_id): (answer, question)
+               for question in questions.values() for answer in question.answers}
+    if not questions:
+        return
+
+    captured_at = datetime.now()
+    with get_cursor(conn) as cur:
+        snapshot_questions([(batch_site_ids[question.site], question.question_id,
+                             question.votes, question.views)
+                            for question in questions.values()], captured_at, cur)
+        snapshot_answers([(batch_site_ids[question.site], answer.answer_id, answer.vote_count)
+                          for answer, question in answers.values()], captured_at, cur)
+
+
+def rollup_batch(questions_data: list[records.Question], batch_site_ids: dict,
+                 batch_author_ids: dict, batch_tag_ids: dict, conn: connection):
+    """ Adds what a batch changes to the dashboard rollups before any of it is upserted,
+        without committing. The batch is copied to the staging tables for this. """
+
+    questions = {(question.site, question.question_id): question
+                 for question in questions_data}
+    answers = {(question.site, answer.answer_id): (answer, question)
+               for question in questions.values() for answer in question.answers}
+
+    with get_cursor(conn) as cur:
+        create_stage_tables(cur)
+        copy_batch("Question_Stage", get_question_batch(
+            questions.values(), batch_site_ids, batch_author_ids), cur)
+        copy_batch("Answer_Stage", get_answer_batch(
+            answers.values(), batch_site_ids, batch_author_ids), cur)
+        copy_batch("Question_Tag_Stage", get_question_tag_batch(
+            questions.values(), batch_site_ids, batch_tag_ids), cur)
+        rollup_staged(cur)
+
+
+def insert_data_to_database(questions_data: list[records.Question], conn: connection = None):
     """ Uploads question data to AWS RDS database: author of question, question, question tags, 
-        author of answers, answers. """
-
-    conn = get_connection()
-
-    for question in questions_data:
-        question_id = question['question_id']
-
-        # insert author's username:
-        author_id = upload_author(question['username'], conn)
-
-        # insert question:
-        upload_question(
-            {'question_id': question_id,
-             'question': question['title'],
-             'timestamp': question['timestamp'],
-             'votes': question['votes'],
-             'views': question['views']
-             },
-            author_id,  conn)
-
-        # inserts tags, and tag question assignments:
-        tag_ids = [upload_tag(tag, conn) for tag in question['tags']]
-        tags_questions = [(tag_id, question_id) for tag_id in tag_ids]
-        upload_tags_question_assignment(tags_questions, conn)
-
-        # insert author of answer and answer:
-        for answer in question['answers']:
-            answer_author_id = upload_author(answer['username'], conn)
-            upload_answer(
-                {'answer_id': answer['answer_id'],
-                 'answer': answer['answer'],
-                 'votes': answer['vote_count'],
-                 'timestamp': answer['timestamp'],
+        author of answers, answers. Opens its own connection unless one is given.
+        Changed votes and views of the whole batch are first recorded in Post_Snapshot,
+        and its changes added to the dashboard rollups.
+        The batch is committed once, so a failed upsert leaves no snapshots behind. """
+
+    own_connection = conn is None
+    if own_connection:
+        conn = get_connection()
+
+    new_site_ids, new_author_ids, new_tag_ids = {}, {}, {}
+    if questions_data:
+        create_snapshot_partition(datetime.now(), conn)
+
+    try:
+        batch_site_ids = {site: upload_site(site, conn, new_site_ids)
+                          for site in sorted({question.site for question in questions_data})}
+        batch_author_ids = {author: upload_author(author, conn, new_author_ids)
+                            for author in sorted(get_batch_authors(questions_data))}
+        batch_tag_ids = {tag: upload_tag(tag, conn, new_tag_ids)
+                         for tag in sorted({tag for question in questions_data
+                                            for tag in question.tags})}
+        rollup_batch(questions_data, batch_site_ids, batch_author_ids, batch_tag_ids, conn)
+        snapshot_batch(questions_data, batch_site_ids, conn)
+
+        for question in questions_data:
+            question_id = question.question_id
+            site_id = batch_site_ids[question.site]
+
+            # insert author's username:
+            author_id = batch_author_ids[question.username]
+
+            # insert question:
+            upload_question(
+                {'site_id': site_id,
+                 'question_id': question_id,
+                 'question': question.title,
+                 'timestamp': question.timestamp,
+                 'votes': question.votes,
+                 'views': question.views,
+                 'last_activity': question.last_activity,
+                 'answer_count': question.answer_count
                  },
-                question_id, answer_author_id, conn)
+                author_id,  conn)
+
+            # inserts tags, and tag question assignments:
+            question_tag_ids = [batch_tag_ids[tag] for tag in question.tags]
+            tags_questions = [(tag_id, site_id, question_id) for tag_id in question_tag_ids]
+            upload_tags_question_assignment(tags_questions, conn)
+
+            # insert author of answer and answer:
+            for answer in question.answers:
+                answer_author_id = batch_author_ids[answer.username]
+                upload_answer(
+                    {'site_id': site_id,
+                     'answer_id': answer.answer_id,
+                     'answer': answer.answer,
+                     'votes': answer.vote_count,
+                     'timestamp': answer.timestamp,
+                     },
+                    question_id, answer_author_id, conn)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_connection:
+            conn.close()
+
+    site_ids.put_many(new_site_ids)
+    author_ids.put_many(new_author_ids)
+    tag_ids.put_many(new_tag_ids)
+
+
+def get_batch_authors(questions_data: list[records.Question]) -> set:
+    """ Returns the usernames of a batch's question and answer authors. """
+
+    authors = {question.username for question in questions_data}
+    authors.update(answer.username
+                   for question in questions_data for answer in question.answers)
+    return authors
+
+
+def bulk_upload_authors(authors: set, cur: cursor) -> tuple[dict, dict]:
+    """ Uploads all new authors in one statement, looking up only authors missing
+        from the id cache. They are inserted in sorted order, so site workers adding
+        the same authors at once lock them in the same order and cannot deadlock.
+        Returns ({username: author_id} for every given author,
+        {username: author_id} read from the database, to cache once committed). """
+
+    cached, missing = author_ids.get_many(authors)
+    if not missing:
+        return cached, {}
+
+    execute_values(cur, """
+        INSERT INTO Author (author_username)
+        VALUES %s
+        ON CONFLICT (author_username) DO NOTHING;
+    """, [(author,) for author in sorted(missing)], page_size=BULK_PAGE_SIZE)
+
+    cur.execute("""
+        SELECT author_id, author_username FROM Author WHERE author_username = ANY(%s);
+    """, (missing,))
+
+    loaded = {row['author_username']: row['author_id'] for row in cur.fetchall()}
+    return cached | loaded, loaded
+
+
+def bulk_upload_tags(tags: set, cur: cursor) -> tuple[dict, dict]:
+    """ Uploads all new tags in one statement, looking up only tags missing from the
+        id cache, in sorted order like authors. Returns ({tag: tag_id} for every given tag,
+        {tag: tag_id} read from the database, to cache once committed). """
+
+    cached, missing = tag_ids.get_many(tags)
+    if not missing:
+        return cached, {}
+
+    execute_values(cur, """
+        INSERT INTO Tag (tag)
+        VALUES %s
+        ON CONFLICT (tag) DO NOTHING;
+    """, [(tag,) for tag in sorted(missing)], page_size=BULK_PAGE_SIZE)
+
+    cur.execute("""
+        SELECT tag_id, tag FROM Tag WHERE tag = ANY(%s);
+    """, (missing,))
 
-    conn.close()
+    loaded = {row['tag']: row['tag_id'] for row in cur.fetchall()}
+    return cached | loaded, loaded
+
+
+def bulk_upload_sites(site_names: set, cur: cursor) -> tuple[dict, dict]:
+    """ Uploads all new sites in one statement, looking up only sites missing from the
+        id cache. Returns ({site: site_id} for every given site,
+        {site: site_id} read from the database, to cache once committed). """
+
+    cached, missing = site_ids.get_many(site_names)
+    if not missing:
+        return cached, {}
+
+    execute_values(cur, """
+        INSERT INTO Site (site)
+        VALUES %s
+        ON CONFLICT (site) DO NOTHING;
+    """, [(site,) for site in sorted(missing)], page_size=BULK_PAGE_SIZE)
+
+    cur.execute("""
+        SELECT site_id, site FROM Site WHERE site = ANY(%s);
+    """, (missing,))
+
+    loaded = {row['site']: row['site_id'] for row in cur.fetchall()}
+    return cached | loaded, loaded
+
+
+def create_stage_tables(cur: cursor):
+    """ Creates the session's temporary tables that batches are copied into before
+        being merged, if they do not exist yet. They are emptied at every commit. """
+
+    cur.execute(STAGE_TABLES_QUERY)
+
+
+def copy_batch(table: str, batch: records.ColumnBatch, cur: cursor):
+    """ Writes a column batch to a table with COPY. """
+
+    cur.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table.lower()), sql.SQL(", ").join(map(sql.Identifier, batch.names))),
+        batch.to_copy_text())
+
+
+def get_question_batch(questions, batch_site_ids: dict,
+                       batch_author_ids: dict) -> records.ColumnBatch:
+    """ Returns column batch of questions in the columns of Question_Stage. """
+
+    batch = records.ColumnBatch({'site_id': "q", 'question_id': "q", 'author_id': "q",
+                                 'question': None, 'votes': "q", 'views': "q",
+                                 'upload_timestamp': None, 'last_activity': None,
+                                 'answer_count': "q"})
+    for question in questions:
+        batch.append(batch_site_ids[question.site], question.question_id,
+                     batch_author_ids[question.username], question.title,
+                     question.votes, question.views, question.timestamp,
+                     question.last_activity, question.answer_count)
+    return batch
+
+
+def get_question_tag_batch(questions, batch_site_ids: dict,
+                           batch_tag_ids: dict) -> records.ColumnBatch:
+    """ Returns column batch of the questions' tags in the columns of Question_Tag_Stage. """
+
+    batch = records.ColumnBatch({'tag_id': "q", 'site_id': "q", 'question_id': "q"})
+    for question in questions:
+        for tag in question.tags:
+            batch.append(batch_tag_ids[tag], batch_site_ids[question.site],
+                         question.question_id)
+    return batch
+
+
+def get_answer_batch(answers, batch_site_ids: dict,
+                     batch_author_ids: dict) -> records.ColumnBatch:
+    """ Returns column batch of (answer, question) pairs in the columns of Answer_Stage. """
+
+    batch = records.ColumnBatch({'site_id': "q", 'answer_id': "q", 'answer': None,
+                                 'votes': "q", 'question_id': "q", 'author_id': "q",
+                                 'upload_timestamp': None})
+    for answer, question in answers:
+        batch.append(batch_site_ids[question.site], answer.answer_id, answer.answer,
+                     answer.vote_count, question.question_id,
+                     batch_author_ids[answer.username], answer.timestamp)
+    return batch
+
+
+def snapshot_staged_questions(captured_at: datetime, cur: cursor):
+    """ Records the staged questions that are new or whose votes or views changed in
+        Post_Snapshot, as snapshot_questions does. Run before they are merged. """
+
+    cur.execute(SNAPSHOT_STAGED_QUESTIONS_QUERY, (captured_at,))
+
+
+def snapshot_staged_answers(captured_at: datetime, cur: cursor):
+    """ Records the staged answers that are new or whose votes changed in Post_Snapshot,
+        as snapshot_answers does. Run before they are merged. """
+
+    cur.execute(SNAPSHOT_STAGED_ANSWERS_QUERY, (captured_at,))
+
+
+def rollup_staged(cur: cursor):
+    """ Adds the changes of the staged questions, answers and tag assignments to the
+        dashboard rollups. Run once all of them are staged and before they are merged. """
+
+    cur.execute(ROLLUP_STAGED_QUERY)
+
+
+def bulk_upload_questions(cur: cursor):
+    """ Merges the staged questions in one statement. Existing questions get their
+        votes, views, last activity and answer count updated, as in upload_question. """
+
+    cur.execute(MERGE_STAGED_QUESTIONS_QUERY)
+
+
+def bulk_upload_tags_question_assignment(cur: cursor):
+    """ Merges the staged tag question links in one statement, without committing. """
+
+    cur.execute(MERGE_STAGED_QUESTION_TAGS_QUERY)
+
+
+def bulk_upload_answers(cur: cursor):
+    """ Merges the staged answers in one statement. Existing answers get their votes
+        updated, as in upload_answer. """
+
+    cur.execute(MERGE_STAGED_ANSWERS_QUERY)
+
+
+def bulk_insert_data_to_database(questions_data: list[records.Question], conn: connection,
+                                 snapshot: bool = True):
+    """ Uploads a batch of question data with a few set-based statements in a single
+        transaction: sites, authors, tags, questions, tag question assignments, answers.
+        Questions, answers and tag links are copied into staging tables with COPY, added
+        to the dashboard rollups and merged from there.
+        A question or answer appearing twice in the batch keeps its last details.
+        Unless snapshot is False, changed votes and views are recorded in Post_Snapshot. """
+
+    authors = get_batch_authors(questions_data)
+    tags = {tag for question in questions_data for tag in question.tags}
+    site_names = {question.site for question in questions_data}
+    captured_at = datetime.now()
+    if snapshot:
+        create_snapshot_partition(captured_at, conn)
+
+    try:
+        with get_cursor(conn) as cur:
+            create_stage_tables(cur)
+            batch_site_ids, new_site_ids = bulk_upload_sites(site_names, cur)
+            batch_author_ids, new_author_ids = bulk_upload_authors(authors, cur)
+            batch_tag_ids, new_tag_ids = bulk_upload_tags(tags, cur)
+
+            questions = {(question.site, question.question_id): question
+                         for question in questions_data}
+            answers = {(question.site, answer.answer_id): (answer, question)
+                       for question in questions.values()
+                       for answer in question.answers}
+            copy_batch("Question_Stage", get_question_batch(
+                questions.values(), batch_site_ids, batch_author_ids), cur)
+            copy_batch("Answer_Stage", get_answer_batch(
+                answers.values(), batch_site_ids, batch_author_ids), cur)
+            copy_batch("Question_Tag_Stage", get_question_tag_batch(
+                questions.values(), batch_site_ids, batch_tag_ids), cur)
+            rollup_staged(cur)
+
+            if snapshot:
+                snapshot_staged_questions(captured_at, cur)
+                snapshot_staged_answers(captured_at, cur)
+            bulk_upload_questions(cur)
+            bulk_upload_tags_question_assignment(cur)
+            bulk_upload_answers(cur)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    site_ids.put_many(new_site_ids)
+    author_ids.put_many(new_author_ids)
+    tag_ids.put_many(new_tag_ids)
+
+
+def record_etl_run(mode: str, started_at: datetime, conn: connection):
+    """ Records a completed pipeline run, marking data read by the dashboard as changed. """
+
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO ETL_Run (mode, started_at) VALUES (%s, %s);",
+                    (mode, started_at))
+    conn.commit()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+""" Instrumentation for a pipeline run: timing spans of each stage, HTTP latency and
+    byte counts, page parse times and database round trips, rows and commits per table.
+    At the end of the run they are written as a JSON report and a Prometheus textfile. """
+
+import json
+import os
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from os import environ
+from threading import Lock
+
+from psycopg2.extensions import connection, cursor, STATUS_IN_TRANSACTION
+
+HISTOGRAM_BUCKETS = {
+    "http_request_duration_seconds": [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    "page_parse_seconds": [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1],
+}
+STATEMENT_TABLE = re.compile(
+    r"\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|FROM|COPY|MATERIALIZED\s+VIEW(?:\s+CONCURRENTLY)?)"
+    r"\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+SQL_COMMENT = re.compile(r"--[^\n]*")
+
+metrics_lock = Lock()
+spans = {}
+counters = {}
+histograms = {}
+
+
+def get_labels_key(labels: dict) -> tuple:
+    """ Returns labels as a hashable, ordered key. """
+
+    return tuple(sorted(labels.items()))
+
+
+def increment(name: str, value: float = 1, **labels):
+    """ Adds value to a counter. """
+
+    key = (name, get_labels_key(labels))
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """ Records a value in a histogram with the buckets given in HISTOGRAM_BUCKETS. """
+
+    key = (name, get_labels_key(labels))
+    buckets = HISTOGRAM_BUCKETS[name]
+    with metrics_lock:
+        histogram = histograms.setdefault(
+            key, {"buckets": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0})
+        histogram["buckets"][bisect_left(buckets, value)] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+@contextmanager
+def span(name: str):
+    """ Times the with block as a run of the named stage. Stages run more than once,
+        such as each inserted batch, add up. """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with metrics_lock:
+            stage = spans.setdefault(name, {"runs": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stage["runs"] += 1
+            stage["seconds"] += seconds
+            stage["max_seconds"] = max(stage["max_seconds"], seconds)
+
+
+def reset():
+    """ Clears all recorded metrics. """
+
+    with metrics_lock:
+        spans.clear()
+        counters.clear()
+        histograms.clear()
+
+
+def get_state() -> dict:
+    """ Returns a copy of all recorded metrics that can be sent to another process. """
+
+    with metrics_lock:
+        return {"spans": {name: dict(stage) for name, stage in spans.items()},
+                "counters": dict(counters),
+                "histograms": {key: {**histogram, "buckets": list(histogram["buckets"])}
+                               for key, histogram in histograms.items()}}
+
+
+def merge_state(state: dict):
+    """ Adds metrics recorded by another process, as returned by its get_state. """
+
+    with metrics_lock:
+        for name, other in state["spans"].items():
+            stage = spans.setdefault(name, {"runs": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stage["runs"] += other["runs"]
+            stage["seconds"] += other["seconds"]
+            stage["max_seconds"] = max(stage["max_seconds"], other["max_seconds"])
+        for key, value in state["counters"].items():
+            counters[key] = counters.get(key, 0) + value
+        for key, other in state["histograms"].items():
+            histogram = histograms.setdefault(
+                key, {"buckets": [0] * len(other["buckets"]), "sum": 0.0, "count": 0})
+            histogram["buckets"] = [count + other_count for count, other_count
+                                    in zip(histogram["buckets"], other["buckets"])]
+            histogram["sum"] += other["sum"]
+            histogram["count"] += other["count"]
+
+
+def get_statement_table(query) -> str:
+    """ Returns the first table a SQL statement reads or writes, lower cased. """
+
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    match = STATEMENT_TABLE.search(SQL_COMMENT.sub("", str(query)))
+    return match.group(1).lower() if match else "none"
+
+
+class InstrumentedConnection(connection):
+    """ Connection recording a round trip and the rows affected for each statement, by
+        table, and a commit for every table written in the committed transaction. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tables_in_transaction = set()
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop("cursor_factory", None) or self.cursor_factory or cursor
+        return super().cursor(*args, cursor_factory=get_instrumented_cursor(base), **kwargs)
+
+    def record_statement(self, query, rowcount: int):
+        """ Records a statement sent to the server and the rows it affected. """
+
+        table = get_statement_table(query)
+        increment("db_round_trips_total", table=table)
+        increment("db_rows_total", max(rowcount, 0), table=table)
+        self.tables_in_transaction.add(table)
+
+    def commit(self):
+        if self.status == STATUS_IN_TRANSACTION:
+            increment("db_round_trips_total", table="commit")
+            for table in self.tables_in_transaction:
+                increment("db_commits_total", table=table)
+        self.tables_in_transaction = set()
+        super().commit()
+
+    def rollback(self):
+        if self.status == STATUS_IN_TRANSACTION:
+            increment("db_round_trips_total", table="rollback")
+            for table in self.tables_in_transaction:
+                increment("db_rollbacks_total", table=table)
+        self.tables_in_transaction = set()
+        super().rollback()
+
+
+instrumented_cursors = {}
+
+
+def get_instrumented_cursor(base: type) -> type:
+    """ Returns subclass of a cursor class recording its statements on its connection. """
+
+    if base not in instrumented_cursors:
+
+        class InstrumentedCursor(base):
+            """ Cursor recording each statement with InstrumentedConnection.record_statement. """
+
+            def execute(self, query, vars=None):  # pylint: disable=redefined-builtin
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    self.connection.record_statement(query, self.rowcount)
+
+            def copy_expert(self, sql, file, size=8192):
+                try:
+                    return super().copy_expert(sql, file, size)
+                finally:
+                    self.connection.record_statement(sql, self.rowcount)
+
+        instrumented_cursors[base] = InstrumentedCursor
+
+    return instrumented_cursors[base]
+
+
+def get_report() -> dict:
+    """ Returns all recorded metrics as a dictionary. """
+
+    def labelled(key):
+        return {"name": key[0], "labels": dict(key[1])}
+
+    with metrics_lock:
+        return {
+            "stages": {name: {**stage, "seconds": round(stage["seconds"], 4),
+                              "max_seconds": round(stage["max_seconds"], 4)}
+                       for name, stage in spans.items()},
+            "counters": [{**labelled(key), "value": value}
+                         for key, value in sorted(counters.items())],
+            "histograms": [{**labelled(key),
+                            "buckets": dict(zip([*map(str, HISTOGRAM_BUCKETS[key[0]]), "+Inf"],
+                                                histogram["buckets"])),
+                            "sum": round(histogram["sum"], 6), "count": histogram["count"]}
+                           for key, histogram in sorted(histograms.items())],
+        }
+
+
+def format_labels(labels: dict) -> str:
+    """ Returns labels in Prometheus exposition format. """
+
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in labels.items()) + "}"
+
+
+def get_prometheus_text(report: dict) -> str:
+    """ Returns a report in Prometheus text exposition format, with every metric
+        prefixed by stackexchange_pipeline_. """
+
+    prefix = "stackexchange_pipeline_"
+    lines = []
+    for field in ("seconds", "runs"):
+        lines.append(f"# TYPE {prefix}stage_{field} gauge")
+        lines.extend(f'{prefix}stage_{field}{{stage="{name}"}} {stage[field]}'
+                     for name, stage in report["stages"].items())
+
+    for name in sorted({counter["name"] for counter in report["counters"]}):
+        lines.append(f"# TYPE {prefix}{name} counter")
+        lines.extend(f"{prefix}{name}{format_labels(counter['labels'])} {counter['value']}"
+                     for counter in report["counters"] if counter["name"] == name)
+
+    for name in sorted({histogram["name"] for histogram in report["histograms"]}):
+        lines.append(f"# TYPE {prefix}{name} histogram")
+        for histogram in report["histograms"]:
+            if histogram["name"] != name:
+                continue
+            cumulative = 0
+            for bucket, count in histogram["buckets"].items():
+                cumulative += count
+                labels = format_labels({**histogram["labels"], "le": bucket})
+                lines.append(f"{prefix}{name}_bucket{labels} {cumulative}")
+            labels = format_labels(histogram["labels"])
+            lines.append(f"{prefix}{name}_sum{labels} {histogram['sum']}")
+            lines.append(f"{prefix}{name}_count{labels} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_text(path: str, text: str):
+    """ Writes file atomically, so a collector never reads a partial file. """
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def write_reports(run_details: dict) -> dict:
+    """ Writes the report, with details of the run, as JSON to METRICS_JSON_PATH and
+        in Prometheus textfile format to METRICS_PROMETHEUS_PATH. An empty path skips
+        that file. Returns the report. """
+
+    report = {**run_details, **get_report()}
+
+    json_path = environ.get("METRICS_JSON_PATH", "pipeline_metrics.json")
+    if json_path:
+        write_text(json_path, json.dumps(report, indent=2, default=str))
+
+    prometheus_path = environ.get("METRICS_PROMETHEUS_PATH", "pipeline_metrics.prom")
+    if prometheus_path:
+        write_text(prometheus_path, get_prometheus_text(report))
+
+    return report
@@ -0,0 +1,90 @@
+""" Applies versioned schema migrations from the migrations directory to the database.
+    Each is applied once, in its own transaction, and recorded in the Schema_Migration
+    table. Most only add to the schema, but some rebuild keys and views, which locks
+    the tables they change until they commit; those say so in their header comment. """
+
+import logging
+import os
+
+from psycopg2.extensions import connection
+
+import insert
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_LOCK_ID = 7236501
+
+
+def get_migrations() -> list[tuple[str, str]]:
+    """ Returns (version, path) of every migration file, in version order. """
+
+    return [(name.split("_")[0], os.path.join(MIGRATIONS_DIR, name))
+            for name in sorted(os.listdir(MIGRATIONS_DIR)) if name.endswith(".sql")]
+
+
+def get_applied_versions(conn: connection) -> set:
+    """ Returns versions of migrations already applied to the database. """
+
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS Schema_Migration (
+                version TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("SELECT version FROM Schema_Migration;")
+        versions = {row[0] for row in cur.fetchall()}
+
+    conn.commit()
+    return versions
+
+
+def apply_migration(version: str, path: str, conn: connection):
+    """ Runs a migration file and records it, in one transaction. """
+
+    with open(path, "r", encoding="utf-8") as f:
+        sql = f.read()
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+            cur.execute("INSERT INTO Schema_Migration (version, name) VALUES (%s, %s);",
+                        (version, os.path.basename(path)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def migrate(conn: connection) -> list[str]:
+    """ Applies every pending migration and returns their file names. A session advisory
+        lock stops two containers migrating at the same time. """
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+
+    try:
+        applied = get_applied_versions(conn)
+        pending = [(version, path) for version, path in get_migrations()
+                   if version not in applied]
+
+        for version, path in pending:
+            logging.info("Applying migration %s", os.path.basename(path))
+            apply_migration(version, path, conn)
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+        conn.commit()
+
+    return [os.path.basename(path) for _, path in pending]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db_conn = insert.get_connection()
+    applied_migrations = migrate(db_conn)
+    db_conn.close()
+
+    logging.info("%s migrations applied.", len(applied_migrations))
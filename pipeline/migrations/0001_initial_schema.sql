@@ -0,0 +1,50 @@
+-- Tables as originally created by schema.sql.
+
+CREATE TABLE IF NOT EXISTS Author(
+    author_id INT GENERATED ALWAYS AS IDENTITY,
+    author_username TEXT UNIQUE NOT NULL,
+
+    PRIMARY KEY (author_id)
+);
+
+CREATE TABLE IF NOT EXISTS Question (
+    question_id INT UNIQUE NOT NULL,
+    author_id INT NOT NULL,
+    question TEXT NOT NULL,
+    votes INT NOT NULL,
+    views INT NOT NULL,
+    upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    PRIMARY KEY (question_id),
+    FOREIGN KEY (author_id) REFERENCES Author(author_id)
+);
+
+CREATE TABLE IF NOT EXISTS Tag(
+    tag_id INT GENERATED ALWAYS AS IDENTITY,
+    tag TEXT UNIQUE NOT NULL,
+
+    PRIMARY KEY(tag_id)
+);
+
+CREATE TABLE IF NOT EXISTS Question_Tag_Assignment(
+    question_tag_id INT GENERATED ALWAYS AS IDENTITY,
+    tag_id INT NOT NULL,
+    question_id INT NOT NULL,
+
+    PRIMARY KEY(question_tag_id),
+    FOREIGN KEY(tag_id) REFERENCES Tag(tag_id),
+    FOREIGN KEY(question_id) REFERENCES Question(question_id)
+);
+
+CREATE TABLE IF NOT EXISTS Answer(
+    answer_id INT UNIQUE NOT NULL,
+    answer TEXT NOT NULL,
+    votes INT NOT NULL,
+    question_id INT NOT NULL,
+    author_id INT NOT NULL,
+    upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    PRIMARY KEY(answer_id),
+    FOREIGN KEY(question_id) REFERENCES Question(question_id),
+    FOREIGN KEY(author_id) REFERENCES Author(author_id)
+);
@@ -0,0 +1,3 @@
+-- Last activity time shown on the listing, used by incremental scraping.
+
+ALTER TABLE Question ADD COLUMN IF NOT EXISTS last_activity TIMESTAMP;
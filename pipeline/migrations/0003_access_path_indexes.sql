@@ -0,0 +1,19 @@
+-- Indexes for the joins and filters of the dashboard queries, and a unique
+-- (tag_id, question_id) so ON CONFLICT DO NOTHING dedupes tag assignments.
+
+DELETE FROM Question_Tag_Assignment duplicate
+USING Question_Tag_Assignment original
+WHERE duplicate.tag_id = original.tag_id
+    AND duplicate.question_id = original.question_id
+    AND duplicate.question_tag_id > original.question_tag_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS question_tag_assignment_tag_question_idx
+    ON Question_Tag_Assignment (tag_id, question_id);
+CREATE INDEX IF NOT EXISTS question_tag_assignment_question_idx
+    ON Question_Tag_Assignment (question_id);
+
+CREATE INDEX IF NOT EXISTS question_author_idx ON Question (author_id);
+CREATE INDEX IF NOT EXISTS question_upload_timestamp_idx ON Question (upload_timestamp);
+
+CREATE INDEX IF NOT EXISTS answer_question_idx ON Answer (question_id);
+CREATE INDEX IF NOT EXISTS answer_author_idx ON Answer (author_id);
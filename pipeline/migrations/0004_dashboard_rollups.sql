@@ -0,0 +1,59 @@
+-- Aggregates read by the dashboard, refreshed by the pipeline after each run.
+-- Unique indexes allow REFRESH MATERIALIZED VIEW CONCURRENTLY, so readers never block.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS Tag_Rollup AS
+    SELECT t.tag,
+        COUNT(qt.tag_id) AS tag_count,
+        SUM(q.votes) AS total_votes,
+        COALESCE(SUM(a.answer_count), 0) AS total_answers
+    FROM Question_Tag_Assignment qt
+    JOIN Tag t ON qt.tag_id = t.tag_id
+    JOIN Question q ON q.question_id = qt.question_id
+    LEFT JOIN (
+        SELECT question_id, COUNT(answer_id) AS answer_count
+        FROM Answer
+        GROUP BY question_id
+    ) a ON a.question_id = q.question_id
+    GROUP BY t.tag;
+
+CREATE UNIQUE INDEX IF NOT EXISTS tag_rollup_tag_idx ON Tag_Rollup (tag);
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS Tag_Week_Rollup AS
+    SELECT t.tag, COUNT(qt.tag_id) AS tag_count
+    FROM Question_Tag_Assignment qt
+    JOIN Tag t ON qt.tag_id = t.tag_id
+    JOIN Question q ON qt.question_id = q.question_id
+    WHERE q.upload_timestamp >= CURRENT_TIMESTAMP - INTERVAL '7 days'
+    GROUP BY t.tag;
+
+CREATE UNIQUE INDEX IF NOT EXISTS tag_week_rollup_tag_idx ON Tag_Week_Rollup (tag);
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS Question_Hour_Rollup AS
+    SELECT DATE_PART('hour', q.upload_timestamp) AS upload_hour,
+        COUNT(*) AS question_count
+    FROM Question q
+    GROUP BY upload_hour;
+
+CREATE UNIQUE INDEX IF NOT EXISTS question_hour_rollup_hour_idx
+    ON Question_Hour_Rollup (upload_hour);
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS Author_Rollup AS
+    SELECT a.author_id, a.author_username,
+        COALESCE(q.num_questions_asked, 0) AS num_questions_asked,
+        COALESCE(aw.num_answers_written, 0) AS num_answers_written
+    FROM Author a
+    LEFT JOIN (
+        SELECT author_id, COUNT(question_id) AS num_questions_asked
+        FROM Question
+        GROUP BY author_id
+    ) q ON q.author_id = a.author_id
+    LEFT JOIN (
+        SELECT author_id, COUNT(answer_id) AS num_answers_written
+        FROM Answer
+        GROUP BY author_id
+    ) aw ON aw.author_id = a.author_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS author_rollup_author_idx ON Author_Rollup (author_id);
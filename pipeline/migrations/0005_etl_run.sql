@@ -0,0 +1,13 @@
+-- One row per completed pipeline run; the dashboard uses the latest
+-- finished_at to tell when its cached query results are out of date.
+
+CREATE TABLE IF NOT EXISTS ETL_Run(
+    run_id INT GENERATED ALWAYS AS IDENTITY,
+    mode TEXT NOT NULL,
+    started_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    PRIMARY KEY(run_id)
+);
+
+CREATE INDEX IF NOT EXISTS etl_run_finished_at_idx ON ETL_Run (finished_at);
@@ -0,0 +1,20 @@
+-- Append-only history of question and answer votes/views. A row is only written when
+-- a post is first seen or its counts change, with the change since its previous row
+-- (NULL for the first row of a post).
+-- Partitioned by day on captured_at; the pipeline creates each day's partition
+-- (Post_Snapshot_YYYYMMDD) before writing to it, and old days can be dropped whole.
+
+CREATE TABLE IF NOT EXISTS Post_Snapshot(
+    post_type TEXT NOT NULL CHECK (post_type IN ('question', 'answer')),
+    post_id INT NOT NULL,
+    captured_at TIMESTAMP NOT NULL,
+    votes INT NOT NULL,
+    views INT,
+    votes_change INT,
+    views_change INT
+) PARTITION BY RANGE (captured_at);
+
+CREATE INDEX IF NOT EXISTS post_snapshot_captured_at_brin
+    ON Post_Snapshot USING BRIN (captured_at);
+CREATE INDEX IF NOT EXISTS post_snapshot_post_idx
+    ON Post_Snapshot (post_type, post_id);
@@ -0,0 +1,122 @@
+-- Site dimension, so several Stack Exchange sites can share the database.
+-- Question and answer ids are only unique within a site, so their keys become
+-- (site_id, id); rows stored before sites were added belong to history, the first
+-- site. Authors and tags stay shared across sites by name.
+-- The rollups are rebuilt with a row per site, which the dashboard sums for all sites.
+-- This is a destructive re-keying migration: it drops and recreates the Question and
+-- Answer primary keys, foreign keys and indexes and every materialized view, holding
+-- ACCESS EXCLUSIVE locks on them until it commits. Run it while the dashboard and the
+-- pipeline are stopped.
+
+CREATE TABLE IF NOT EXISTS Site(
+    site_id SMALLINT GENERATED ALWAYS AS IDENTITY,
+    site TEXT UNIQUE NOT NULL,
+
+    PRIMARY KEY (site_id)
+);
+
+INSERT INTO Site (site) VALUES ('history') ON CONFLICT (site) DO NOTHING;
+
+DROP MATERIALIZED VIEW IF EXISTS Tag_Rollup, Tag_Week_Rollup, Question_Hour_Rollup,
+    Author_Rollup;
+
+-- A constant default fills existing rows without rewriting the tables.
+ALTER TABLE Question ADD COLUMN site_id SMALLINT NOT NULL DEFAULT 1 REFERENCES Site(site_id);
+ALTER TABLE Answer ADD COLUMN site_id SMALLINT NOT NULL DEFAULT 1;
+ALTER TABLE Question_Tag_Assignment ADD COLUMN site_id SMALLINT NOT NULL DEFAULT 1;
+ALTER TABLE Post_Snapshot ADD COLUMN site_id SMALLINT NOT NULL DEFAULT 1;
+
+ALTER TABLE Question ALTER COLUMN site_id DROP DEFAULT;
+ALTER TABLE Answer ALTER COLUMN site_id DROP DEFAULT;
+ALTER TABLE Question_Tag_Assignment ALTER COLUMN site_id DROP DEFAULT;
+ALTER TABLE Post_Snapshot ALTER COLUMN site_id DROP DEFAULT;
+
+ALTER TABLE Answer DROP CONSTRAINT IF EXISTS answer_question_id_fkey;
+ALTER TABLE Question_Tag_Assignment
+    DROP CONSTRAINT IF EXISTS question_tag_assignment_question_id_fkey;
+
+ALTER TABLE Question
+    DROP CONSTRAINT IF EXISTS question_question_id_key,
+    DROP CONSTRAINT question_pkey,
+    ADD PRIMARY KEY (site_id, question_id);
+
+ALTER TABLE Answer
+    DROP CONSTRAINT IF EXISTS answer_answer_id_key,
+    DROP CONSTRAINT answer_pkey,
+    ADD PRIMARY KEY (site_id, answer_id),
+    ADD FOREIGN KEY (site_id, question_id) REFERENCES Question(site_id, question_id);
+
+ALTER TABLE Question_Tag_Assignment
+    ADD FOREIGN KEY (site_id, question_id) REFERENCES Question(site_id, question_id);
+
+DROP INDEX IF EXISTS question_tag_assignment_tag_question_idx;
+DROP INDEX IF EXISTS question_tag_assignment_question_idx;
+DROP INDEX IF EXISTS answer_question_idx;
+DROP INDEX IF EXISTS post_snapshot_post_idx;
+
+CREATE UNIQUE INDEX IF NOT EXISTS question_tag_assignment_tag_question_idx
+    ON Question_Tag_Assignment (tag_id, site_id, question_id);
+CREATE INDEX IF NOT EXISTS question_tag_assignment_question_idx
+    ON Question_Tag_Assignment (site_id, question_id);
+CREATE INDEX IF NOT EXISTS answer_question_idx ON Answer (site_id, question_id);
+CREATE INDEX IF NOT EXISTS post_snapshot_post_idx
+    ON Post_Snapshot (post_type, site_id, post_id);
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS Tag_Rollup AS
+    SELECT q.site_id, t.tag,
+        COUNT(qt.tag_id) AS tag_count,
+        SUM(q.votes) AS total_votes,
+        COALESCE(SUM(a.answer_count), 0) AS total_answers
+    FROM Question_Tag_Assignment qt
+    JOIN Tag t ON qt.tag_id = t.tag_id
+    JOIN Question q ON q.site_id = qt.site_id AND q.question_id = qt.question_id
+    LEFT JOIN (
+        SELECT site_id, question_id, COUNT(answer_id) AS answer_count
+        FROM Answer
+        GROUP BY site_id, question_id
+    ) a ON a.site_id = q.site_id AND a.question_id = q.question_id
+    GROUP BY q.site_id, t.tag;
+
+CREATE UNIQUE INDEX IF NOT EXISTS tag_rollup_tag_idx ON Tag_Rollup (site_id, tag);
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS Tag_Week_Rollup AS
+    SELECT q.site_id, t.tag, COUNT(qt.tag_id) AS tag_count
+    FROM Question_Tag_Assignment qt
+    JOIN Tag t ON qt.tag_id = t.tag_id
+    JOIN Question q ON q.site_id = qt.site_id AND q.question_id = qt.question_id
+    WHERE q.upload_timestamp >= CURRENT_TIMESTAMP - INTERVAL '7 days'
+    GROUP BY q.site_id, t.tag;
+
+CREATE UNIQUE INDEX IF NOT EXISTS tag_week_rollup_tag_idx ON Tag_Week_Rollup (site_id, tag);
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS Question_Hour_Rollup AS
+    SELECT q.site_id, DATE_PART('hour', q.upload_timestamp) AS upload_hour,
+        COUNT(*) AS question_count
+    FROM Question q
+    GROUP BY q.site_id, upload_hour;
+
+CREATE UNIQUE INDEX IF NOT EXISTS question_hour_rollup_hour_idx
+    ON Question_Hour_Rollup (site_id, upload_hour);
+
+
+-- Only authors who asked or answered on a site have a row for it.
+CREATE MATERIALIZED VIEW IF NOT EXISTS Author_Rollup AS
+    SELECT site_id, author_id, a.author_username,
+        COALESCE(q.num_questions_asked, 0) AS num_questions_asked,
+        COALESCE(aw.num_answers_written, 0) AS num_answers_written
+    FROM (
+        SELECT site_id, author_id, COUNT(question_id) AS num_questions_asked
+        FROM Question
+        GROUP BY site_id, author_id
+    ) q
+    FULL JOIN (
+        SELECT site_id, author_id, COUNT(answer_id) AS num_answers_written
+        FROM Answer
+        GROUP BY site_id, author_id
+    ) aw USING (site_id, author_id)
+    JOIN Author a USING (author_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS author_rollup_author_idx ON Author_Rollup (site_id, author_id);
@@ -0,0 +1,5 @@
+-- Answer count shown on the listing, used by incremental scraping. It counts every
+-- answer, including ones the scraper does not store, so comparing against the
+-- stored answers would mark such questions as changed on every run.
+
+ALTER TABLE Question ADD COLUMN IF NOT EXISTS answer_count INT;
@@ -0,0 +1,74 @@
+-- Tag_Rollup, Question_Hour_Rollup and Author_Rollup become tables that each inserted
+-- batch adds its changes to (insert.ROLLUP_STAGED_QUERY), instead of materialized views
+-- recomputed from all history after every run. They only ever grow: questions, answers
+-- and tag assignments are never deleted and keep their author, time and question.
+-- Tag_Week_Rollup stays a materialized view, as questions leave its 7 day window.
+-- The views are dropped and the tables filled from the stored data in this migration's
+-- transaction, so the dashboard waits on its locks until it commits.
+
+DROP MATERIALIZED VIEW IF EXISTS Tag_Rollup, Question_Hour_Rollup, Author_Rollup;
+
+
+CREATE TABLE IF NOT EXISTS Tag_Rollup(
+    site_id SMALLINT NOT NULL REFERENCES Site(site_id),
+    tag TEXT NOT NULL,
+    tag_count BIGINT NOT NULL,
+    total_votes BIGINT NOT NULL,
+    total_answers BIGINT NOT NULL,
+
+    PRIMARY KEY (site_id, tag)
+);
+
+INSERT INTO Tag_Rollup (site_id, tag, tag_count, total_votes, total_answers)
+    SELECT q.site_id, t.tag,
+        COUNT(qt.tag_id),
+        COALESCE(SUM(q.votes), 0),
+        COALESCE(SUM(a.answer_count), 0)
+    FROM Question_Tag_Assignment qt
+    JOIN Tag t ON qt.tag_id = t.tag_id
+    JOIN Question q ON q.site_id = qt.site_id AND q.question_id = qt.question_id
+    LEFT JOIN (
+        SELECT site_id, question_id, COUNT(answer_id) AS answer_count
+        FROM Answer
+        GROUP BY site_id, question_id
+    ) a ON a.site_id = q.site_id AND a.question_id = q.question_id
+    GROUP BY q.site_id, t.tag;
+
+
+-- Questions without an asked time count under a NULL hour, as in the view.
+CREATE TABLE IF NOT EXISTS Question_Hour_Rollup(
+    site_id SMALLINT NOT NULL REFERENCES Site(site_id),
+    upload_hour DOUBLE PRECISION,
+    question_count BIGINT NOT NULL,
+
+    UNIQUE NULLS NOT DISTINCT (site_id, upload_hour)
+);
+
+INSERT INTO Question_Hour_Rollup (site_id, upload_hour, question_count)
+    SELECT site_id, DATE_PART('hour', upload_timestamp), COUNT(*)
+    FROM Question
+    GROUP BY 1, 2;
+
+
+CREATE TABLE IF NOT EXISTS Author_Rollup(
+    site_id SMALLINT NOT NULL REFERENCES Site(site_id),
+    author_id INT NOT NULL REFERENCES Author(author_id),
+    author_username TEXT NOT NULL,
+    num_questions_asked BIGINT NOT NULL,
+    num_answers_written BIGINT NOT NULL,
+
+    PRIMARY KEY (site_id, author_id)
+);
+
+INSERT INTO Author_Rollup (site_id, author_id, author_username, num_questions_asked,
+                           num_answers_written)
+    SELECT posts.site_id, posts.author_id, a.author_username,
+        COUNT(*) FILTER (WHERE posts.is_question),
+        COUNT(*) FILTER (WHERE NOT posts.is_question)
+    FROM (
+        SELECT site_id, author_id, TRUE AS is_question FROM Question
+        UNION ALL
+        SELECT site_id, author_id, FALSE FROM Answer
+    ) posts
+    JOIN Author a ON a.author_id = posts.author_id
+    GROUP BY posts.site_id, posts.author_id, a.author_username;
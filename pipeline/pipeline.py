@@ -1,22 +1,292 @@
 """ Runs ETL pipeline """
 
+import asyncio
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from itertools import repeat
+from multiprocessing import get_context
+from os import environ
+from queue import Full, Queue
+from threading import Thread
+import async_pipeline
+import crawl
+import export
+import fetch
 import scrape
 import insert
+import metrics
+import migrate
+import replay
+import rollup
+import sites
 
 
-def run_pipeline():
-    """ Runs ETL pipeline for scraping StackExchange history page and uploading to database. """
+def set_up_logging():
+    """ Logs INFO and above with timestamps. """
 
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s - %(levelname)s - %(message)s')
 
-    logging.info("SCRAPING: ")
-    data = scrape.extract_stack_exchange_history_data()
 
-    logging.info("INSERTING: ")
-    insert.insert_data_to_database(data)
+def load_known_states(conn, site: str, question_ids: list[int]) -> dict:
+    """ Returns stored states of a site's questions, ending the lookup's transaction so
+        the connection is not left idle in it while pages are fetched. """
+
+    states = insert.load_question_states(question_ids, conn, site)
+    conn.commit()
+    return states
+
+
+def get_known_states_loader(conn, site: str):
+    """ Returns function loading stored states of a site's questions for incremental
+        scraping, or None when SCRAPE_INCREMENTAL is not enabled. """
+
+    if environ.get("SCRAPE_INCREMENTAL", "false").lower() != "true":
+        return None
+    return partial(load_known_states, conn, site)
+
+
+def batch_questions(questions, batch_size: int):
+    """ Groups streamed questions into (batch, on_inserted) units for the database writer. """
+
+    batch = []
+    for question in questions:
+        batch.append(question)
+        if len(batch) >= batch_size:
+            yield batch, None
+            batch = []
+    if batch:
+        yield batch, None
+
+
+def crawl_pages(get_known_states, host: str):
+    """ Yields each crawled page of the site at host as a unit whose on_inserted callback
+        moves the site's checkpoint past it. Once the crawl has run out of listing pages
+        or reached the end of its range, a last unit without questions removes the
+        checkpoint after every page has been inserted.
+        The checkpoint is not moved past a page that skipped questions whose answers
+        could not be fetched, nor removed, so the next run crawls that page again. """
+
+    checkpoint_path = crawl.get_checkpoint_path(host)
+    retry_page = None
+    for page, questions, skipped in crawl.crawl_history_from_environment(get_known_states,
+                                                                          host):
+        if skipped and retry_page is None:
+            logging.warning("Page %s skipped %s questions, keeping the checkpoint at it.",
+                            page, skipped)
+            retry_page = page
+        yield questions, (partial(crawl.save_checkpoint, checkpoint_path, page + 1)
+                          if retry_page is None else None)
+
+    if retry_page is None:
+        yield [], partial(crawl.remove_checkpoint, checkpoint_path)
+    else:
+        logging.warning("Crawl finished with skipped questions, the next run resumes "
+                        "from page %s.", retry_page)
+
+
+def insert_units(units, conn, snapshot: bool = True):
+    """ Inserts each (questions, on_inserted) unit, then calls its callback. """
+
+    for questions, on_inserted in units:
+        if questions:
+            with metrics.span("insert_batch"):
+                insert.bulk_insert_data_to_database(questions, conn, snapshot)
+        if on_inserted:
+            on_inserted()
+
+
+def write_units(units: Queue, errors: list):
+    """ Database writer: inserts units from the queue until it receives None. """
+
+    conn = insert.get_connection()
+    try:
+        insert_units(iter(units.get, None), conn)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        errors.append(e)
+    finally:
+        conn.close()
+
+
+def put_unit(units: Queue, unit, writer: Thread, errors: list):
+    """ Puts unit on the queue, blocking while the writer is behind.
+        Raises the writer's error if it stopped. """
+
+    while True:
+        try:
+            units.put(unit, timeout=1)
+            return
+        except Full:
+            if not writer.is_alive():
+                raise errors[0] if errors else RuntimeError("Database writer stopped.")
+
+
+def stream_units(units):
+    """ Inserts units on a writer thread while they are still being scraped.
+        The bounded queue holds back scraping when the database falls behind. """
+
+    queue = Queue(maxsize=int(environ.get("PIPELINE_QUEUE_SIZE", 4)))
+    errors = []
+    writer = Thread(target=write_units, args=(queue, errors))
+    writer.start()
+
+    try:
+        for unit in units:
+            put_unit(queue, unit, writer, errors)
+    finally:
+        if writer.is_alive():
+            put_unit(queue, None, writer, errors)
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+
+def run_site(host: str, mode: str, streaming: bool):
+    """ Scrapes the site at host and inserts its questions, on its own connection. """
+
+    crawling = mode == "crawl"
+    conn = insert.get_connection()
+    with metrics.span("warm_id_caches"):
+        insert.warm_id_caches(conn)
+    # Ends the read's transaction, so the connection is not idle in it while scraping.
+    conn.commit()
+    get_known_states = get_known_states_loader(conn, sites.get_site_name(host))
+
+    if crawling:
+        logging.info("CRAWLING %s: ", host)
+        units = crawl_pages(get_known_states, host)
+    elif streaming:
+        logging.info("SCRAPING AND INSERTING %s: ", host)
+        units = batch_questions(
+            scrape.iter_stack_exchange_history_data(get_known_states,
+                                                    scrape.get_listing_url(host)),
+            int(environ.get("PIPELINE_BATCH_SIZE", 10)))
+    else:
+        logging.info("SCRAPING %s: ", host)
+        with metrics.span("scrape"):
+            data = scrape.extract_stack_exchange_history_data(get_known_states,
+                                                              scrape.get_listing_url(host))
+        logging.info("INSERTING %s: ", host)
+        units = [(data, None)]
+
+    with metrics.span("scrape_and_insert" if crawling or streaming else "insert"):
+        if streaming:
+            stream_units(units)
+        else:
+            insert_units(units, conn)
+
+    conn.close()
+
+
+def get_process_stats() -> dict:
+    """ Returns statistics of this process's id caches and rate limiters. """
+
+    return {'id_caches': [cache.stats()
+                          for cache in (insert.author_ids, insert.tag_ids, insert.site_ids)],
+            'rate_limits': fetch.get_rate_limit_stats()}
+
+
+def run_site_process(host: str, mode: str, streaming: bool) -> dict:
+    """ Runs run_site in a worker process. Returns the process's statistics and
+        metrics for the main process to report. """
+
+    set_up_logging()
+    run_site(host, mode, streaming)
+    return {**get_process_stats(), 'metrics': metrics.get_state()}
+
+
+def get_site_workers(site_count: int) -> int:
+    """ Returns number of sites scraped at once, from PIPELINE_SITE_WORKERS,
+        defaulting to all of them. """
+
+    return max(1, min(site_count, int(environ.get("PIPELINE_SITE_WORKERS", site_count))))
+
+
+def run_sites(hosts: list[str], mode: str, streaming: bool) -> list[dict]:
+    """ Runs every site, a single site in this process, several in parallel worker
+        processes. Each worker has its own connection, id caches and per-host rate
+        limiters, so every site is rate limited separately. Returns statistics of
+        each process that ran a site. """
+
+    if len(hosts) == 1:
+        run_site(hosts[0], mode, streaming)
+        return [get_process_stats()]
+
+    # Spawned rather than forked, so workers do not inherit the open connection.
+    with ProcessPoolExecutor(max_workers=get_site_workers(len(hosts)),
+                             mp_context=get_context("spawn")) as executor:
+        results = list(executor.map(run_site_process, hosts, repeat(mode), repeat(streaming)))
+
+    for result in results:
+        metrics.merge_state(result.pop('metrics'))
+    return results
+
+
+def run_pipeline():
+    """ Runs ETL pipeline for scraping StackExchange history page, or each site in
+        PIPELINE_SITES, and uploading to database. """
+
+    set_up_logging()
+
+    started_at = datetime.now()
+    mode = environ.get("PIPELINE_MODE", "latest")
+    replaying = mode == "replay"
+    streaming = environ.get("PIPELINE_STREAMING", "false").lower() == "true"
+    hosts = sites.get_hosts()
+
+    with metrics.span("run"):
+        conn = insert.get_connection()
+        if environ.get("RUN_MIGRATIONS", "false").lower() == "true":
+            with metrics.span("migrate"):
+                migrate.migrate(conn)
+
+        if replaying:
+            logging.info("REPLAYING ARCHIVE: ")
+            with metrics.span("warm_id_caches"):
+                insert.warm_id_caches(conn)
+            conn.commit()
+            units = batch_questions(replay.iter_replayed_questions(hosts=hosts),
+                                    int(environ.get("PIPELINE_BATCH_SIZE", 10)))
+            # Pages are parsed in worker processes while batches are inserted here.
+            # Replayed votes and views are not new observations, so are not snapshotted.
+            with metrics.span("replay_and_insert"):
+                insert_units(units, conn, snapshot=False)
+            process_stats = [get_process_stats()]
+        elif mode == "async":
+            logging.info("SCRAPING AND INSERTING ASYNCHRONOUSLY: ")
+            with metrics.span("async_scrape_and_insert"):
+                asyncio.run(async_pipeline.run_sites(hosts))
+            process_stats = [get_process_stats()]
+        else:
+            with metrics.span("sites"):
+                process_stats = run_sites(hosts, mode, streaming)
+
+        logging.info("REFRESHING ROLLUPS: ")
+        with metrics.span("refresh_rollups"):
+            rollup.refresh_rollups(conn)
+        insert.record_etl_run(mode, started_at, conn)
+
+        if export.get_export_dir():
+            logging.info("EXPORTING DASHBOARD SNAPSHOT: ")
+            with metrics.span("export_snapshot"):
+                export.export_snapshot(conn)
+
+        conn.close()
+        with metrics.span("evict_cache"):
+            fetch.evict_cache()
 
+    id_cache_stats = [stats for process in process_stats for stats in process['id_caches']]
+    for stats in id_cache_stats:
+        logging.info("ID cache: %s", stats)
+    rate_limit_stats = [stats for process in process_stats for stats in process['rate_limits']]
+    for stats in rate_limit_stats:
+        logging.info("Rate limit: %s", stats)
+    metrics.write_reports({'mode': mode, 'sites': hosts, 'started_at': started_at,
+                           'finished_at': datetime.now(), 'id_caches': id_cache_stats,
+                           'rate_limits': rate_limit_stats})
     logging.info("ETL COMPLETE. ")
 
 
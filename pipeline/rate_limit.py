@@ -0,0 +1,84 @@
+""" Token-bucket rate limiter for requests to one host, adapting its rate to how the
+    server responds: it slows down sharply when throttled and speeds up gradually
+    while requests succeed. """
+
+import time
+from threading import Lock
+
+
+class AdaptiveTokenBucket:
+    """ Allows rate requests per second with bursts of up to burst requests.
+        Each throttled response halves the rate (down to min_rate) and can pause the
+        bucket, for example for a Retry-After; each success adds increase to the rate
+        (up to max_rate). Thread safe. """
+
+    def __init__(self, name: str, rate: float, burst: int, min_rate: float, max_rate: float,
+                 increase: float):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self.lock = Lock()
+
+    def refill(self, now: float):
+        """ Adds the tokens earned since the last update, none while paused. """
+
+        earning_since = max(self.updated, self.paused_until)
+        if now > earning_since:
+            self.tokens = min(self.burst, self.tokens + (now - earning_since) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """ Takes a token, sleeping until one is available, and returns seconds waited. """
+
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self) -> float:
+        """ Takes a token without waiting for it, and returns seconds the caller must
+            wait before using it, so an event loop can wait without blocking. """
+
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            self.tokens -= 1
+            wait = max(0.0, self.paused_until - now) + max(0.0, -self.tokens) / self.rate
+            self.requests += 1
+            self.waited += wait
+        return wait
+
+    def on_success(self):
+        """ Speeds up after a response that was not throttled. """
+
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttled(self, pause: float = 0.0):
+        """ Halves the rate after a throttled response, and stops handing out tokens
+            for pause seconds. """
+
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            self.throttled += 1
+
+    def stats(self) -> dict:
+        """ Returns current rate, requests, throttled responses and time spent waiting. """
+
+        with self.lock:
+            return {'host': self.name,
+                    'rate': round(self.rate, 3),
+                    'requests': self.requests,
+                    'throttled': self.throttled,
+                    'waited_seconds': round(self.waited, 3)}
@@ -0,0 +1,136 @@
+""" Typed records of scraped questions and answers, with counts and times parsed once
+    when they are extracted, and column batches of them that are written to the
+    database with COPY. """
+
+import io
+import re
+from array import array
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from decimal import Decimal
+
+import sites
+
+COUNT = re.compile(r"(-?\d*\.?\d+)([kmb]?)", re.IGNORECASE)
+COUNT_MULTIPLIERS = {"": 1, "k": 1000, "m": 1000000, "b": 1000000000}
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def parse_count(count) -> int:
+    """ Returns a count as shown on the site as an int: "12", "-3", "1,234",
+        "1.2k" (1200), "3m" (3000000). Raises ValueError for anything else. """
+
+    if isinstance(count, int):
+        return count
+
+    match = COUNT.fullmatch(count.strip().replace(",", ""))
+    if not match:
+        raise ValueError(f"Not a count: {count!r}")
+    number, suffix = match.groups()
+    return int(Decimal(number) * COUNT_MULTIPLIERS[suffix.lower()])
+
+
+def parse_time(value) -> datetime:
+    """ Returns a datetime from a datetime or an ISO formatted string, None if empty. """
+
+    if not value or isinstance(value, datetime):
+        return value or None
+    return datetime.fromisoformat(value)
+
+
+@dataclass(slots=True)
+class Answer:
+    """ An answer to a question. """
+
+    answer_id: int
+    answer: str
+    username: str
+    vote_count: int
+    timestamp: datetime | None
+
+
+@dataclass(slots=True)
+class Question:
+    """ A question from a listing page of a site, with its answers. """
+
+    site: str
+    question_id: int
+    title: str
+    timestamp: datetime | None
+    tags: list[str]
+    votes: int
+    views: int
+    username: str
+    answer_count: int
+    last_activity: datetime | None
+    answers: list[Answer]
+
+
+def answer_from_dict(answer: dict) -> Answer:
+    """ Returns a record of an answer in the shape of data.json, parsing its fields. """
+
+    return Answer(answer_id=int(answer['answer_id']),
+                  answer=answer['answer'],
+                  username=answer['username'],
+                  vote_count=parse_count(answer['vote_count']),
+                  timestamp=parse_time(answer.get('timestamp')))
+
+
+def question_from_dict(question: dict) -> Question:
+    """ Returns a record of a question in the shape of data.json, parsing its fields.
+        Questions recorded without a site are from history. """
+
+    return Question(site=question.get('site', sites.DEFAULT_SITE),
+                    question_id=int(question['question_id']),
+                    title=question['title'],
+                    timestamp=parse_time(question.get('timestamp')),
+                    tags=list(question['tags']),
+                    votes=parse_count(question['votes']),
+                    views=parse_count(question['views']),
+                    username=question['username'],
+                    answer_count=int(question.get('answer_count', len(question['answers']))),
+                    last_activity=parse_time(question.get('last_activity')),
+                    answers=[answer_from_dict(answer) for answer in question['answers']])
+
+
+def to_dict(record) -> dict:
+    """ Returns a record as a dictionary in the shape of data.json. """
+
+    return asdict(record)
+
+
+class ColumnBatch:
+    """ Rows kept column by column, integer columns in compact arrays, that can be
+        written to a table with COPY without converting each row. """
+
+    __slots__ = ("names", "columns")
+
+    def __init__(self, columns: dict):
+        """ columns maps each column name to "q" for a column of integers,
+            or None for a column of other values. """
+
+        self.names = list(columns)
+        self.columns = [array(typecode) if typecode else [] for typecode in columns.values()]
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def append(self, *values):
+        """ Adds a row, given its values in column order. """
+
+        for column, value in zip(self.columns, values):
+            column.append(value)
+
+    def to_copy_text(self) -> io.StringIO:
+        """ Returns the rows in COPY text format: tab separated, None as \\N. """
+
+        text = io.StringIO()
+        for row in zip(*self.columns):
+            text.write("\t".join(
+                "\\N" if value is None else
+                str(value) if isinstance(value, (int, datetime)) else
+                str(value).translate(COPY_ESCAPES)
+                for value in row))
+            text.write("\n")
+        text.seek(0)
+        return text
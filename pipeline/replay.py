@@ -0,0 +1,70 @@
+""" Replays the page archive: parses the latest archived copy of every listing and
+    question page again, in parallel processes and without the network, so changes to
+    the scraper can be applied to everything fetched before. """
+
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
+from os import environ
+from urllib.parse import urlparse
+
+import archive
+import metrics
+import scrape
+
+QUESTION_PAGE = re.compile(r"/questions/\d+")
+
+
+def get_replay_workers() -> int:
+    """ Returns number of processes parsing archived pages, from REPLAY_WORKERS,
+        defaulting to one per CPU. """
+
+    return max(1, int(environ.get("REPLAY_WORKERS", os.cpu_count() or 1)))
+
+
+def parse_archived_page(page: dict) -> list[dict]:
+    """ Returns question summaries of an archived listing page, or answers of an
+        archived question page. Runs in a worker process. """
+
+    html = archive.read_page(page)
+    if QUESTION_PAGE.search(page['url']):
+        return scrape.parse_question_page(html)
+    return scrape.parse_listing_page(html, urlparse(page['url']).netloc)
+
+
+def iter_replayed_questions(archive_dir: str = None, workers: int = None,
+                            hosts: list[str] = None):
+    """ Yields details of every question on the archived listing pages, with answers
+        from its archived question page. A question on several listings keeps its
+        summary from the most recently fetched one; a question whose page was never
+        archived gets no answers. If hosts is given, only pages of those sites are
+        replayed. """
+
+    pages = [page for page in archive.get_latest_pages(archive_dir)
+             if hosts is None or urlparse(page['url']).netloc in hosts]
+    listings = [page for page in pages if not QUESTION_PAGE.search(page['url'])]
+    question_pages = {page['url']: page for page in pages if QUESTION_PAGE.search(page['url'])}
+    logging.info("Replaying %s listing pages and %s question pages.",
+                 len(listings), len(question_pages))
+
+    with ProcessPoolExecutor(max_workers=workers or get_replay_workers()) as executor:
+        summaries = {}
+        for summaries_on_page in executor.map(parse_archived_page, listings, chunksize=8):
+            summaries.update(((summary['site'], summary['question_id']), summary)
+                             for summary in summaries_on_page)
+        metrics.increment("replayed_pages_total", len(listings), page="listing")
+
+        with_page = [summary for summary in summaries.values()
+                     if summary['link'] in question_pages]
+        without_page = [summary for summary in summaries.values()
+                        if summary['link'] not in question_pages]
+        metrics.increment("replayed_pages_total", len(with_page), page="question")
+
+        answers = executor.map(parse_archived_page,
+                               [question_pages[summary['link']] for summary in with_page],
+                               chunksize=8)
+        for summary, question_answers in zip(with_page + without_page,
+                                             chain(answers, repeat([]))):
+            yield scrape.question_from_summary(summary, question_answers)
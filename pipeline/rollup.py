@@ -0,0 +1,70 @@
+""" Keeps the dashboard's pre-aggregated rollups up to date once new data has been inserted.
+    Tag_Rollup, Question_Hour_Rollup and Author_Rollup are added to by every inserted
+    batch (insert.ROLLUP_STAGED_QUERY); only the Tag_Week_Rollup view is refreshed. """
+
+import logging
+
+from psycopg2.extensions import connection
+
+ROLLUPS = ["Tag_Week_Rollup"]
+
+# Recomputes the batch-maintained rollups from all stored data, as migration 0009 fills them.
+REBUILD_QUERY = """
+    DELETE FROM Tag_Rollup;
+    INSERT INTO Tag_Rollup (site_id, tag, tag_count, total_votes, total_answers)
+        SELECT q.site_id, t.tag,
+            COUNT(qt.tag_id),
+            COALESCE(SUM(q.votes), 0),
+            COALESCE(SUM(a.answer_count), 0)
+        FROM Question_Tag_Assignment qt
+        JOIN Tag t ON qt.tag_id = t.tag_id
+        JOIN Question q ON q.site_id = qt.site_id AND q.question_id = qt.question_id
+        LEFT JOIN (
+            SELECT site_id, question_id, COUNT(answer_id) AS answer_count
+            FROM Answer
+            GROUP BY site_id, question_id
+        ) a ON a.site_id = q.site_id AND a.question_id = q.question_id
+        GROUP BY q.site_id, t.tag;
+
+    DELETE FROM Question_Hour_Rollup;
+    INSERT INTO Question_Hour_Rollup (site_id, upload_hour, question_count)
+        SELECT site_id, DATE_PART('hour', upload_timestamp), COUNT(*)
+        FROM Question
+        GROUP BY 1, 2;
+
+    DELETE FROM Author_Rollup;
+    INSERT INTO Author_Rollup (site_id, author_id, author_username, num_questions_asked,
+                               num_answers_written)
+        SELECT posts.site_id, posts.author_id, a.author_username,
+            COUNT(*) FILTER (WHERE posts.is_question),
+            COUNT(*) FILTER (WHERE NOT posts.is_question)
+        FROM (
+            SELECT site_id, author_id, TRUE AS is_question FROM Question
+            UNION ALL
+            SELECT site_id, author_id, FALSE FROM Answer
+        ) posts
+        JOIN Author a ON a.author_id = posts.author_id
+        GROUP BY posts.site_id, posts.author_id, a.author_username;
+"""
+
+
+def refresh_rollups(conn: connection):
+    """ Recomputes each rollup view concurrently, so the dashboard keeps reading the
+        previous contents until the refresh commits. """
+
+    with conn.cursor() as cur:
+        for rollup in ROLLUPS:
+            logging.info("Refreshing %s", rollup)
+            cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {rollup};")
+            conn.commit()
+
+
+def rebuild_rollups(conn: connection):
+    """ Recomputes every rollup from all stored data, for data written to the tables
+        directly rather than through insert, in one transaction. """
+
+    logging.info("Rebuilding Tag_Rollup, Question_Hour_Rollup and Author_Rollup")
+    with conn.cursor() as cur:
+        cur.execute(REBUILD_QUERY)
+    conn.commit()
+    refresh_rollups(conn)
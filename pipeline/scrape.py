@@ -1,22 +1,131 @@
 """ Web scrapes stack exchange history questions for latest 50 questions.
     https://history.stackexchange.com/questions?tab=newest&pagesize=50.
-    Retrieves details about each question and their answers. """
+    Retrieves details about each question and their answers. Other Stack Exchange
+    sites are scraped the same way, from the listing page at their host. """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import requests as req
-from bs4 import BeautifulSoup
+from importlib.util import find_spec
+import logging
+from os import environ
+from threading import BoundedSemaphore, Lock
+import time
+from urllib.parse import urlparse
+
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+from requests import RequestException
+
+import archive
+import fetch
+import metrics
+import records
+import sites
+import stackexchange_api
+
+LISTING_URL = "https://{host}/questions?tab=Newest"
+host_limits = {}
+host_limits_lock = Lock()
+
+
+def class_filter(class_name: str):
+    """ Returns SoupStrainer attribute filter matching elements that have class_name
+        among their classes. """
+
+    def matches(value) -> bool:
+        if not value:
+            return False
+        classes = value.split() if isinstance(value, str) else value
+        return class_name in classes
+
+    return matches
+
+
+QUESTION_SUMMARIES = SoupStrainer("div", attrs={"class": class_filter("js-post-summary")})
+ANSWER_BLOCKS = SoupStrainer("div", attrs={"class": class_filter("answer")})
+
+
+def get_worker_count() -> int:
+    """ Returns number of threads used to fetch answer pages, from SCRAPE_WORKERS.
+        A value of 1 fetches pages one at a time. """
+
+    return max(1, int(environ.get("SCRAPE_WORKERS", 8)))
+
+
+def get_host_concurrency() -> int:
+    """ Returns maximum number of requests in flight to a single host,
+        from SCRAPE_HOST_CONCURRENCY. """
+
+    return max(1, int(environ.get("SCRAPE_HOST_CONCURRENCY", 4)))
+
+
+def get_answer_source() -> str:
+    """ Returns where answers come from, from SCRAPE_ANSWER_SOURCE: "html" scrapes each
+        question page, "api" requests them in batches from the Stack Exchange API. """
+
+    return environ.get("SCRAPE_ANSWER_SOURCE", "html").lower()
+
+
+def get_host_limit(url: str) -> BoundedSemaphore:
+    """ Returns semaphore capping concurrent requests to the host of the URL. """
+
+    host = urlparse(url).netloc
+    with host_limits_lock:
+        if host not in host_limits:
+            host_limits[host] = BoundedSemaphore(get_host_concurrency())
+        return host_limits[host]
+
+
+def get_listing_url(host: str = sites.DEFAULT_HOST) -> str:
+    """ Returns URL of the newest questions listing of the site at host. """
+
+    return LISTING_URL.format(host=host)
 
 
 def get_website(url: str):
-    """ Gets URL for recent 50 history questions """
+    """ Gets URL for recent 50 history questions, archiving the page. """
+
+    with get_host_limit(url):
+        response = fetch.cached_get(url)
+    archive.archive_page(url, response)
+    return response
+
+
+def get_parser_backend() -> str:
+    """ Returns BeautifulSoup parser backend from SCRAPE_PARSER, defaulting to lxml
+        when it is installed. """
+
+    backend = environ.get("SCRAPE_PARSER")
+    if backend:
+        return backend
+    return "lxml" if find_spec("lxml") else "html.parser"
+
+
+def soup_website(response: str, parse_only: SoupStrainer = None):
+    """ Web scrapes response of website and parses it.
+        If parse_only is given, only the matching nodes are built into the tree. """
+
+    return soup_html(response.text, parse_only)
+
 
-    return req.get(url, timeout=15)
+def soup_html(html: str, parse_only: SoupStrainer = None):
+    """ Parses HTML, building only the nodes matching parse_only if it is given. """
 
+    return BeautifulSoup(html, features=get_parser_backend(), parse_only=parse_only)
 
-def soup_website(response: str):
-    """ Web scrapes response of website and parses it. """
 
-    return BeautifulSoup(response.text, features="html.parser")
+def parse_listing_page(html: str, host: str = sites.DEFAULT_HOST) -> list[dict]:
+    """ Returns summaries of the questions on the HTML of a listing page of the site
+        at host. """
+
+    return [extract_question_summary(question, host)
+            for question in get_all_questions(soup_html(html, QUESTION_SUMMARIES))]
+
+
+def parse_question_page(html: str) -> list[records.Answer]:
+    """ Returns details of the answers on a question page's HTML. """
+
+    return [extract_answer(answer)
+            for answer in soup_html(html, ANSWER_BLOCKS).find_all("div", class_="answer js-answer")]
 
 
 def get_all_questions(soup: str) -> str:
@@ -25,189 +134,352 @@ def get_all_questions(soup: str) -> str:
     return soup.find_all("div", class_="js-post-summary")
 
 
-def get_questions_details(questions: str) -> list[dict]:
+def get_questions_details(questions: str, workers: int = None, known_states: dict = None,
+                          host: str = sites.DEFAULT_HOST,
+                          include=None) -> list[records.Question]:
     """ Retrieves details for each question: title, tags, votes, answer count, views,
-        username, answers and its details"""
+        username, answers and its details. """
 
-    questions_data = []
-    for question in questions:
+    return list(iter_questions_details(questions, workers, known_states, host, include))
 
-        votes, views, username = get_question_stats(question)
 
-        questions_data.append(
-            {
-                'question_id': get_question_id(question),
-                'title': get_question_title(question),
-                'timestamp': get_question_timestamp(question),
-                'tags': get_question_tags(question),
-                'votes': votes,
-                'views': views,
-                'username': username,
-                'answers': get_answers(question)
-            })
-        # print(len(questions_data))
-    return questions_data
+def iter_questions_details(questions: str, workers: int = None, known_states: dict = None,
+                           host: str = sites.DEFAULT_HOST, include=None):
+    """ Yields details for each question of the site at host as soon as its answers
+        are fetched.
+        Answer pages are fetched concurrently; results keep the order of the questions.
+        If include is given, it is called once with each question's summary and only
+        the questions it returns True for are fetched and yielded.
+        If known_states is given (incremental mode), answer pages are only fetched for
+        questions that changed since they were stored; the rest get no answers.
+        Questions whose answer page could not be fetched are left out, so the next
+        run fetches them again. """
 
+    summaries = [extract_question_summary(question, host) for question in questions]
+    if include is not None:
+        summaries = [summary for summary in summaries if include(summary)]
+    changed = [known_states is None or has_question_changed(summary, known_states)
+               for summary in summaries]
+    to_fetch = [summary['link'] for summary, is_changed in zip(summaries, changed)
+                if is_changed]
 
-def get_question_id(question: str) -> str:
-    """ Retrieves id from question """
+    if known_states is not None:
+        logging.info("Incremental scrape: fetching %s answer pages, skipped %s unchanged.",
+                     len(to_fetch), len(summaries) - len(to_fetch))
 
-    question_id = question.get('data-post-id')
-    return question_id if question_id else None
+    workers = workers or get_worker_count()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if get_answer_source() == "api":
+            fetched_answers = get_answers_from_api(
+                [summary['question_id'] for summary, is_changed in zip(summaries, changed)
+                 if is_changed], sites.get_site_name(host))
+        else:
+            fetched_answers = executor.map(get_answers_from_page, to_fetch)
+
+        for summary, is_changed in zip(summaries, changed):
+            answers = next(fetched_answers) if is_changed else []
+            if answers is None:
+                logging.warning("Skipping question %s, its answers could not be fetched.",
+                                summary['question_id'])
+                metrics.increment("questions_skipped_total")
+                continue
+
+            yield question_from_summary(summary, answers)
 
 
-def get_question_title(question: str) -> str:
-    """ Retrieves question title """
+def question_from_summary(summary: dict, answers: list[records.Answer]) -> records.Question:
+    """ Returns record of a question from its listing summary and its answers. """
 
-    return question.find(
-        "h3", class_="s-post-summary--content-title").get_text().strip()
+    return records.Question(site=summary['site'],
+                            question_id=summary['question_id'],
+                            title=summary['title'],
+                            timestamp=summary['timestamp'],
+                            tags=summary['tags'],
+                            votes=summary['votes'],
+                            views=summary['views'],
+                            username=summary['username'],
+                            answer_count=summary['answer_count'],
+                            last_activity=summary['last_activity'],
+                            answers=answers)
 
 
-def get_question_tags(question: str) -> list:
-    """ Retrieves question tags """
+def has_question_changed(summary: dict, known_states: dict) -> bool:
+    """ Returns whether a question's answer page needs fetching, comparing its listing
+        answer count, last activity time, votes and views with the stored
+        (answer count, last activity, votes, views). """
 
-    return [tag.get_text() for tag in question.find_all(
-        "li", class_="d-inline mr4 js-post-tag-list-item")]
+    if summary['answer_count'] == 0:
+        return False
 
+    state = known_states.get(summary['question_id'])
+    if state is None:
+        return True
 
-def get_question_timestamp(question: str) -> str:
-    """ Retrieves timestamp of when question was asked. """
+    stored_answer_count, stored_last_activity, stored_votes, stored_views = state
+    last_activity = summary['last_activity']
 
-    time_element = question.find('time', class_='s-user-card--time')
-    if time_element and 'asked' in time_element.text:
-        timestamp = time_element.find(
-            'span', class_='relativetime').get('title')
-        return format_timestamp(timestamp)
-    return None
+    return (summary['answer_count'] != stored_answer_count
+            or summary['votes'] != stored_votes
+            or summary['views'] != stored_views
+            or last_activity is None
+            or stored_last_activity is None
+            or last_activity > stored_last_activity)
 
 
-def get_question_stats(question: str) -> str:
-    """ Retrieves statistics for a question regarding: votes, answer count, views, username. """
+def has_class(element: Tag, class_name: str) -> bool:
+    """ Matches classes the way BeautifulSoup's class_ filter does: either one of the
+        element's classes, or its whole class string. """
 
-    all_stats = question.find_all(
-        "div", class_="s-post-summary--stats-item")
+    classes = element.get("class") or []
+    return class_name in classes or " ".join(classes) == class_name
+
+
+def is_inside(element: Tag, ancestor: Tag) -> bool:
+    """ Returns whether element is nested inside ancestor. """
+
+    return any(parent is ancestor for parent in element.parents)
+
+
+def get_question_id(question: str) -> int:
+    """ Retrieves id from question """
+
+    question_id = question.get('data-post-id')
+    return int(question_id) if question_id else None
+
+
+def extract_question_summary(question: Tag, host: str = sites.DEFAULT_HOST) -> dict:
+    """ Retrieves site, question id, title, link, tags, votes, answer count, views,
+        username, timestamp of when it was asked and of its latest activity, walking the
+        question summary of a listing of the site at host once. """
+
+    title = link = time_element = relative_time = user_card = None
+    tags = []
+    stats = []
+
+    for element in question.descendants:
+        if not isinstance(element, Tag):
+            continue
+
+        if element.name == "div":
+            if has_class(element, "s-post-summary--stats-item"):
+                stats.append({'element': element, 'unit': None, 'number': None})
+            if user_card is None and has_class(element, "s-user-card--link d-flex gs4"):
+                user_card = element
+
+        elif element.name == "span":
+            if stats and is_inside(element, stats[-1]['element']):
+                for part in ('unit', 'number'):
+                    if (stats[-1][part] is None
+                            and has_class(element, f"s-post-summary--stats-item-{part}")):
+                        stats[-1][part] = element
+            if (relative_time is None and time_element is not None
+                    and has_class(element, "relativetime") and is_inside(element, time_element)):
+                relative_time = element
+
+        elif element.name == "h3":
+            if title is None and has_class(element, "s-post-summary--content-title"):
+                title = element.get_text().strip()
+
+        elif element.name == "a":
+            if link is None and has_class(element, "s-link"):
+                link = f"https://{host}/{element.get('href')}"
+
+        elif element.name == "li":
+            if has_class(element, "d-inline mr4 js-post-tag-list-item"):
+                tags.append(element.get_text())
+
+        elif element.name == "time":
+            if time_element is None and has_class(element, "s-user-card--time"):
+                time_element = element
+
+    votes, views, answer_count = get_question_stats(stats)
+
+    last_activity = None
+    if relative_time is not None and relative_time.get('title'):
+        last_activity = format_timestamp(relative_time.get('title'))
+
+    return {
+        'site': sites.get_site_name(host),
+        'question_id': get_question_id(question),
+        'title': title,
+        'link': link,
+        'timestamp': (last_activity if time_element is not None and 'asked' in time_element.text
+                      else None),
+        'tags': tags,
+        'votes': votes,
+        'views': views,
+        'username': user_card.get_text().strip(),
+        'answer_count': answer_count,
+        'last_activity': last_activity
+    }
+
+
+def get_question_stats(stats: list[dict]) -> tuple:
+    """ Retrieves votes, views and answer count from the statistics of a question,
+        as ints. """
 
     votes = 0
     views = 0
+    answer_count = 0
 
-    for stat in all_stats:
-        stat_text = stat.find(
-            'span', class_="s-post-summary--stats-item-unit").get_text().strip()
-        stat_value = stat.find(
-            'span', class_="s-post-summary--stats-item-number").get_text().strip()
-
-        if stat_value.endswith('k'):
-            stat_value = stat_value.replace('k', '000')
+    for stat in stats:
+        stat_text = stat['unit'].get_text().strip()
+        stat_value = records.parse_count(stat['number'].get_text())
 
         if stat_text in ("vote", "votes"):
             votes = stat_value
         elif stat_text in ("view", "views"):
             views = stat_value
+        elif stat_text in ("answer", "answers"):
+            answer_count = stat_value
 
-    username = question.find(
-        "div", class_="s-user-card--link d-flex gs4").get_text().strip()
-
-    return votes, views, username
+    return votes, views, answer_count
 
 
-def get_answers(question) -> list[dict]:
+def get_answers(question, host: str = sites.DEFAULT_HOST) -> list[records.Answer]:
     """ Retrieves all answers for a questions and its details" answer, username, vote. """
 
-    all_answers = scrape_answer(question)
-    answers = []
+    return [extract_answer(answer) for answer in scrape_answer(question, host)]
 
-    for answer in all_answers:
 
-        answers.append(
-            {'answer_id': get_answer_id(answer),
-             'answer': get_answer_text(answer),
-             'username': get_answer_author(answer),
-             'vote_count': get_answer_votes(answer),
-             'timestamp': get_answer_timestamp(answer)
-             }
-        )
+def get_answers_from_page(link: str) -> list[records.Answer]:
+    """ Retrieves all answers and their details from a question page.
+        Returns None if the page could not be fetched. """
 
-    return answers
+    try:
+        return [extract_answer(answer) for answer in scrape_answer_page(link)]
+    except RequestException as e:
+        logging.warning("Could not fetch answers from %s: %s", link, e)
+        return None
 
 
-def scrape_answer(question) -> list[str]:
-    """ Extracts all answers for a given question. """
+def get_answers_from_api(question_ids: list[int], site: str = sites.DEFAULT_SITE):
+    """ Returns iterator of the answers of each question of a site, in order, fetched
+        from the Stack Exchange API. If the API cannot be reached, every question gets None. """
 
-    link = f"https://history.stackexchange.com/{
-        question.find("a", class_="s-link").get("href")}"
+    try:
+        answers = stackexchange_api.get_answers(question_ids, site)
+    except RequestException as e:
+        logging.warning("Could not fetch answers from the Stack Exchange API: %s", e)
+        return iter([None] * len(question_ids))
 
-    question_response = get_website(link)
-    soup = soup_website(question_response)
+    return iter([answers.get(question_id, []) for question_id in question_ids])
 
-    all_answers = soup.find_all("div", class_="answer js-answer")
 
-    return all_answers
+def scrape_answer(question, host: str = sites.DEFAULT_HOST) -> list[str]:
+    """ Extracts all answers for a given question of the site at host. """
 
+    href = question.find("a", class_="s-link").get("href")
+    return scrape_answer_page(f"https://{host}/{href}")
 
-def get_answer_id(answer: str) -> str:
-    """ Retrieves id from answer. """
 
-    answer_id = answer.get('data-answerid')
-    return answer_id if answer_id else None
+def scrape_answer_page(link: str) -> list[str]:
+    """ Extracts all answers from a question page, parsing only the answer blocks. """
 
+    question_response = get_website(link)
+    question_response.raise_for_status()
+    start = time.perf_counter()
+    soup = soup_website(question_response, ANSWER_BLOCKS)
+    answers = soup.find_all("div", class_="answer js-answer")
+    metrics.observe("page_parse_seconds", time.perf_counter() - start, page="question")
 
-def get_answer_text(answer: str) -> str:
-    """ Extracts answer text. """
-    return answer.find(
-        'div', class_='s-prose js-post-body').get_text().strip()
+    return answers
 
 
-def get_answer_author(answer: str) -> str:
-    """ Retrieves username of author of an answer to a question. """
+def extract_answer(answer: Tag) -> records.Answer:
+    """ Retrieves answer id, text, author username, votes and timestamp of when it was
+        answered, walking the answer block once. """
 
-    author = answer.find('div', itemprop="author").find(
-        'span', itemprop='name')
+    text = author = author_name = author_link = votes = action_time = relative_time = None
 
-    if author:
-        username = author.get_text()
-    else:
-        username = answer.find(
-            'div', itemprop="author").find('a').get_text()
+    for element in answer.descendants:
+        if not isinstance(element, Tag):
+            continue
 
-    return username
+        if element.name == "div":
+            if text is None and has_class(element, "s-prose js-post-body"):
+                text = element.get_text().strip()
+            if author is None and element.get("itemprop") == "author":
+                author = element
+            if votes is None and has_class(element, "js-vote-count"):
+                votes = records.parse_count(element.get_text())
+            if action_time is None and has_class(element, "user-action-time fl-grow1"):
+                action_time = element
 
+        elif element.name == "span":
+            if (author_name is None and author is not None
+                    and element.get("itemprop") == "name" and is_inside(element, author)):
+                author_name = element
+            if (relative_time is None and action_time is not None
+                    and has_class(element, "relativetime") and is_inside(element, action_time)):
+                relative_time = element
 
-def get_answer_votes(answer: str) -> str:
-    """ Extracts votes for an answer. """
-    return answer.find(
-        'div', class_='js-vote-count').get_text().strip().replace('k', '000')
+        elif element.name == "a":
+            if author_link is None and author is not None and is_inside(element, author):
+                author_link = element
 
+    timestamp = None
+    if action_time is not None and "answered" in action_time.text:
+        timestamp = format_timestamp(relative_time.get("title"))
 
-def get_answer_timestamp(answer: str) -> str:
-    """ Retrieves timestamp of when question was asked. """
+    return records.Answer(answer_id=get_answer_id(answer),
+                          answer=text,
+                          username=(author_name or author_link).get_text(),
+                          vote_count=votes,
+                          timestamp=timestamp)
 
-    div = answer.find("div", class_="user-action-time fl-grow1")
-    if div and "answered" in div.text:
-        timestamp = div.find("span", class_="relativetime").get("title")
-        return format_timestamp(timestamp)
-    return None
+
+def get_answer_id(answer: str) -> int:
+    """ Retrieves id from answer. """
+
+    answer_id = answer.get('data-answerid')
+    return int(answer_id) if answer_id else None
 
 
-def format_timestamp(timestamp: str) -> str:
+def format_timestamp(timestamp: str) -> datetime:
     """ Formats extracted timestamp into Postgres timestamp datatype form. """
 
     return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%SZ")
 
 
-def extract_stack_exchange_history_data() -> dict:
-    """ Extracts stack exchange data for history questions"""
+def extract_stack_exchange_history_data(
+        get_known_states=None,
+        url: str = get_listing_url(),
+        include=None
+) -> list[records.Question]:
+    """ Extracts stack exchange data for history questions from a listing page, or for
+        the questions of another site from a listing page at its host.
+        If get_known_states is given, it is called with the listed question ids and must
+        return their stored {question_id: (answer count, last activity, votes, views)};
+        only changed questions then have their answer pages fetched.
+        If include is given, only the questions whose summary it returns True for are
+        fetched. """
+
+    return list(iter_stack_exchange_history_data(get_known_states, url, include))
+
+
+def iter_stack_exchange_history_data(get_known_states=None, url: str = get_listing_url(),
+                                     include=None):
+    """ Yields stack exchange data for each question of a listing page
+        as soon as it is scraped. """
 
-    response = get_website(
-        "https://history.stackexchange.com/questions?tab=Newest")
-    print(response.status_code)
-    soup = soup_website(response)
+    response = get_website(url)
+    logging.info("Listing %s returned %s.", url, response.status_code)
+    response.raise_for_status()
+    start = time.perf_counter()
+    soup = soup_website(response, QUESTION_SUMMARIES)
 
     questions = get_all_questions(soup)
-    result = get_questions_details(questions)
+    metrics.observe("page_parse_seconds", time.perf_counter() - start, page="listing")
+    known_states = None
+    if get_known_states:
+        known_states = get_known_states(
+            [get_question_id(question) for question in questions])
 
-    print(len(questions))
+    logging.info("Found %s questions.", len(questions))
 
-    return result
+    yield from iter_questions_details(questions, known_states=known_states,
+                                      host=urlparse(url).netloc, include=include)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+""" Stack Exchange sites the pipeline scrapes. A site is given by its host, and stored
+    under its name, which is also the site parameter of the Stack Exchange API. """
+
+from os import environ
+
+DEFAULT_HOST = "history.stackexchange.com"
+DEFAULT_SITE = "history"
+
+
+def get_hosts() -> list[str]:
+    """ Returns hosts of the sites to scrape, from the comma separated PIPELINE_SITES,
+        e.g. "history.stackexchange.com,politics.stackexchange.com". """
+
+    hosts = environ.get("PIPELINE_SITES", DEFAULT_HOST).split(",")
+    return list(dict.fromkeys(host.strip().lower() for host in hosts if host.strip()))
+
+
+def get_site_name(host: str) -> str:
+    """ Returns name of the site at a host: history for history.stackexchange.com,
+        stackoverflow for stackoverflow.com, mathoverflow.net for mathoverflow.net. """
+
+    host = host.lower()
+    if host.endswith(".stackexchange.com"):
+        return host[:-len(".stackexchange.com")]
+    if host.endswith(".com"):
+        return host[:-len(".com")]
+    return host
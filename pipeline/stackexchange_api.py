@@ -0,0 +1,106 @@
+""" Fetches answers through the Stack Exchange API, up to 100 questions per request,
+    as an alternative to scraping each question page. Answers have the same shape as
+    scrape.extract_answer returns.
+    https://api.stackexchange.com/docs/answers-on-questions """
+
+import html
+import logging
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from os import environ
+from urllib.parse import quote, urlencode
+
+from bs4 import BeautifulSoup
+
+import fetch
+import records
+import sites
+
+API_BATCH_SIZE = 100
+ANSWER_FIELDS = [".backoff", ".has_more", ".items", ".quota_remaining",
+                 "answer.answer_id", "answer.body", "answer.creation_date", "answer.owner",
+                 "answer.question_id", "answer.score", "shallow_user.display_name"]
+
+
+def get_api_url() -> str:
+    """ Returns base URL of the API, from SE_API_URL. """
+
+    return environ.get("SE_API_URL", "https://api.stackexchange.com/2.3").rstrip("/")
+
+
+def get_api_params(site: str, **params) -> dict:
+    """ Returns query parameters for a site, with the app key in SE_API_KEY if one is
+        set, which raises the daily request quota. """
+
+    params["site"] = site
+    if environ.get("SE_API_KEY"):
+        params["key"] = environ["SE_API_KEY"]
+    return params
+
+
+def get_json(path: str, params: dict) -> dict:
+    """ Gets an API method as JSON, through the rate limited and retrying fetcher.
+        Waits afterwards if the API asked for a backoff. """
+
+    response = fetch.get_with_retries(f"{get_api_url()}{path}?{urlencode(params)}", {},
+                                      fetch.get_timeout(), "disabled")
+    response.raise_for_status()
+    data = response.json()
+
+    if data.get("backoff"):
+        logging.info("Stack Exchange API asked to back off for %s seconds.", data["backoff"])
+        time.sleep(data["backoff"])
+    return data
+
+
+@lru_cache(maxsize=1)
+def get_answer_filter() -> str:
+    """ Returns filter limiting answers to the fields ANSWER_FIELDS. Uses SE_API_FILTER
+        if set, otherwise creates the filter with one request per run. """
+
+    if environ.get("SE_API_FILTER"):
+        return environ["SE_API_FILTER"]
+
+    data = get_json("/filters/create", {"include": ";".join(ANSWER_FIELDS),
+                                        "base": "none", "unsafe": "false"})
+    return data["items"][0]["filter"]
+
+
+def format_answer(item: dict) -> records.Answer:
+    """ Returns record of an API answer. """
+
+    return records.Answer(
+        answer_id=item['answer_id'],
+        answer=BeautifulSoup(item.get('body', ''), "html.parser").get_text().strip(),
+        username=html.unescape(item.get('owner', {}).get('display_name', '')),
+        vote_count=item['score'],
+        timestamp=datetime.fromtimestamp(item['creation_date'], timezone.utc)
+        .replace(tzinfo=None) if 'creation_date' in item else None)
+
+
+def get_answers(question_ids: list[int],
+                site: str = sites.DEFAULT_SITE) -> dict[int, list[records.Answer]]:
+    """ Returns {question id: answers} for the given questions of a site, requesting up
+        to API_BATCH_SIZE questions at a time and following pages of results. """
+
+    answers = {question_id: [] for question_id in question_ids}
+    data = {}
+
+    for start in range(0, len(question_ids), API_BATCH_SIZE):
+        batch = ";".join(map(str, question_ids[start:start + API_BATCH_SIZE]))
+        page = 1
+        while True:
+            data = get_json(f"/questions/{quote(batch, safe=';')}/answers",
+                            get_api_params(site, filter=get_answer_filter(), pagesize=100,
+                                           page=page, sort="votes", order="desc"))
+            for item in data.get("items", []):
+                answers.setdefault(item["question_id"], []).append(format_answer(item))
+
+            if not data.get("has_more"):
+                break
+            page += 1
+
+    if "quota_remaining" in data:
+        logging.info("Stack Exchange API quota remaining: %s", data["quota_remaining"])
+    return answers
@@ -0,0 +1,8 @@
+""" Puts the pipeline and benchmark modules on the import path, as they import each
+    other by name from their own directories. """
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "pipeline"), os.path.join(ROOT, "benchmark")]
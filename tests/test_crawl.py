@@ -0,0 +1,171 @@
+""" Tests of crawling listing pages and checkpointing against stubbed pages, including
+    answer pages that cannot be fetched. """
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+import requests as req
+
+import benchmark
+import crawl
+import fetch
+import pipeline
+import records
+import sites
+
+HOST = sites.DEFAULT_HOST
+PAGES = 3
+QUESTIONS_PER_PAGE = 2
+NEWEST = datetime(2024, 3, 6, 12)
+
+
+def make_question(index: int) -> records.Question:
+    """ Returns the index-th newest question, asked a day after the next one. """
+
+    question_id = 1000 - index
+    timestamp = NEWEST - timedelta(days=index)
+    return records.Question(
+        site=sites.DEFAULT_SITE, question_id=question_id, title=f"Question {question_id}",
+        timestamp=timestamp, tags=["crime"], votes=index, views=10, username="Andrea",
+        answer_count=1, last_activity=timestamp,
+        answers=[records.Answer(answer_id=question_id * 10, answer="Answer",
+                                username="O'Brien", vote_count=1,
+                                timestamp=timestamp + timedelta(minutes=1))])
+
+
+def get_answer_url(question_id: int) -> str:
+    """ Returns URL of a question's answer page, as linked from its listing summary. """
+
+    return f"https://{HOST}//questions/{question_id}/question-{question_id}"
+
+
+class StubSession:
+    """ Session serving pages by URL, failing URLs with 503 and others with 404. """
+
+    def __init__(self, pages: dict, failing: set):
+        self.pages = pages
+        self.failing = failing
+        self.requested = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requested.append(url)
+        response = req.Response()
+        response.url = url
+        response.encoding = "utf-8"
+        response.status_code = (503 if url in self.failing
+                                else 200 if url in self.pages else 404)
+        body = self.pages[url] if response.status_code == 200 else ""
+        response._content = body.encode("utf-8")  # pylint: disable=protected-access
+        return response
+
+
+@pytest.fixture(name="site")
+def fixture_site(tmp_path, monkeypatch):
+    """ Serves PAGES listing pages of questions, each with an answer page, followed by
+        an empty listing page. Answer pages whose question id is added to failing fail. """
+
+    questions = [make_question(index) for index in range(PAGES * QUESTIONS_PER_PAGE)]
+    pages = {}
+    for page in range(1, PAGES + 2):
+        listed = questions[(page - 1) * QUESTIONS_PER_PAGE:page * QUESTIONS_PER_PAGE]
+        pages[crawl.get_listing_url(page, HOST)] = benchmark.PAGE_TEMPLATE.format(
+            body="".join(benchmark.render_summary(
+                question, f"/questions/{question.question_id}/question-{question.question_id}")
+                for question in listed))
+    for question in questions:
+        pages[get_answer_url(question.question_id)] = benchmark.PAGE_TEMPLATE.format(
+            body="".join(map(benchmark.render_answer, question.answers)))
+
+    failing = set()
+    session = StubSession(pages, failing)
+    monkeypatch.setattr(fetch, "get_session", lambda: session)
+    monkeypatch.setattr(fetch, "rate_limits", {})
+    for name in ("CRAWL_FIRST_PAGE", "CRAWL_LAST_PAGE", "CRAWL_SINCE", "CRAWL_UNTIL",
+                 "SCRAPE_ANSWER_SOURCE"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("HTTP_CACHE_DIR", "")
+    monkeypatch.setenv("ARCHIVE_DIR", "")
+    monkeypatch.setenv("HTTP_MAX_RETRIES", "0")
+    monkeypatch.setenv("HTTP_RATE", "1000")
+    monkeypatch.setenv("HTTP_BURST", "1000")
+    monkeypatch.setenv("HTTP_MAX_RATE", "1000")
+    monkeypatch.setenv("CRAWL_CHECKPOINT", str(tmp_path / "crawl_checkpoint.json"))
+
+    return SimpleNamespace(session=session, failing=failing,
+                           checkpoint_path=crawl.get_checkpoint_path(HOST))
+
+
+def get_answer_requests(site) -> list[int]:
+    """ Returns ids of the questions whose answer pages were requested, sorted. """
+
+    return sorted(int(url.rsplit("-", 1)[1]) for url in site.session.requested
+                  if "/question-" in url)
+
+
+def crawl_and_insert(site) -> list[tuple]:
+    """ Runs pipeline.crawl_pages as insert_units does, returning the ids of each unit's
+        questions and the checkpoint after its callback ran. """
+
+    inserted = []
+    for questions, on_inserted in pipeline.crawl_pages(None, HOST):
+        if on_inserted:
+            on_inserted()
+        inserted.append(([question.question_id for question in questions],
+                         crawl.load_checkpoint(site.checkpoint_path)))
+    return inserted
+
+
+def test_crawl_history_stops_at_empty_listing_page(site):
+    pages = list(crawl.crawl_history(host=HOST))
+
+    assert [(page, [question.question_id for question in questions], skipped)
+            for page, questions, skipped in pages] \
+        == [(1, [1000, 999], 0), (2, [998, 997], 0), (3, [996, 995], 0)]
+    assert pages[0][1][0].answers[0].answer_id == 10000
+    assert crawl.get_listing_url(PAGES + 1, HOST) in site.session.requested
+    assert crawl.get_listing_url(PAGES + 2, HOST) not in site.session.requested
+
+
+def test_crawl_history_fetches_answers_only_in_range(site):
+    pages = list(crawl.crawl_history(since=NEWEST - timedelta(days=3, hours=12),
+                                     until=NEWEST - timedelta(hours=12), host=HOST))
+
+    assert [(page, [question.question_id for question in questions], skipped)
+            for page, questions, skipped in pages] \
+        == [(1, [999], 0), (2, [998, 997], 0), (3, [], 0)]
+    assert get_answer_requests(site) == [997, 998, 999]
+    assert crawl.get_listing_url(PAGES + 1, HOST) not in site.session.requested
+
+
+def test_crawl_history_counts_questions_whose_answers_failed(site):
+    site.failing.add(get_answer_url(998))
+
+    pages = list(crawl.crawl_history(host=HOST))
+
+    assert [(page, len(questions), skipped) for page, questions, skipped in pages] \
+        == [(1, 2, 0), (2, 1, 1), (3, 2, 0)]
+
+
+def test_crawl_pages_moves_checkpoint_and_removes_it_at_the_end(site):
+    assert crawl_and_insert(site) == [([1000, 999], 2), ([998, 997], 3), ([996, 995], 4),
+                                      ([], None)]
+
+
+def test_crawl_pages_keeps_checkpoint_at_page_with_failed_answers(site):
+    site.failing.add(get_answer_url(998))
+
+    assert crawl_and_insert(site) == [([1000, 999], 2), ([997], 2), ([996, 995], 2)]
+
+    site.failing.clear()
+    site.session.requested.clear()
+
+    assert crawl_and_insert(site) == [([998, 997], 3), ([996, 995], 4), ([], None)]
+    assert crawl.get_listing_url(1, HOST) not in site.session.requested
+
+
+def test_crawl_resumes_from_checkpoint(site, monkeypatch):
+    crawl.save_checkpoint(site.checkpoint_path, 3)
+    monkeypatch.setenv("CRAWL_LAST_PAGE", "3")
+
+    assert [page for page, _, _ in crawl.crawl_history_from_environment(host=HOST)] == [3]
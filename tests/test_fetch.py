@@ -0,0 +1,214 @@
+""" Tests of request retries, backoff and cache eviction against stubbed responses. """
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+import requests as req
+
+import fetch
+import rate_limit
+
+URL = "https://history.stackexchange.com/questions"
+
+
+def make_response(status: int, headers: dict = None, body: bytes = b"") -> req.Response:
+    """ Returns a response as the session gives it. """
+
+    response = req.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = body  # pylint: disable=protected-access
+    response.url = URL
+    return response
+
+
+class StubSession:
+    """ Session answering each request with the next of its outcomes, a response or
+        an exception to raise. """
+
+    def __init__(self, outcomes: list):
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append((url, headers))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture(name="stub")
+def fixture_stub(tmp_path, monkeypatch):
+    """ Replaces the session and rate limiters with fresh ones, and records the retry
+        waits and rate limit waits instead of sleeping. Backoffs take their longest
+        value, HTTP_BACKOFF_BASE * 2 ** attempt. """
+
+    stub = SimpleNamespace(session=None, sleeps=[], waits=[])
+
+    def set_outcomes(*outcomes):
+        stub.session = StubSession(outcomes)
+
+    stub.set_outcomes = set_outcomes
+    monkeypatch.setattr(fetch, "get_session", lambda: stub.session)
+    monkeypatch.setattr(fetch, "rate_limits", {})
+    monkeypatch.setattr(fetch, "time", SimpleNamespace(sleep=stub.sleeps.append,
+                                                       perf_counter=time.perf_counter,
+                                                       time=time.time))
+    monkeypatch.setattr(fetch, "random", SimpleNamespace(uniform=lambda low, high: high))
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(sleep=stub.waits.append,
+                                                            monotonic=time.monotonic))
+    monkeypatch.setenv("HTTP_RATE", "100")
+    monkeypatch.setenv("HTTP_BURST", "100")
+    monkeypatch.setenv("HTTP_MAX_RATE", "200")
+    monkeypatch.setenv("HTTP_MAX_RETRIES", "3")
+    monkeypatch.setenv("HTTP_BACKOFF_BASE", "0.5")
+    monkeypatch.setenv("HTTP_BACKOFF_MAX", "60")
+    monkeypatch.setenv("HTTP_CACHE_DIR", str(tmp_path / "http_cache"))
+    return stub
+
+
+def get_bucket_stats() -> dict:
+    """ Returns statistics of the only host's rate limiter. """
+
+    [stats] = fetch.get_rate_limit_stats()
+    return stats
+
+
+def test_throttled_response_is_retried_after_backoff(stub):
+    stub.set_outcomes(make_response(503), make_response(200, body=b"ok"))
+
+    response = fetch.get_with_retries(URL, {}, 1, "miss")
+
+    assert response.status_code == 200
+    assert len(stub.session.requests) == 2
+    assert stub.sleeps == [0.5]
+    stats = get_bucket_stats()
+    assert stats['requests'] == 2
+    assert stats['throttled'] == 1
+    assert stats['rate'] == 50.1
+
+
+def test_retry_after_is_waited_for_and_pauses_the_host(stub):
+    stub.set_outcomes(make_response(429, {"Retry-After": "3"}), make_response(200))
+
+    fetch.get_with_retries(URL, {}, 1, "miss")
+
+    assert stub.sleeps == [3.0]
+    assert len(stub.waits) == 1
+    assert 2.5 < stub.waits[0] <= 3.1
+
+
+def test_retry_after_is_capped(stub, monkeypatch):
+    monkeypatch.setenv("HTTP_BACKOFF_MAX", "10")
+    stub.set_outcomes(make_response(503, {"Retry-After": "120"}), make_response(200))
+
+    fetch.get_with_retries(URL, {}, 1, "miss")
+
+    assert stub.sleeps == [10.0]
+
+
+def test_retry_after_accepts_http_date(stub):
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    response = make_response(429, {"Retry-After": format_datetime(retry_at, usegmt=True)})
+
+    assert 28 < fetch.get_retry_after(response) <= 30
+    assert fetch.get_retry_after(make_response(429, {"Retry-After": "soon"})) is None
+    assert fetch.get_retry_after(make_response(429)) is None
+
+
+def test_server_errors_return_last_response_once_retries_run_out(stub):
+    stub.set_outcomes(*[make_response(500) for _ in range(4)])
+
+    response = fetch.get_with_retries(URL, {}, 1, "miss")
+
+    assert response.status_code == 500
+    assert len(stub.session.requests) == 4
+    assert stub.sleeps == [0.5, 1.0, 2.0]
+    assert get_bucket_stats()['throttled'] == 0
+
+
+def test_connection_errors_raise_once_retries_run_out(stub, monkeypatch):
+    monkeypatch.setenv("HTTP_MAX_RETRIES", "2")
+    stub.set_outcomes(req.ConnectionError("reset"), req.Timeout("slow"),
+                      req.ConnectionError("refused"))
+
+    with pytest.raises(req.ConnectionError, match="refused"):
+        fetch.get_with_retries(URL, {}, 1, "miss")
+
+    assert len(stub.session.requests) == 3
+    assert stub.sleeps == [0.5, 1.0]
+
+
+def test_client_error_is_not_retried(stub):
+    stub.set_outcomes(make_response(404))
+
+    assert fetch.get_with_retries(URL, {}, 1, "miss").status_code == 404
+    assert stub.sleeps == []
+
+
+def test_backoff_is_capped(stub, monkeypatch):
+    monkeypatch.setenv("HTTP_BACKOFF_MAX", "3")
+
+    assert [fetch.get_backoff(attempt) for attempt in range(5)] == [0.5, 1.0, 2.0, 3.0, 3.0]
+
+
+def test_not_modified_response_gets_cached_body(stub):
+    stub.set_outcomes(make_response(200, {"ETag": '"v1"'}, b"listing"),
+                      make_response(304))
+
+    fetch.cached_get(URL)
+    response = fetch.cached_get(URL)
+
+    assert stub.session.requests[1][1] == {"If-None-Match": '"v1"'}
+    assert response.content == b"listing"
+    assert response.from_cache
+
+
+def add_cache_entry(url: str, validated_at: float, body: bytes = b"page"):
+    """ Writes a cache entry for a URL last validated at validated_at. """
+
+    body_path, meta_path = fetch.get_cache_paths(url)
+    os.makedirs(fetch.get_cache_dir(), exist_ok=True)
+    fetch.write_file(body_path, body)
+    fetch.write_meta(meta_path, {"url": url, "etag": '"v1"', "last_modified": None,
+                                 "encoding": "utf-8", "validated_at": validated_at})
+
+
+def is_cached(url: str) -> bool:
+    """ Returns whether both files of a URL's cache entry exist. """
+
+    return all(os.path.exists(path) for path in fetch.get_cache_paths(url))
+
+
+def test_evict_cache_removes_entries_not_validated_recently(stub, monkeypatch):
+    monkeypatch.setenv("HTTP_CACHE_MAX_AGE_DAYS", "7")
+    now = time.time()
+    add_cache_entry(f"{URL}?page=1", now - 8 * 86400)
+    add_cache_entry(f"{URL}?page=2", now - 6 * 86400)
+
+    fetch.evict_cache()
+
+    assert not is_cached(f"{URL}?page=1")
+    assert is_cached(f"{URL}?page=2")
+
+
+def test_evict_cache_removes_least_recently_validated_until_it_fits(stub, monkeypatch):
+    now = time.time()
+    urls = [f"{URL}?page={page}" for page in range(1, 5)]
+    for age, url in enumerate(urls):
+        add_cache_entry(url, now - age * 60, b"x" * 4000)
+    corrupt_url = f"{URL}?page=5"
+    add_cache_entry(corrupt_url, now)
+    fetch.write_file(fetch.get_cache_paths(corrupt_url)[1], b"{not json")
+    monkeypatch.setenv("HTTP_CACHE_MAX_MB", str(9000 / 1024 / 1024))
+
+    fetch.evict_cache()
+
+    assert [is_cached(url) for url in urls] == [True, True, False, False]
+    assert not is_cached(corrupt_url)
+
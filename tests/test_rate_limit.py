@@ -0,0 +1,111 @@
+""" Tests of the adaptive token bucket against a stubbed clock. """
+
+import pytest
+
+import rate_limit
+
+
+class Clock:
+    """ Clock whose time only moves when advanced or slept on. """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch):
+    """ Replaces the rate limiter's clock. """
+
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def make_bucket(rate: float = 2, burst: int = 3) -> rate_limit.AdaptiveTokenBucket:
+    """ Returns a bucket that can speed up to 4 requests per second and slow down to 0.5. """
+
+    return rate_limit.AdaptiveTokenBucket("history.stackexchange.com", rate=rate, burst=burst,
+                                          min_rate=0.5, max_rate=4, increase=0.25)
+
+
+def test_burst_is_free_then_tokens_come_at_rate(clock):
+    bucket = make_bucket()
+
+    assert [bucket.reserve() for _ in range(5)] == [0, 0, 0, 0.5, 1.0]
+
+
+def test_acquire_sleeps_until_token_is_available(clock):
+    bucket = make_bucket(burst=1)
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0.5
+    assert clock.slept == [0.5]
+    assert bucket.stats()['waited_seconds'] == 0.5
+
+
+def test_tokens_refill_up_to_burst(clock):
+    bucket = make_bucket()
+    for _ in range(3):
+        bucket.reserve()
+
+    clock.now += 10
+
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0, 0.5]
+
+
+def test_throttled_halves_rate_down_to_min_rate(clock):
+    bucket = make_bucket()
+
+    rates = []
+    for _ in range(3):
+        bucket.on_throttled()
+        rates.append(bucket.rate)
+
+    assert rates == [1.0, 0.5, 0.5]
+    assert bucket.stats()['throttled'] == 3
+
+
+def test_success_raises_rate_up_to_max_rate(clock):
+    bucket = make_bucket(rate=3.5)
+
+    rates = []
+    for _ in range(3):
+        bucket.on_success()
+        rates.append(bucket.rate)
+
+    assert rates == [3.75, 4, 4]
+
+
+def test_throttled_pause_holds_back_tokens(clock):
+    bucket = make_bucket()
+
+    bucket.on_throttled(pause=5)
+
+    assert bucket.reserve() == 5 + 1 / bucket.rate
+
+
+def test_no_tokens_are_earned_while_paused(clock):
+    bucket = make_bucket()
+    bucket.on_throttled(pause=5)
+
+    clock.now += 6
+
+    assert [bucket.reserve() for _ in range(2)] == [0, 1.0]
+
+
+def test_stats(clock):
+    bucket = make_bucket(burst=1)
+    bucket.acquire()
+    bucket.acquire()
+    bucket.on_throttled()
+
+    assert bucket.stats() == {'host': "history.stackexchange.com", 'rate': 1.0,
+                              'requests': 2, 'throttled': 1, 'waited_seconds': 0.5}
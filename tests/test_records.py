@@ -0,0 +1,54 @@
+""" Tests of count parsing and COPY encoding of record batches. """
+
+import re
+from datetime import datetime
+
+import pytest
+
+import records
+
+
+@pytest.mark.parametrize("count, expected", [
+    ("12", 12),
+    ("1.2k", 1200),
+    ("1,234", 1234),
+    ("-3", -3),
+    (" 3m ", 3000000),
+    ("2.5K", 2500),
+    (7, 7),
+])
+def test_parse_count(count, expected):
+    assert records.parse_count(count) == expected
+
+
+@pytest.mark.parametrize("count", ["", "k", "1.2x", "1.2.3", "twelve", "1 2"])
+def test_parse_count_rejects_malformed_counts(count):
+    with pytest.raises(ValueError):
+        records.parse_count(count)
+
+
+def test_to_copy_text_escapes_special_characters():
+    batch = records.ColumnBatch({'id': "q", 'text': None, 'at': None})
+    batch.append(1, "tab\there", datetime(2024, 3, 6, 0, 20, 33))
+    batch.append(2, "line\nbreak\r\nand \\ backslash", None)
+    batch.append(3, None, None)
+
+    assert batch.to_copy_text().read() == (
+        "1\ttab\\there\t2024-03-06 00:20:33\n"
+        "2\tline\\nbreak\\r\\nand \\\\ backslash\t\\N\n"
+        "3\t\\N\t\\N\n")
+
+
+def test_to_copy_text_round_trips_through_copy_rules():
+    """ Unescaping the COPY text gives the original values back, one row per line. """
+
+    values = ["a\tb", "c\nd", "e\\f", "plain"]
+    batch = records.ColumnBatch({'text': None})
+    for value in values:
+        batch.append(value)
+
+    lines = batch.to_copy_text().read().split("\n")[:-1]
+    unescape = {"\\t": "\t", "\\n": "\n", "\\r": "\r", "\\\\": "\\"}
+    decoded = [re.sub(r"\\[tnr\\]", lambda m: unescape[m.group(0)], line)
+               for line in lines]
+    assert decoded == values
@@ -0,0 +1,111 @@
+""" Tests of question summary extraction from listing pages. """
+
+from bs4 import BeautifulSoup
+
+import scrape
+
+SUMMARY = """
+<div id="question-summary-76363" class="s-post-summary    js-post-summary" data-post-id="76363">
+  <div class="s-post-summary--stats js-post-summary-stats">
+    <div class="s-post-summary--stats-item s-post-summary--stats-item__emphasized">
+      <span class="s-post-summary--stats-item-number">0</span>
+      <span class="s-post-summary--stats-item-unit">votes</span>
+    </div>
+    <div class="s-post-summary--stats-item  has-answers">
+      <span class="s-post-summary--stats-item-number">1</span>
+      <span class="s-post-summary--stats-item-unit">answers</span>
+    </div>
+    <div class="s-post-summary--stats-item ">
+      <span class="s-post-summary--stats-item-number">20</span>
+      <span class="s-post-summary--stats-item-unit">views</span>
+    </div>
+  </div>
+  <div class="s-post-summary--content">
+    <h3 class="s-post-summary--content-title">
+      <a href="/questions/76363/slug-76363" class="s-link">Was King Ferdinand tied to the Camorra?</a>
+    </h3>
+    <div class="s-post-summary--meta">
+      <ul class="ml0 list-ls-none js-post-tag-list-wrapper d-inline">
+        <li class="d-inline mr4 js-post-tag-list-item"><a class="post-tag">italy</a></li>
+        <li class="d-inline mr4 js-post-tag-list-item"><a class="post-tag">crime</a></li>
+      </ul>
+      <div class="s-user-card s-user-card__minimal">
+        <div class="s-user-card--info">
+          <div class="s-user-card--link d-flex gs4">
+            <a href="/users/1/u" class="flex--item">Andrea Korompis</a>
+          </div>
+        </div>
+        {time}
+      </div>
+    </div>
+  </div>
+</div>
+"""
+
+ASKED = ('<time class="s-user-card--time">asked '
+         '<span title="2024-03-06 00:20:33Z" class="relativetime">3 mins ago</span></time>')
+
+
+def get_summary(time: str) -> dict:
+    """ Returns the summary extracted from SUMMARY with the given time element. """
+
+    html = SUMMARY.replace("{time}", time)
+    question = BeautifulSoup(html, "html.parser").find("div", class_="s-post-summary")
+    return scrape.extract_question_summary(question)
+
+
+def test_summary_without_time_element_matches_baseline():
+    """ The baseline parser gave no timestamp, and the other fields as usual, for a
+        summary without an s-user-card--time element. """
+
+    summary = get_summary("")
+
+    assert summary['timestamp'] is None
+    assert summary['last_activity'] is None
+    assert {key: summary[key] for key in
+            ('question_id', 'title', 'tags', 'votes', 'views', 'username')} == {
+        'question_id': 76363,
+        'title': "Was King Ferdinand tied to the Camorra?",
+        'tags': ["italy", "crime"],
+        'votes': 0,
+        'views': 20,
+        'username': "Andrea Korompis",
+    }
+
+
+def test_summary_with_asked_time():
+    summary = get_summary(ASKED)
+
+    assert summary['timestamp'] == scrape.format_timestamp("2024-03-06 00:20:33Z")
+    assert summary['last_activity'] == summary['timestamp']
+    assert summary['answer_count'] == 1
+
+
+def get_listed(**fields) -> dict:
+    """ Returns a listing summary of question 1, with the given fields changed. """
+
+    return {'question_id': 1, 'answer_count': 2, 'votes': 5, 'views': 100,
+            'last_activity': scrape.format_timestamp("2024-03-06 00:20:33Z"), **fields}
+
+
+STORED = {1: (2, scrape.format_timestamp("2024-03-06 00:20:33Z"), 5, 100)}
+
+
+def test_unchanged_question_is_skipped():
+    """ The stored count is the listing's, so an answer the scraper does not keep, such
+        as an accepted answer, does not make the question look changed. """
+
+    assert not scrape.has_question_changed(get_listed(), STORED)
+
+
+def test_changed_question_is_fetched():
+    assert scrape.has_question_changed(get_listed(answer_count=3), STORED)
+    assert scrape.has_question_changed(get_listed(votes=6), STORED)
+    assert scrape.has_question_changed(get_listed(views=101), STORED)
+    assert scrape.has_question_changed(
+        get_listed(last_activity=scrape.format_timestamp("2024-03-07 00:00:00Z")), STORED)
+    assert scrape.has_question_changed(get_listed(question_id=2), STORED)
+
+
+def test_question_without_answers_is_skipped():
+    assert not scrape.has_question_changed(get_listed(answer_count=0, question_id=2), STORED)
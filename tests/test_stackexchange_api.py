@@ -0,0 +1,112 @@
+""" Tests of the Stack Exchange API answer source against the offline API stub. """
+
+import json
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import records
+import stackexchange_api
+import stackexchange_api_stub
+
+QUESTION_COUNT = 150
+PAGED_QUESTION_ID = 1005
+
+
+def get_stored_question(question_id: int) -> dict:
+    """ Returns a question as stored in data.json, with one answer, or five for
+        PAGED_QUESTION_ID so the first batch runs over one page of results. """
+
+    answer_count = 5 if question_id == PAGED_QUESTION_ID else 1
+    return {'question_id': question_id, 'site': "history",
+            'answers': [{'answer_id': question_id * 10 + n,
+                         'answer': f"Answer {n} & more",
+                         'username': "O'Brien",
+                         'vote_count': n - 1,
+                         'timestamp': "2024-03-06 00:20:33" if n == 1 else None}
+                        for n in range(1, answer_count + 1)]}
+
+
+@pytest.fixture(name="stub")
+def fixture_stub(tmp_path, monkeypatch):
+    """ Starts the API stub on an ephemeral port, points SE_API_URL at it and records
+        the paths it is asked for and the backoffs the client sleeps for. """
+
+    data = tmp_path / "data.json"
+    data.write_text(json.dumps([get_stored_question(1000 + n) for n in range(QUESTION_COUNT)]),
+                    encoding="utf-8")
+    paths = []
+
+    class RecordingHandler(stackexchange_api_stub.make_handler(
+            stackexchange_api_stub.load_answers(data), backoff=2)):
+        """ Records each requested path before answering it. """
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            paths.append(self.path)
+            super().do_GET()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    sleeps = []
+    monkeypatch.setenv("SE_API_URL", f"http://127.0.0.1:{server.server_port}/2.3/")
+    monkeypatch.delenv("SE_API_FILTER", raising=False)
+    monkeypatch.delenv("SE_API_KEY", raising=False)
+    monkeypatch.setenv("HTTP_RATE", "100")
+    monkeypatch.setenv("HTTP_BURST", "100")
+    monkeypatch.setattr(stackexchange_api, "time", SimpleNamespace(sleep=sleeps.append))
+    stackexchange_api.get_answer_filter.cache_clear()
+
+    yield SimpleNamespace(paths=paths, sleeps=sleeps)
+
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    stackexchange_api.get_answer_filter.cache_clear()
+
+
+def test_get_answers_batches_and_pages(stub):
+    question_ids = [1000 + n for n in range(QUESTION_COUNT)]
+    answers = stackexchange_api.get_answers(question_ids, "history")
+
+    answer_paths = [path for path in stub.paths if "/answers?" in path]
+    batches = [path.split("/")[3] for path in answer_paths]
+    assert stub.paths[0].startswith("/2.3/filters/create?")
+    assert batches == [";".join(map(str, question_ids[:100]))] * 2 \
+        + [";".join(map(str, question_ids[100:]))]
+    assert [parse_qs(urlsplit(path).query)["page"] for path in answer_paths] \
+        == [["1"], ["2"], ["1"]]
+    assert all("filter=stub" in path and "site=history" in path for path in answer_paths)
+
+    assert sorted(answers) == question_ids
+    assert len(answers[PAGED_QUESTION_ID]) == 5
+    assert sum(map(len, answers.values())) == QUESTION_COUNT + 4
+
+
+def test_get_answers_honours_backoff(stub):
+    stackexchange_api.get_answers([1000, 1001], "history")
+
+    assert len([path for path in stub.paths if "/answers?" in path]) == 1
+    assert stub.sleeps == [2]
+
+
+def test_get_answers_maps_fields(stub):
+    answers = stackexchange_api.get_answers([1000], "history")
+
+    assert answers == {1000: [records.Answer(answer_id=10001,
+                                             answer="Answer 1 & more",
+                                             username="O'Brien",
+                                             vote_count=0,
+                                             timestamp=datetime(2024, 3, 6, 0, 20, 33))]}
+
+
+def test_get_answers_keeps_questions_without_answers(stub):
+    answers = stackexchange_api.get_answers([1000, 999], "history")
+
+    assert answers[999] == []
+    assert [answer.answer_id for answer in answers[1000]] == [10001]